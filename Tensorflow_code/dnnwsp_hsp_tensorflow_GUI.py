@@ -6,14 +6,43 @@
 import tensorflow as tf
 # The fundamental package for scientific computing with Python.
 import numpy as np
-# Linear algebra module for calculating L1 and L2 norm  
-from numpy import linalg as LA
 # To plot the results
 import matplotlib.pyplot as plt
 # To check the directory when saving the results
 import os.path
 # The module for file input and output
 import scipy.io as sio
+# To import the shared dnnwsp modules from the root of the repository
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+# Weight sparsity control of all hidden layers with one beta buffer
+from dnnwsp.sparsity import SparsityControl
+# How often (and in which thread) the weight sparsity control runs
+from dnnwsp.schedule import HspSchedule
+# Memory-mapped datasets (a directory made by python -m dnnwsp.dataset) or .mat files
+from dnnwsp.dataset import load_dataset
+# float32 inputs and vectorized one-hot labels
+from dnnwsp.prepare import prepare_classification
+# Storage and compute dtypes of the samples, weights, optimizer state and sparsity control, with a dtype audit
+from dnnwsp.precision import PrecisionPolicy
+# Cache of the preprocessed inputs, keyed by the content of the data file
+from dnnwsp.cache import PreprocessCache
+# Evaluation of whole data sets in chunks, running mean of the training minibatches
+from dnnwsp.evaluation import evaluate, RunningMean
+# Minibatches gathered from a shuffled index into one reusable buffer
+from dnnwsp.batching import BatchGatherer
+# tf.data input pipeline (shuffled minibatches gathered and prefetched while the graph runs)
+from dnnwsp.pipeline import InputPipeline
+# Out-of-core training on a shard directory (chunked shuffle, shards read in the background)
+from dnnwsp.streaming import ShardStream
+# Several training steps in one session call (tf.while_loop over the training set kept in the graph)
+from dnnwsp.multistep import MultiStepLoop
+# Data-parallel training (worker processes compute the gradients of the shards of each minibatch in NumPy)
+from dnnwsp.parallel import DataParallelMLP
+# Projection of the voxels onto fewer features (PCA, randomized SVD or sparse random projection) fitted on the training set
+from dnnwsp.projection import InputProjection, project_datasets
+# Early stopping once Hoyer's sparsness and beta have converged
+from dnnwsp.stopping import EarlyStopping
 
 
 ################################################# Parameters #################################################
@@ -23,11 +52,46 @@ from customizationGUI \
         import mode, optimizer_algorithm, momtentum, nodes, n_epochs, batch_size,\
         beginAnneal, decay_rate, lr_init, lr_min, beta_lrates, L2_reg, max_beta, tg_hspset
     
+# Run Hoyer's sparsity control inside the graph together with the optimizer step
+hsp_in_graph = True
+# Recompute beta after every minibatch, in the training thread
+hsp_every = 1
+hsp_async = False
+# Shuffle, gather and prefetch the minibatches in a tf.data input pipeline instead of feed_dict
+input_pipeline = True
+# Train on a shard directory streamed from disk (python -m dnnwsp.streaming) instead of train_x, or None
+stream_data = None
+stream_buffer = 2000
+# Cache the float32 samples and one-hot labels on local disk (~/.cache/dnnwsp) and memory-map them in the next runs
+preprocess_cache = False
+# Precision policy : 'float32' everywhere, or 'float16' samples upcast to float32 minibatch by minibatch (dtype audit)
+precision = 'float32'
+# Evaluate the whole sets in chunks of eval_chunk samples; train_error 'full' (whole training set after the epoch)
+# or 'minibatch' (mean error of the training minibatches, no extra pass)
+eval_chunk = 256
+train_error = 'full'
+# One session call per minibatch (None), per epoch ('epoch') or per k minibatches (k) in a tf.while_loop
+multistep = None
+# Number of worker processes computing the gradients of the shards of every minibatch (0 : the session trains)
+parallel_workers = 0
+# Momentum entered in the GUI (used by the data-parallel training)
+momentum = momtentum
+# Project the voxels onto projection_components features ('pca', 'randomized_svd' or 'sparse_random') fitted on train_x, or None
+projection = None
+projection_components = 200
+# End training after early_stopping epochs without a decrease of the cost, once Hoyer's sparsness is within hsp_tol of tg_hspset
+# and beta moved by at most beta_tol (the weights of the lowest cost are restored), or 0 to train n_epochs
+early_stopping = 0
+hsp_tol = 0.05
+beta_tol = 0.01
+
 
 ################################################# Input data ############### ##################################
 
 
-datasets = sio.loadmat('lhrhadvs_sample_data.mat')
+# a dataset directory converted from the .mat file (python -m dnnwsp.dataset lhrhadvs_sample_data.mat lhrhadvs_sample_data)
+# is memory-mapped in float32 instead of being read into RAM in float64
+data_file = 'lhrhadvs_sample_data.mat'
 
 ################ lhrhadvs_sample_data.mat ##################
 # train_x  = 240 volumes x 74484 voxels  
@@ -37,18 +101,34 @@ datasets = sio.loadmat('lhrhadvs_sample_data.mat')
 ############################################################
 
 
-train_x = datasets['train_x']
-train_y = np.zeros((np.shape(datasets['train_y'])[0],np.max(datasets['train_y'])+1))
-# transform into One-hot
-for i in np.arange(np.shape(datasets['train_y'])[0]):
-    train_y[i][datasets['train_y'][i][0]]=1 
+# convert the inputs to the storage dtype of the precision policy once (float32 : the placeholders are float32, so nothing
+# is converted when feeding) and transform the labels into One-hot (float32, as many classes as output nodes)
+precision_policy = PrecisionPolicy(precision)
+if preprocess_cache==True:
+    datasets = PreprocessCache().load(data_file, {'prepare':'classification', 'n_classes':nodes[-1], 'dtype':precision_policy.storage_dtype.name},
+                                      lambda: prepare_classification(load_dataset(data_file), nodes[-1], dtype=precision_policy.storage_dtype))
+else:
+    datasets = prepare_classification(load_dataset(data_file), nodes[-1], dtype=precision_policy.storage_dtype)
+
+# the projection is fitted on train_x only, the projected samples are kept in the storage dtype
+if (projection is not None) and (stream_data is None):
+    [datasets, input_projection] = project_datasets(datasets, InputProjection(projection, projection_components),
+                                                    dtype=precision_policy.storage_dtype, cache=PreprocessCache() if preprocess_cache==True else None,
+                                                    sources=data_file, params={'prepare':'classification', 'n_classes':nodes[-1]})
+    nodes[0] = projection_components
+if precision_policy.name != 'float32':
+    print(precision_policy.describe(train_x=datasets['train_x'], test_x=datasets['test_x']))
+
+if stream_data is None:
+    train_x = datasets['train_x']
+    train_y = datasets['train_y']
+else:
+    # the training set is read shard by shard in every epoch (float32 samples and one-hot labels)
+    train_stream = ShardStream(stream_data, batch_size, stream_buffer, n_classes=nodes[-1])
 
 
 test_x = datasets['test_x']
-test_y = np.zeros((np.shape(datasets['test_y'])[0],np.max(datasets['test_y'])+1))
-# transform into One-hot
-for i in np.arange(np.shape(datasets['test_y'])[0]):
-    test_y[i][datasets['test_y'][i][0]]=1 
+test_y = datasets['test_y']
 
 
 ################################################# Build Model #################################################
@@ -58,8 +138,13 @@ for i in np.arange(np.shape(datasets['test_y'])[0]):
 nodes_index= [int(np.sum(nodes[1:i+1])) for i in np.arange(np.shape(nodes)[0]-1)]
 
 # Make two placeholders to fill the values later when training or testing
-X=tf.placeholder(tf.float32,[None,nodes[0]])
-Y=tf.placeholder(tf.float32,[None,nodes[-1]])
+# (with the input pipeline they default to the next prefetched minibatch when they are not fed)
+if input_pipeline==True:
+    pipeline = InputPipeline(nodes[0], nodes[-1], batch_size)
+    X, Y = pipeline.X, pipeline.Y
+else:
+    X=tf.placeholder(tf.float32,[None,nodes[0]])
+    Y=tf.placeholder(tf.float32,[None,nodes[-1]])
 
 # Create randomly initialized weight variables 
 w_init=[tf.div(tf.random_normal([nodes[i],nodes[i+1]]), tf.sqrt(float(nodes[i])/2)) for i in np.arange(np.shape(nodes)[0]-1)]
@@ -68,21 +153,28 @@ w=[tf.Variable(w_init[i], dtype=tf.float32) for i in np.arange(np.shape(nodes)[0
 b=[tf.Variable(tf.random_normal([nodes[i+1]]), dtype=tf.float32) for i in np.arange(np.shape(nodes)[0]-1)]
 
 # Build MLP model 
-hidden_layers=[0.0]*(np.shape(nodes)[0]-2)
-for i in np.arange(np.shape(nodes)[0]-2):
-    # Input layer
-    if i==0:
-        hidden_layers[i]=tf.add(tf.matmul(X,w[i]),b[i])
-        hidden_layers[i]=tf.nn.tanh(hidden_layers[i])
-    # The other layers    
-    else:     
-        hidden_layers[i]=tf.add(tf.matmul(hidden_layers[i-1],w[i]),b[i])
-        hidden_layers[i]=tf.nn.tanh(hidden_layers[i])
-# Output layer
-output_layer=tf.add(tf.matmul(hidden_layers[-1],w[-1]),b[-1])
-
-# Logistic regression layer
-logRegression_layer=tf.nn.tanh(output_layer)
+# (a function of the weights, to build the same model again inside the multi-step training loop)
+def init_model(X, w, b):
+    hidden_layers=[0.0]*(np.shape(nodes)[0]-2)
+    for i in np.arange(np.shape(nodes)[0]-2):
+        # Input layer
+        if i==0:
+            hidden_layers[i]=tf.add(tf.matmul(X,w[i]),b[i])
+            hidden_layers[i]=tf.nn.tanh(hidden_layers[i])
+        # The other layers    
+        else:     
+            hidden_layers[i]=tf.add(tf.matmul(hidden_layers[i-1],w[i]),b[i])
+            hidden_layers[i]=tf.nn.tanh(hidden_layers[i])
+    # Output layer
+    output_layer=tf.add(tf.matmul(hidden_layers[-1],w[-1]),b[-1])
+    
+    # Logistic regression layer
+    logRegression_layer=tf.nn.tanh(output_layer)
+    
+    return logRegression_layer
+
+
+logRegression_layer=init_model(X, w, b)
                     
 
 
@@ -93,28 +185,35 @@ logRegression_layer=tf.nn.tanh(output_layer)
 def init_beta():
     if mode=='layer':
         # The size is same with the number of layers
-        Beta=tf.placeholder(tf.float32,[np.shape(nodes)[0]-2])
+        beta_shape=[np.shape(nodes)[0]-2]
     elif mode=='node':
         # The size is same with the number of nodes
-        Beta=tf.placeholder(tf.float32,[np.sum(nodes[1:-1])])
+        beta_shape=[np.sum(nodes[1:-1])]
+        
+    if hsp_in_graph==True:
+        # Beta lives in the graph, so it must not be trained by the optimizer
+        Beta=tf.Variable(tf.zeros(beta_shape), trainable=False, dtype=tf.float32)
+    else:
+        Beta=tf.placeholder(tf.float32,beta_shape)
 
     return Beta
 
 
 # Make L1 loss term for regularization
-def init_L1():
+def init_L1(w, Beta):
     if mode=='layer':
         # Get L1 loss term by simply multiplying beta(scalar value) and L1 norm of weight for each layer
         L1=[Beta[i]*tf.reduce_sum(abs(w[i])) for i in np.arange(np.shape(nodes)[0]-2)]
     elif mode=='node':
         # Get L1 loss term by multiplying beta(vector values as many as nodes) and L1 norm of weight for each layer
-        L1=[tf.reduce_sum(tf.matmul(abs(w[i]),tf.cast(tf.diag(Beta[nodes_index[i]:nodes_index[i+1]]),tf.float32))) for i in np.arange(np.shape(nodes)[0]-2)]
+        # Each column (node) of |w| is scaled by its beta through broadcasting, which gives the same value as |w| x diag(beta)
+        L1=[tf.reduce_sum(abs(w[i])*Beta[nodes_index[i]:nodes_index[i+1]]) for i in np.arange(np.shape(nodes)[0]-2)]
         
     return L1
 
 
 # Make L2 loss term for regularization
-def init_L2():
+def init_L2(w):
     L2=[tf.reduce_sum(tf.square(w[i])) for i in np.arange(np.shape(nodes)[0]-1)] 
     
     
@@ -124,7 +223,7 @@ def init_L2():
        
 
 # Define cost term (Cost = cross entropy + L1 term + L2 term )    
-def init_cost():
+def init_cost(logRegression_layer, Y, L1, L2):
 
     # A softmax regression : it adds up the evidence of our input being in certain classes, and converts that evidence into probabilities.
     cost=tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(logits=logRegression_layer, labels=Y)) \
@@ -134,35 +233,115 @@ def init_cost():
 
 
 # TensorFlow provides optimizers that slowly change each variable in order to minimize the loss function.
+# (the optimizer object is kept, the multi-step training loop applies its gradients with the same slots)
 def init_optimizer(Lr):
     if optimizer_algorithm=='GradientDescent':
-        optimizer=tf.train.GradientDescentOptimizer(Lr).minimize(cost) 
+        opt=tf.train.GradientDescentOptimizer(Lr)
     elif optimizer_algorithm=='Adagrad':
-        optimizer=tf.train.AdagradOptimizer(Lr).minimize(cost) 
+        opt=tf.train.AdagradOptimizer(Lr)
     elif optimizer_algorithm=='Adam':
-        optimizer=tf.train.AdamOptimizer(Lr).minimize(cost) 
+        opt=tf.train.AdamOptimizer(Lr)
     elif optimizer_algorithm=='Momentum':
-        optimizer=tf.train.MomentumOptimizer(Lr).minimize(cost) 
+        opt=tf.train.MomentumOptimizer(Lr)
     elif optimizer_algorithm=='RMSProp':
-        optimizer=tf.train.RMSPropOptimizer(Lr).minimize(cost) 
+        opt=tf.train.RMSPropOptimizer(Lr)
+
+    return opt
+
 
-    return optimizer
+# Weight sparsity control with Hoyer's sparsness inside the graph (after the training step train_op)
+def init_hsp_control(train_op):
+    hsp_list=[]
+    beta_list=[]
+    
+    # Read the weights only after the optimizer step, as the NumPy version does
+    with tf.control_dependencies([train_op]):
+        beta_old=Beta.read_value()
+        for i in np.arange(np.shape(nodes)[0]-2):
+            W=w[i].read_value()
+            
+            if mode=='layer':
+                # Calculate L1 and L2 norm over the whole weight matrix
+                sqrt_nsamps=np.sqrt(nodes[i]*nodes[i+1])
+                L1norm=tf.reduce_sum(tf.abs(W))
+                L2norm=tf.sqrt(tf.reduce_sum(tf.square(W)))
+                b_old=beta_old[i]
+            elif mode=='node':
+                # Calculate L1 and L2 norm of each column
+                sqrt_nsamps=np.sqrt(nodes[i])
+                L1norm=tf.reduce_sum(tf.abs(W),axis=0)
+                L2norm=tf.sqrt(tf.reduce_sum(tf.square(W),axis=0))
+                b_old=beta_old[nodes_index[i]:nodes_index[i+1]]
+            
+            # Calculate hoyer's sparsness
+            h=(sqrt_nsamps-(L1norm/L2norm))/(sqrt_nsamps-1)
+            
+            # Update beta and trim value
+            b_new=b_old-beta_lrates*tf.sign(h-tg_hspset[i])
+            b_new=tf.clip_by_value(b_new,0.0,max_beta[i])
+            
+            hsp_list.append(h)
+            beta_list.append(b_new)
+            
+        if mode=='layer':
+            hsp_update=tf.group(tf.assign(Hsp,tf.stack(hsp_list)), tf.assign(Beta,tf.stack(beta_list)))
+        elif mode=='node':
+            hsp_update=tf.group(tf.assign(Hsp,tf.concat(hsp_list,0)), tf.assign(Beta,tf.concat(beta_list,0)))
+    
+    return hsp_update
+
+
+# One training step of the multi-step training loop on the minibatch x, y (batch-th minibatch of the epoch)
+def init_multistep_train(x, y, epoch, batch):
+    # Begin Annealing at the beginning of the epoch, as the minibatch loop does
+    if beginAnneal == 0:
+        lr_step=Lr.read_value()
+    else:
+        anneal=tf.logical_and(tf.equal(batch,0), epoch+1 > beginAnneal)
+        lr_step=tf.cond(anneal, lambda: tf.identity(tf.assign(Lr, tf.maximum(lr_min, \
+                        (-decay_rate*tf.cast(epoch+1,tf.float32) + (1+decay_rate*beginAnneal)) * Lr.read_value()))),
+                        lambda: Lr.read_value())
+    
+    # Read the variables in this step (the ones used outside the loop are read once per session call)
+    with tf.control_dependencies([lr_step]):
+        w_step=[w[i].read_value() for i in np.arange(np.shape(nodes)[0]-1)]
+        b_step=[b[i].read_value() for i in np.arange(np.shape(nodes)[0]-1)]
+        beta_step=Beta.read_value()
+    
+    output_step=init_model(x, w_step, b_step)
+    cost_step=init_cost(output_step, y, init_L1(w_step, beta_step), init_L2(w_step))
+    error_step=1-tf.reduce_mean(tf.cast(tf.equal(tf.argmax(output_step,1),tf.argmax(y,1)),tf.float32))
+    
+    # The same optimizer (and slots) as the minibatch loop, with the annealed learning rate
+    with tf.control_dependencies([lr_step]):
+        train_step=opt.apply_gradients(opt.compute_gradients(cost_step, var_list=w+b))
+    
+    # Weight sparsity control every hsp_every steps or after the last minibatch of the epoch
+    if hsp_every=='epoch':
+        hsp_due=tf.equal(batch, train_loop.n_batches-1)
+    else:
+        hsp_due=tf.equal((epoch*train_loop.n_batches+batch+1)%hsp_every, 0)
+        
+    def hsp_step():
+        with tf.control_dependencies([init_hsp_control(train_step)]):
+            return tf.constant(True)
+    def no_hsp_step():
+        with tf.control_dependencies([train_step]):
+            return tf.constant(False)
+    hsp_done=tf.cond(hsp_due, hsp_step, no_hsp_step)
+    
+    with tf.control_dependencies([hsp_done]):
+        return [cost_step, error_step, Lr.read_value(), Hsp.read_value(), Beta.read_value()]
 
 
 
 # initialization   
 def init_otherVariables():           
     if mode=='layer': 
-        beta_val = np.zeros(np.shape(nodes)[0]-2)
-        beta = np.zeros(np.shape(nodes)[0]-2)
-        hsp_val = np.zeros(np.shape(nodes)[0]-2)            
         result_beta = np.zeros(np.shape(nodes)[0]-2)
         result_hsp = np.zeros(np.shape(nodes)[0]-2)
                    
     elif mode=='node':                       
-        beta_val = [np.zeros(nodes[i+1]) for i in np.arange(np.shape(nodes)[0]-2)]  
-        beta = np.zeros(np.sum(nodes[1:-1]))
-        hsp_val = [np.zeros(nodes[i+1]) for i in np.arange(np.shape(nodes)[0]-2)]            
         result_beta = [np.zeros(nodes[i+1]) for i in np.arange(np.shape(nodes)[0]-2)]
         result_hsp = [np.zeros(nodes[i+1]) for i in np.arange(np.shape(nodes)[0]-2)]
     
@@ -173,7 +352,7 @@ def init_otherVariables():
     result_test_err=np.zeros(1)
       
     
-    return beta_val, beta, hsp_val, result_beta, result_hsp, result_lr, result_cost, result_train_err, result_test_err
+    return result_beta, result_hsp, result_lr, result_cost, result_train_err, result_test_err
         
 
 
@@ -183,15 +362,33 @@ def init_otherVariables():
 lr = lr_init 
     
 # Make a placeholder to be able to update learning rate (Learning rate decaying) 
-Lr=tf.placeholder(tf.float32)
+# (the multi-step training loop anneals it in the graph, it is a resource variable read again in every step)
+if multistep is None:
+    Lr=tf.placeholder(tf.float32)
+else:
+    Lr=tf.get_variable('Lr', initializer=tf.constant(lr_init,tf.float32), trainable=False, use_resource=True)
 
 
 Beta = init_beta()
-L1 = init_L1()
-L2 = init_L2()
-cost = init_cost()
+L1 = init_L1(w, Beta)
+L2 = init_L2(w)
+cost = init_cost(logRegression_layer, Y, L1, L2)
+
+opt=init_optimizer(Lr)
+optimizer=opt.minimize(cost)
 
-optimizer=init_optimizer(Lr)
+if hsp_in_graph==True:
+    # Hoyer's sparsness of every layer (or every node), kept to plot the results
+    Hsp=tf.Variable(tf.zeros(Beta.get_shape()), trainable=False, dtype=tf.float32)
+    
+    # One session call runs the optimizer step and the weight sparsity control together
+    hsp_update = init_hsp_control(optimizer)
+
+if (multistep is not None) & (hsp_in_graph==True):
+    # n_steps training steps (shuffling, annealing, optimizer step and sparsity control) in one session call,
+    # returns the cost, error, learning rate, Hoyer's sparsness and beta of every step
+    train_loop = MultiStepLoop(nodes[0], nodes[-1], batch_size, tf.as_dtype(precision_policy.storage_dtype))
+    step_cost, step_err, step_lr, step_hsp, step_beta = train_loop.build(init_multistep_train, [tf.float32]*5)
 
  
 correct_prediction=tf.equal(tf.argmax(logRegression_layer,1),tf.argmax(Y,1))  
@@ -199,72 +396,12 @@ correct_prediction=tf.equal(tf.argmax(logRegression_layer,1),tf.argmax(Y,1))
 error=1-tf.reduce_mean(tf.cast(correct_prediction,tf.float32))      
 
 
-beta_val, beta, hsp_val, result_beta, result_hsp, result_lr, result_cost, result_train_err, result_test_err = init_otherVariables()
+result_beta, result_hsp, result_lr, result_cost, result_train_err, result_test_err = init_otherVariables()
 
 
 
 
 
-if mode=='layer':
-    # Weight sparsity control with Hoyer's sparsness (Layer wise)  
-    def Hoyers_sparsity_control(w_,b,max_b,tg):
-        
-        # Get value of weight
-        W=sess.run(w_)
-        [nodes,dim]=W.shape  
-        
-        # vectorize weight matrix 
-        Wvec=W.flatten()     
-        sqrt_nsamps=np.sqrt(Wvec.shape[0])
-        
-        # Calculate L1 and L2 norm     
-        L1norm=LA.norm(Wvec,1)
-        L2norm=LA.norm(Wvec,2)
-        
-        # Calculate hoyer's sparsness
-        h=(sqrt_nsamps-(L1norm/L2norm))/(sqrt_nsamps-1)
-        
-        # Update beta
-        b-=beta_lrates*np.sign(h-tg)
-        
-        # Trim value
-        b=0.0 if b<0.0 else b
-        b=max_b if b>max_b else b
-                         
-        return [h,b]
-    
-    
-elif mode=='node':   
-    # Weight sparsity control with Hoyer's sparsness (Node wise)
-    def Hoyers_sparsity_control(w_,b_vec,max_b,tg):
-    
-        # Get value of weight
-        W=sess.run(w_)
-        [nodes,dim]=W.shape
-        sqrt_nsamps=np.sqrt(nodes)
-        
-        # Calculate L1 and L2 norm 
-        L1norm=LA.norm(W,1,axis=0)
-        L2norm=LA.norm(W,2,axis=0)
-     
-        # Calculate hoyer's sparsness
-        h_vec = np.zeros((1,dim))
-        h_vec=(sqrt_nsamps-(L1norm/L2norm))/(sqrt_nsamps-1)
-        
-        tg_vec = np.ones(dim)*tg
-        # Update beta       
-        b_vec-=beta_lrates*np.sign(h_vec-tg_vec)
-        
-        # Trim value
-        b_vec[b_vec<0.0]=0.0
-        b_vec[b_vec>max_b]=max_b
-        
-               
-        return [h_vec,b_vec]
-    
-
-
-
 ############################################# Condition check #############################################
 
 condition=False
@@ -277,12 +414,38 @@ elif (np.size(nodes)-2) != np.size(max_beta):
     print("Error : The number of hidden layers and max beta values don't match. ")
 elif (np.size(nodes)-2) != np.size(tg_hspset):
     print("Error : The number of hidden layers and target sparsity values don't match.")
-elif np.size(train_x,axis=0) != np.size(train_y,axis=0):
+elif (stream_data is None) and (np.size(train_x,axis=0) != np.size(train_y,axis=0)):
     print("Error : The sizes of input train datasets and output train datasets don't match. ")  
 elif np.size(test_x,axis=0) != np.size(test_y,axis=0):
     print("Error : The sizes of input test datasets and output test datasets don't match. ")     
 elif (np.any(np.array(tg_hspset)<0)) | (np.any(np.array(tg_hspset)>1)):  
     print("Error : The values of target sparsities are inappropriate.")
+elif train_error not in ['full', 'minibatch']:
+    print("Error : train_error should be 'full' or 'minibatch'.")
+elif (hsp_async==True) & (hsp_in_graph==True):
+    print("Error : The asynchronous sparsity control needs hsp_in_graph = False.")
+elif (stream_data is None) and (len(precision_policy.mismatches({'train_x':train_x, 'test_x':test_x}, train_y=train_y, test_y=test_y)) > 0):
+    print("Error : The datasets don't follow the precision policy :", precision_policy.mismatches({'train_x':train_x, 'test_x':test_x}, train_y=train_y, test_y=test_y))
+elif len(precision_policy.mismatches(cost=cost, error=error, **{v.op.name:v for v in tf.global_variables()})) > 0:
+    print("Error : The graph doesn't follow the precision policy :", precision_policy.mismatches(cost=cost, error=error, **{v.op.name:v for v in tf.global_variables()}))
+elif (stream_data is not None) and (train_stream.n_features != nodes[0]):
+    print("Error : The number of input nodes and the features of the shards don't match.")
+elif (multistep is not None) and (multistep != 'epoch') and ((int(multistep) != multistep) or (multistep < 1)):
+    print("Error : multistep should be None, 'epoch' or a positive number of minibatches.")
+elif (multistep is not None) & (hsp_in_graph==False):
+    print("Error : The multi-step training needs hsp_in_graph = True.")
+elif (multistep is not None) & (stream_data is not None):
+    print("Error : The multi-step training keeps the training set in the graph, it can't be streamed from disk.")
+elif (parallel_workers > 0) & (hsp_in_graph==True):
+    print("Error : The data-parallel training needs hsp_in_graph = False.")
+elif (parallel_workers > 0) and (optimizer_algorithm not in ['GradientDescent', 'Momentum']):
+    print("Error : The data-parallel training supports the 'GradientDescent' and 'Momentum' optimizers.")
+elif (parallel_workers > 0) and ((input_pipeline==True) or (stream_data is not None) or (multistep is not None)):
+    print("Error : The data-parallel training gathers the minibatches in the workers, it needs input_pipeline = False, stream_data = None and multistep = None.")
+elif (projection is not None) and (stream_data is not None):
+    print("Error : The input projection is fitted on train_x, it needs stream_data = None.")
+elif early_stopping < 0:
+    print("Error : early_stopping should be 0 or a number of epochs.")
 else:
     condition=True
 
@@ -296,6 +459,23 @@ if condition==True:
     # variables are not initialized when you call tf.Variable
     # To initialize all the variables in a TensorFlow program, you must explicitly call a special operation         
     init = tf.global_variables_initializer()              
+    
+    # Beta and Hoyer's sparsness of every hidden layer (sparsity.beta is the whole beta array fed to the graph,
+    # sparsity.layer_beta[i] and sparsity.layer_hsp[i] are the parts of the i-th hidden layer)
+    sparsity = SparsityControl(nodes[1:-1], tg_hspset, max_beta, beta_lrates, nodewise=(mode=='node'), dtype=precision_policy.compute_dtype)
+    
+    # when to recompute beta
+    hsp_schedule = HspSchedule(hsp_every, hsp_async)
+    result_beta_lag = np.zeros(1)
+    
+    # cost, learning rate, Hoyer's sparsness and beta of every step of the multi-step training
+    result_step_cost = np.zeros(0)
+    result_step_lr = np.zeros(0)
+    result_step_hsp = np.zeros((0,int(Beta.get_shape()[0])))
+    result_step_beta = np.zeros((0,int(Beta.get_shape()[0])))
+    
+    # stop on the training cost once the sparsity has converged
+    stopping = EarlyStopping(early_stopping, tg_hsp=tg_hspset, hsp_tol=hsp_tol, beta_tol=beta_tol) if early_stopping > 0 else None
      
 
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True, log_device_placement=True)) as sess:           
@@ -303,62 +483,134 @@ if condition==True:
         # run tensorflow variable initialization
         sess.run(init)
         
+        # the training set is never copied, the minibatches are gathered from a shuffled index
+        # (in the graph by the input pipeline, or into a batch buffer fed through feed_dict)
+        # (or copied once into the graph for the multi-step training)
+        if stream_data is not None:
+            total_batch = train_stream.n_batches
+        elif multistep is not None:
+            total_batch = train_loop.start(sess, train_x, train_y)
+        elif parallel_workers > 0:
+            # the worker processes start from the initial weights of the graph (tanh output layer with softmax cross entropy)
+            trainer = DataParallelMLP(parallel_workers, nodes, batch_size, 'tanh', 'tanh_softmax', 'Grad', int(mode=='node'), L2_reg,
+                                      list(zip(*sess.run([w, b]))))
+            total_batch = trainer.start(train_x, np.argmax(train_y,axis=1), sparsity.sizes)
+            parallel_momentum = float(momentum) if optimizer_algorithm=='Momentum' else 0.0
+        elif input_pipeline==True:
+            total_batch = pipeline.start(sess, train_x, train_y)
+        else:
+            # (float16 samples are upcast to float32 in the batch buffer)
+            batches = BatchGatherer([train_x, train_y], batch_size, dtypes=[precision_policy.compute_dtype, train_y.dtype])
+            total_batch = batches.n_batches
 
         # Start training 
         for epoch in np.arange(n_epochs):            
                    
-            # Shuffle training data at the begining of each epoch           
-            total_sample = np.size(train_x, axis=0)
-            sample_ids = np.arange(total_sample)
-            np.random.shuffle(sample_ids) 
+            # Shuffle the order of the training samples at the begining of each epoch
+            # (the pipeline and the multi-step training loop reshuffle by themselves)
+            if stream_data is not None:
+                stream_batches = iter(train_stream)
+            elif parallel_workers > 0:
+                trainer.shuffle()
+            elif (input_pipeline==False) & (multistep is None):
+                batches.shuffle()
             
-            train_x_shuff = np.array([ train_x[i] for i in sample_ids])
-            train_y_shuff = np.array([ train_y[i] for i in sample_ids])
             
             
-            # Begin Annealing
+            # Begin Annealing (in the graph for the multi-step training)
             if beginAnneal == 0:
                 lr = lr * 1.0
-            elif epoch+1 > beginAnneal:
+            elif (epoch+1 > beginAnneal) & (multistep is None):
                 lr = max( lr_min, (-decay_rate*(epoch+1) + (1+decay_rate*beginAnneal)) * lr )  
             
-        
-            
-            
-            # Calculate how many mini-batch iterations we need
-            total_batch = int(np.shape(train_x)[0]/batch_size) 
             
             cost_epoch=0.0
+            train_err_running=RunningMean()
             
-            # minibatch based training  
-            for batch in np.arange(total_batch):
-                batch_x = train_x_shuff[batch*batch_size:(batch+1)*batch_size]
-                batch_y = train_y_shuff[batch*batch_size:(batch+1)*batch_size]
+            # multi-step training : the minibatches of the epoch in session calls of multistep steps
+            if multistep is not None:
+                n_steps = total_batch if multistep=='epoch' else int(multistep)
+                for first in np.arange(0,total_batch,n_steps):
+                    cost_steps,err_steps,lr_steps,hsp_steps,beta_steps=sess.run([step_cost,step_err,step_lr,step_hsp,step_beta],
+                                                                                {train_loop.n_steps:min(n_steps,total_batch-first)})
+                    cost_epoch+=np.sum(cost_steps)/total_batch
+                    for err_batch in err_steps:
+                        train_err_running.add(err_batch, batch_size)
+                    
+                    result_step_cost=np.hstack([result_step_cost,cost_steps])
+                    result_step_lr=np.hstack([result_step_lr,lr_steps])
+                    result_step_hsp=np.vstack([result_step_hsp,hsp_steps])
+                    result_step_beta=np.vstack([result_step_beta,beta_steps])
+                lr=lr_steps[-1]
+            else:
+                # minibatch based training
+                for batch in np.arange(total_batch):
+                    # the minibatch is read from the shard stream, fed by the input pipeline through its iterator,
+                    # or gathered from the (memory-mapped) training set into the batch buffer
+                    if stream_data is not None:
+                        batch_x, batch_y = next(stream_batches)
+                        batch_feed={X:batch_x, Y:batch_y}
+                    elif (input_pipeline==True) | (parallel_workers > 0):
+                        batch_feed={}
+                    else:
+                        batch_x, batch_y = batches.batch(batch)
+                        batch_feed={X:batch_x, Y:batch_y}
                 
-                # Get cost and optimize the model
-                cost_batch,_=sess.run([cost,optimizer],{Lr:lr, X:batch_x, Y:batch_y, Beta:beta})
-
-                cost_epoch+=cost_batch/total_batch      
-        
-        
-                # weight sparsity control    
-                if mode=='layer':                   
-                    for i in np.arange(np.shape(nodes)[0]-2):
-                        [hsp_val[i], beta_val[i]] = Hoyers_sparsity_control(w[i], beta_val[i], max_beta[i], tg_hspset[i])   
-                    beta=beta_val                      
-
-                elif mode=='node':                             
-                    for i in np.arange(np.shape(nodes)[0]-2):
-                        [hsp_val[i], beta_val[i]] = Hoyers_sparsity_control(w[i], beta_val[i], max_beta[i], tg_hspset[i])   
-                    # flatten beta_val (shape (3, 100) -> (300,))
-                    beta=[item for sublist in beta_val for item in sublist]
+                    # Get cost, optimize the model and control the weight sparsity in one session call
+                    if hsp_in_graph==True:
+                        if hsp_schedule.due(batch,total_batch):
+                            cost_batch,err_batch,_=sess.run([cost,error,hsp_update],{Lr:lr, **batch_feed})
+                        else:
+                            cost_batch,err_batch,_=sess.run([cost,error,optimizer],{Lr:lr, **batch_feed})
+                    
+                    # Get cost and optimize the model, then control the weight sparsity in NumPy
+                    else:
+                        # (the gradients of the shards in the worker processes, one step on the shared weights)
+                        if parallel_workers > 0:
+                            cost_batch,err_batch,_=trainer.step(batch, sparsity.layer_beta, lr, parallel_momentum)
+                        else:
+                            cost_batch,err_batch,_=sess.run([cost,error,optimizer],{Lr:lr, Beta:sparsity.beta, **batch_feed})
+                    
+                        # Hoyer's sparsness of a snapshot of every hidden layer (one session call, or the shared weights)
+                        if hsp_schedule.due(batch,total_batch):
+                            if parallel_workers > 0:
+                                w_hidden=[np.array(trainer.W[i], copy=(hsp_async==True)) for i in np.arange(np.shape(nodes)[0]-2)]
+                            else:
+                                w_hidden=sess.run(w[:-1])
+                            hsp_result=hsp_schedule.run(sparsity.hoyer, w_hidden)
+                        else:
+                            hsp_result=hsp_schedule.poll()
+                        
+                        # update beta of every hidden layer at once
+                        if hsp_result is not None:
+                            sparsity.apply(hsp_result)
+
+                    cost_epoch+=cost_batch/total_batch      
+                    train_err_running.add(err_batch, batch_size)
+            
+            # Fetch Hoyer's sparsness and beta from the graph once per epoch
+            if hsp_in_graph==True:
+                sparsity.hsp[...], sparsity.beta[...] = sess.run([Hsp, Beta])
+            
+            # the run fails if beta or Hoyer's sparsness were upcast during the epoch
+            precision_policy.audit('epoch %d'%(epoch+1), beta=sparsity.beta, hsp=sparsity.hsp)
+            
+            # Load the weights trained by the worker processes into the graph to evaluate them
+            if parallel_workers > 0:
+                for i in np.arange(np.shape(nodes)[0]-1):
+                    w[i].load(trainer.W[i], sess)
+                    b[i].load(trainer.b[i], sess)
                
-            # get train error
-            train_err_epoch=sess.run(error,{X:train_x_shuff, Y:train_y_shuff})
+            # get train error in chunks of eval_chunk samples
+            # (the mean error of the minibatches of the epoch when the training set is streamed from disk)
+            if (stream_data is None) & (train_error=='full'):
+                [train_err_epoch]=evaluate(lambda x,y: sess.run([error],{X:x, Y:y}), train_x, train_y, eval_chunk)
+            else:
+                train_err_epoch=train_err_running.mean()
             result_train_err=np.hstack([result_train_err,[train_err_epoch]])
             
             # get test error
-            test_err_epoch=sess.run(error,{X:test_x, Y:test_y})
+            [test_err_epoch]=evaluate(lambda x,y: sess.run([error],{X:x, Y:y}), test_x, test_y, eval_chunk)
             result_test_err=np.hstack([result_test_err,[test_err_epoch]])
             
             
@@ -367,13 +619,17 @@ if condition==True:
             result_lr=np.hstack([result_lr,[lr]])
             result_cost=np.hstack([result_cost,[cost_epoch]])
             
+            # Mean lag of the applied beta (in minibatches) in this epoch
+            [lag_mean, lag_max]=hsp_schedule.lag_summary()
+            result_beta_lag=np.hstack([result_beta_lag,[lag_mean]])
+            
             if mode=='layer':
-                result_hsp=[np.vstack([result_hsp[i],[hsp_val[i]]]) for i in np.arange(np.shape(nodes)[0]-2)]
-                result_beta=[np.vstack([result_beta[i],[beta[i]]]) for i in np.arange(np.shape(nodes)[0]-2)]
+                result_hsp=[np.vstack([result_hsp[i],[sparsity.hsp[i]]]) for i in np.arange(np.shape(nodes)[0]-2)]
+                result_beta=[np.vstack([result_beta[i],[sparsity.beta[i]]]) for i in np.arange(np.shape(nodes)[0]-2)]
                 
             elif mode=='node':
-                result_hsp=[np.vstack([result_hsp[i],[np.transpose(hsp_val[i])]]) for i in np.arange(np.shape(nodes)[0]-2)]
-                result_beta=[np.vstack([result_beta[i],[np.transpose(beta_val[i])]]) for i in np.arange(np.shape(nodes)[0]-2)]
+                result_hsp=[np.vstack([result_hsp[i],[np.transpose(sparsity.layer_hsp[i])]]) for i in np.arange(np.shape(nodes)[0]-2)]
+                result_beta=[np.vstack([result_beta[i],[np.transpose(sparsity.layer_beta[i])]]) for i in np.arange(np.shape(nodes)[0]-2)]
 
             
             # Print cost and errors after every training epoch       
@@ -381,10 +637,32 @@ if condition==True:
                                             ,"/ Train err :", "{:.3f}".format(train_err_epoch),"/ Test err :","{:.3f}".format(test_err_epoch)) 
             print("             beta :",np.mean(np.mean(result_beta,axis=1),axis=1))
             print("             hsp :",np.mean(np.mean(result_hsp,axis=1),axis=1))  
+            if hsp_async==True:
+                print("             beta lag : mean %.1f / max %d minibatches"%(lag_mean,lag_max))
+            
+            # End training when the cost stopped decreasing (keeps a copy of the weights of the lowest cost)
+            if (stopping is not None) and stopping.update(cost_epoch, sparsity.layer_hsp, sparsity.layer_beta, lambda: sess.run(w+b)):
+                break
+                
+        hsp_schedule.close()
+        if parallel_workers > 0:
+            trainer.close()
+        
+        # Restore the weights of the lowest cost
+        if stopping is not None:
+            print(stopping.summary())
+            if stopping.best_params is not None:
+                for var, value in zip(w+b, stopping.best_params):
+                    var.load(value, sess)
 
         # Print final accuracy on test set
         print("")
-        print("* Test accuracy :", "{:.3f}".format(1-sess.run(error,{X:test_x, Y:test_y})))
+        print("* Test accuracy :", "{:.3f}".format(1-evaluate(lambda x,y: sess.run([error],{X:x, Y:y}), test_x, test_y, eval_chunk)[0]))
+
+        # First layer on the voxels, to interpret the network trained on the projected features
+        if projection is not None:
+            [w1, b1] = sess.run([w[0], b[0]])
+            result_voxel_weight = {'w1':w1, 'b1':b1, 'w1_voxel':input_projection.voxel_weights(w1), 'b1_voxel':input_projection.voxel_bias(w1, b1)}
             
 else:
     # Don't run the session but print 'failed' if any condition is not met
@@ -418,6 +696,26 @@ if condition==True:
     f.write('L2_reg : '+str(L2_reg)+'\n')
     f.write('max_beta : '+str(max_beta)+'\n')
     f.write('tg_hspset : '+str(max_beta)+'\n')
+    f.write('hsp_in_graph : '+str(hsp_in_graph)+'\n')
+    f.write('hsp_every : '+str(hsp_every)+'\n')
+    f.write('hsp_async : '+str(hsp_async)+'\n')
+    f.write('input_pipeline : '+str(input_pipeline)+'\n')
+    f.write('stream_data : '+str(stream_data)+'\n')
+    f.write('stream_buffer : '+str(stream_buffer)+'\n')
+    f.write('preprocess_cache : '+str(preprocess_cache)+'\n')
+    f.write('eval_chunk : '+str(eval_chunk)+'\n')
+    f.write('train_error : '+str(train_error)+'\n')
+    f.write('multistep : '+str(multistep)+'\n')
+    f.write('parallel_workers : '+str(parallel_workers)+'\n')
+    f.write('precision : '+str(precision)+'\n')
+    f.write('projection : '+str(projection)+'\n')
+    f.write('projection_components : '+str(projection_components)+'\n')
+    f.write('early_stopping : '+str(early_stopping)+'\n')
+    f.write('hsp_tol : '+str(hsp_tol)+'\n')
+    f.write('beta_tol : '+str(beta_tol)+'\n')
+    if stopping is not None:
+        f.write('trained_epochs : '+str(stopping.epoch)+'\n')
+        f.write('best_epoch : '+str(stopping.best_epoch)+'\n')
     f.close()
 
       
@@ -490,6 +788,12 @@ if condition==True:
     sio.savemat(final_directory+"/result_test_err.mat", mdict={'testErr': result_test_err})
     sio.savemat(final_directory+"/result_beta.mat", mdict={'beta': result_beta})
     sio.savemat(final_directory+"/result_hsp.mat", mdict={'hsp': result_hsp})
+    sio.savemat(final_directory+"/result_beta_lag.mat", mdict={'beta_lag': result_beta_lag[1:]})
+    if multistep is not None:
+        sio.savemat(final_directory+"/result_steps.mat", mdict={'cost': result_step_cost, 'lr': result_step_lr,
+                                                               'hsp': result_step_hsp, 'beta': result_step_beta})
+    if projection is not None:
+        sio.savemat(final_directory+"/result_voxel_weight.mat", mdict=result_voxel_weight)
 
 else:
     None 
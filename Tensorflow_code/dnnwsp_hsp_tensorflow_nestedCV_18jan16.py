@@ -8,8 +8,6 @@
 import tensorflow as tf
 # NumPy is the fundamental package for scientific computing with Python.
 import numpy as np
-# Linear algebra module for calculating L1 and L2 norm  
-from numpy import linalg as LA
 # To plot the results
 import matplotlib.pyplot as plt
 # To check the directory when saving the results
@@ -17,6 +15,31 @@ import os.path
 # The module for file input and output
 import scipy.io as sio
 import itertools
+# To import the shared dnnwsp modules from the root of the repository
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+# Weight sparsity control of all hidden layers with one beta buffer
+from dnnwsp.sparsity import SparsityControl
+# How often (and in which thread) the weight sparsity control runs
+from dnnwsp.schedule import HspSchedule
+# Sparse export of the trained network for prediction
+from dnnwsp.inference import export_sparse, print_report
+# Memory-mapped datasets (a directory made by python -m dnnwsp.dataset) or .mat files
+from dnnwsp.dataset import load_dataset
+# float32 inputs and vectorized one-hot labels
+from dnnwsp.prepare import prepare_classification, check_float32
+# Cache of the preprocessed inputs, keyed by the content of the data file
+from dnnwsp.cache import PreprocessCache
+# Evaluation of whole data sets in chunks
+from dnnwsp.evaluation import evaluate
+# Minibatches gathered from a shuffled index into one reusable buffer
+from dnnwsp.batching import BatchGatherer
+# tf.data input pipeline (shuffled minibatches gathered and prefetched while the graph runs)
+from dnnwsp.pipeline import InputPipeline, prefetch_each
+# Projection of the voxels onto fewer features (PCA, randomized SVD or sparse random projection) fitted on the training folds
+from dnnwsp.projection import InputProjection, project_datasets
+# Early stopping once Hoyer's sparsness and beta have converged
+from dnnwsp.stopping import EarlyStopping
 import timeit 
 import datetime
 
@@ -100,6 +123,87 @@ and set target sparsness value (0:dense~1:sparse)
 max_beta = [0.015, 0.25, 0.25]
 #max_beta = [0.0001, 0.7, 0.7]
 
+
+"""
+Select where the weight sparsity control runs
+True : Hoyer's sparsness and beta are graph variables updated in the same session call as the optimizer
+False : weights are copied to NumPy after every minibatch and beta is fed back through feed_dict
+"""
+hsp_in_graph = True
+
+"""
+Set how often the weight sparsity control runs
+hsp_every : recompute beta every k minibatches (1 : after every minibatch) or 'epoch' (once per epoch)
+hsp_async : compute Hoyer's sparsness in a background thread on a snapshot of the weights
+            while the next minibatches train (needs hsp_in_graph = False)
+"""
+hsp_every = 1
+hsp_async = False
+
+
+"""
+Select how the minibatches are fed to the graph
+input_pipeline : True for the tf.data input pipeline (the next minibatches are shuffled, gathered and prefetched
+                 while the current step runs), False to gather each minibatch in Python and feed it through feed_dict
+prefetch_folds : build the data of the next inner fold in a background thread while the current one trains
+"""
+input_pipeline = True
+prefetch_folds = True
+
+
+"""
+Cache the preprocessed inputs (float32 samples and one-hot labels of all folds) on local disk
+True : preprocess once per data file and number of classes, memory-map the cached arrays in the next runs
+       (in ~/.cache/dnnwsp, or the directory in the DNNWSP_CACHE environment variable)
+False : preprocess in every run
+"""
+preprocess_cache = False
+
+
+"""
+Evaluation of the training, validation and test sets after every epoch
+eval_chunk : number of samples fed to the graph at once (bounds the memory of the activations)
+"""
+eval_chunk = 256
+
+
+"""
+Sparse export of the network of each outer fold (result_sparse_weight.mat)
+sparse_export : threshold the weights by the achieved Hoyer's sparsness, save the hidden layers
+                as sparse matrices and print the accuracy drift against the dense model
+sparse_keep_scale : keep sparse_keep_scale times the number of nonzeros implied by Hoyer's sparsness
+"""
+sparse_export = False
+sparse_keep_scale = 1.0
+
+
+"""
+Project the voxels onto fewer input features before the first layer (dnnwsp.projection), fitted on the training folds
+of every fit only (nothing of its validation or test fold leaks into the features)
+None : train on the voxels
+'pca' : principal components of the training folds (projection_components at most the number of their samples)
+'randomized_svd' : principal components approximated by a randomized SVD
+'sparse_random' : very sparse random projection (any number of features, e.g. a few thousand)
+The projected samples of every fold are cached with the preprocessed inputs (preprocess_cache), n_nodes[0] becomes
+projection_components, and the first layer of each outer fold is also saved on the voxels (result_voxel_weight.mat)
+"""
+projection = None
+projection_components = 200
+
+
+"""
+Early stopping of every fit (dnnwsp.stopping)
+0 : train n_epochs
+early_stopping : the patience, end an inner fit after early_stopping epochs without a decrease of its validation error
+                 (of its cost for the autoencoder), counted once Hoyer's sparsness of every hidden layer is within hsp_tol of
+                 the target set and the mean beta of every hidden layer moved by at most beta_tol between two windows of 5 epochs;
+                 the weights of the lowest validation error are restored and their error is the error of the inner fold
+The outer fit has no validation fold, it trains for the mean best epoch of the inner fits of the selected target set
+"""
+early_stopping = 0
+hsp_tol = 0.05
+beta_tol = 0.01
+
 # automatically makes combination sets [(0.3 or 0.7) , (0.3 or 0.7), (0.3 or 0.7)]
 tg_hspset_list = list(itertools.product([0.3, 0.7],[0.3, 0.7],[0.3, 0.7]))
 tg_hspset_list=[list(i) for i in tg_hspset_list]
@@ -130,26 +234,42 @@ f.write('lr_min : '+str(lr_min)+'\n')
 f.write('beta_lrates : '+str(beta_lrates)+'\n')
 f.write('L2_reg : '+str(L2_reg)+'\n')
 f.write('max_beta : '+str(max_beta)+'\n')
+f.write('hsp_in_graph : '+str(hsp_in_graph)+'\n')
+f.write('hsp_every : '+str(hsp_every)+'\n')
+f.write('hsp_async : '+str(hsp_async)+'\n')
+f.write('input_pipeline : '+str(input_pipeline)+'\n')
+f.write('prefetch_folds : '+str(prefetch_folds)+'\n')
+f.write('preprocess_cache : '+str(preprocess_cache)+'\n')
+f.write('eval_chunk : '+str(eval_chunk)+'\n')
+f.write('sparse_export : '+str(sparse_export)+'\n')
+f.write('sparse_keep_scale : '+str(sparse_keep_scale)+'\n')
+f.write('projection : '+str(projection)+'\n')
+f.write('projection_components : '+str(projection_components)+'\n')
+f.write('early_stopping : '+str(early_stopping)+'\n')
+f.write('hsp_tol : '+str(hsp_tol)+'\n')
+f.write('beta_tol : '+str(beta_tol)+'\n')
 f.close()
 
 ################################################# Input data #################################################
 
-datasets = sio.loadmat('/home/hailey/03_code/weight_sparsity_control/lhrhadvs_sample_data.mat')
+# a dataset directory converted from the .mat file (python -m dnnwsp.dataset lhrhadvs_sample_data.mat lhrhadvs_sample_data)
+# is memory-mapped in float32 instead of being read into RAM in float64
+data_file = '/home/hailey/03_code/weight_sparsity_control/lhrhadvs_sample_data.mat'
 
-train_x_ = datasets['train_x']
-train_y_ = np.zeros((np.shape(datasets['train_y'])[0],np.max(datasets['train_y'])+1))
-# transform into One-hot
-for i in np.arange(np.shape(datasets['train_y'])[0]):
-    train_y_[i][datasets['train_y'][i][0]]=1 
+# convert the inputs to float32 once (the placeholders are float32, so nothing is converted when feeding),
+# transform the labels into One-hot (float32, as many classes as output nodes) and stack all samples
+def prepare_total():
+    datasets = prepare_classification(load_dataset(data_file), n_nodes[-1])
+    return {'total_x': np.vstack([datasets['train_x'],datasets['test_x']]),
+            'total_y': np.vstack([datasets['train_y'],datasets['test_y']])}
 
-test_x_ = datasets['test_x']
-test_y_ = np.zeros((np.shape(datasets['test_y'])[0],np.max(datasets['test_y'])+1))
-# transform into One-hot
-for i in np.arange(np.shape(datasets['test_y'])[0]):
-    test_y_[i][datasets['test_y'][i][0]]=1 
+if preprocess_cache==True:
+    datasets = PreprocessCache().load(data_file, {'prepare':'classification_total', 'n_classes':n_nodes[-1]}, prepare_total)
+else:
+    datasets = prepare_total()
 
-total_x=np.vstack([train_x_,test_x_])
-total_y=np.vstack([train_y_,test_y_])
+total_x=datasets['total_x']
+total_y=datasets['total_y']
 
 #datasets = sio.loadmat('mym_vectors_and_labels.mat')
 #
@@ -161,6 +281,30 @@ num_total = np.size(total_x, axis=0)  # total number of examples to use
 num_1fold = int(num_total / k_folds)
 
 
+# the projection of every fit, indexed by its validation fold and training folds
+fold_projections = {}
+
+# training set (the given folds stacked) and validation set (one fold) of a fit
+# (projected onto the features of the projection fitted on the training folds)
+def make_fold(train_folds, valid_fold):
+    train_x = np.vstack([total_x[j*num_1fold : (j+1)*num_1fold] for j in train_folds])
+    train_y = np.vstack([total_y[j*num_1fold : (j+1)*num_1fold] for j in train_folds])
+    valid_x = total_x[valid_fold*num_1fold : (valid_fold+1)*num_1fold]
+    valid_y = total_y[valid_fold*num_1fold : (valid_fold+1)*num_1fold]
+    if projection is not None:
+        fold_params = {'prepare':'classification_total', 'n_classes':n_nodes[-1], 'k_folds':k_folds,
+                       'train_folds':[int(j) for j in train_folds], 'valid_fold':int(valid_fold)}
+        [fold, fold_projections[int(valid_fold), tuple(int(j) for j in train_folds)]] = \
+            project_datasets({'train_x':train_x, 'valid_x':valid_x}, InputProjection(projection, projection_components), names=('train','valid'),
+                             cache=PreprocessCache() if preprocess_cache==True else None, sources=data_file, params=fold_params)
+        train_x = fold['train_x']
+        valid_x = fold['valid_x']
+    return train_x, train_y, valid_x, valid_y
+
+if projection is not None:
+    n_nodes[0] = projection_components
+
+
     
 ################################################# Build Model #################################################
 
@@ -172,8 +316,13 @@ with tf.device('/gpu:0'):
     nodes_index= [int(np.sum(n_nodes[1:i+1])) for i in np.arange(np.shape(n_nodes)[0]-1)]
     
     # Make two placeholders to fill the values later when training or testing
-    X=tf.placeholder(tf.float32,[None,n_nodes[0]])
-    Y=tf.placeholder(tf.float32,[None,n_nodes[-1]])
+    # (with the input pipeline they default to the next prefetched minibatch when they are not fed)
+    if input_pipeline==True:
+        pipeline = InputPipeline(n_nodes[0], n_nodes[-1], batch_size)
+        X, Y = pipeline.X, pipeline.Y
+    else:
+        X=tf.placeholder(tf.float32,[None,n_nodes[0]])
+        Y=tf.placeholder(tf.float32,[None,n_nodes[-1]])
     
     # Create randomly initialized weight variables 
     w_init=[tf.random_uniform([n_nodes[i],n_nodes[i+1]], minval=-tf.sqrt(tf.div(6.0,n_nodes[i]+n_nodes[i+1])), maxval=tf.sqrt(tf.div(6.0,n_nodes[i]+n_nodes[i+1]))) for i in np.arange(np.shape(n_nodes)[0]-1)]
@@ -209,10 +358,16 @@ with tf.device('/gpu:0'):
     def init_beta():
         if mode=='layer':
             # The size is same with the number of layers
-            Beta=tf.placeholder(tf.float32,[np.shape(n_nodes)[0]-2])
+            beta_shape=[np.shape(n_nodes)[0]-2]
         elif mode=='node':
             # The size is same with the number of nodes
-            Beta=tf.placeholder(tf.float32,[np.sum(n_nodes[1:-1])])
+            beta_shape=[np.sum(n_nodes[1:-1])]
+            
+        if hsp_in_graph==True:
+            # Beta lives in the graph, so it must not be trained by the optimizer (sess.run(init) resets it)
+            Beta=tf.Variable(tf.zeros(beta_shape), trainable=False, dtype=tf.float32)
+        else:
+            Beta=tf.placeholder(tf.float32,beta_shape)
     
         return Beta
     
@@ -273,20 +428,60 @@ with tf.device('/gpu:0'):
         return optimizer
     
     
+    # Weight sparsity control with Hoyer's sparsness inside the graph
+    def init_hsp_control():
+        # Target sparsness of each hidden layer, fed because it changes with every candidate set
+        Tg_hsp=tf.placeholder(tf.float32,[np.shape(n_nodes)[0]-2])
+        # Hoyer's sparsness of every layer (or every node), kept to plot the results
+        Hsp=tf.Variable(tf.zeros(Beta.get_shape()), trainable=False, dtype=tf.float32)
+        
+        hsp_list=[]
+        beta_list=[]
+        
+        # Read the weights only after the optimizer step, as the NumPy version does
+        with tf.control_dependencies([optimizer]):
+            for i in np.arange(np.shape(n_nodes)[0]-2):
+                W=w[i].read_value()
+                
+                if mode=='layer':
+                    # Calculate L1 and L2 norm over the whole weight matrix
+                    sqrt_nsamps=np.sqrt(n_nodes[i]*n_nodes[i+1])
+                    L1=tf.reduce_sum(tf.abs(W))
+                    L2=tf.sqrt(tf.reduce_sum(tf.square(W)))
+                    b_old=Beta[i]
+                elif mode=='node':
+                    # Calculate L1 and L2 norm of each column
+                    sqrt_nsamps=np.sqrt(n_nodes[i])
+                    L1=tf.reduce_sum(tf.abs(W),axis=0)
+                    L2=tf.sqrt(tf.reduce_sum(tf.square(W),axis=0))
+                    b_old=Beta[nodes_index[i]:nodes_index[i+1]]
+                
+                # Calculate hoyer's sparsness
+                h=(sqrt_nsamps-(L1/L2))/(sqrt_nsamps-1)
+                
+                # Update beta and trim value
+                b_new=b_old-beta_lrates*tf.sign(h-Tg_hsp[i])
+                b_new=tf.clip_by_value(b_new,0.0,max_beta[i])
+                
+                hsp_list.append(h)
+                beta_list.append(b_new)
+                
+            if mode=='layer':
+                hsp_update=tf.group(tf.assign(Hsp,tf.stack(hsp_list)), tf.assign(Beta,tf.stack(beta_list)))
+            elif mode=='node':
+                hsp_update=tf.group(tf.assign(Hsp,tf.concat(hsp_list,0)), tf.assign(Beta,tf.concat(beta_list,0)))
+        
+        return Tg_hsp, Hsp, hsp_update
+    
+    
     
     # initialization   
     def init_otherVariables():           
         if mode=='layer': 
-            beta_val = np.zeros(np.shape(n_nodes)[0]-2)
-            beta = np.zeros(np.shape(n_nodes)[0]-2)
-            hsp_val = np.zeros(np.shape(n_nodes)[0]-2)            
             plot_beta = np.zeros(np.shape(n_nodes)[0]-2)
             plot_hsp = np.zeros(np.shape(n_nodes)[0]-2)
                        
         elif mode=='node':                       
-            beta_val = [np.zeros(n_nodes[i+1]) for i in np.arange(np.shape(n_nodes)[0]-2)]  
-            beta = np.zeros(np.sum(n_nodes[1:-1]))
-            hsp_val = [np.zeros(n_nodes[i+1]) for i in np.arange(np.shape(n_nodes)[0]-2)]            
             plot_beta = [np.zeros(n_nodes[i+1]) for i in np.arange(np.shape(n_nodes)[0]-2)]
             plot_hsp = [np.zeros(n_nodes[i+1]) for i in np.arange(np.shape(n_nodes)[0]-2)]
         
@@ -300,7 +495,7 @@ with tf.device('/gpu:0'):
         lr = lr_init 
         
         
-        return lr, beta_val, beta, hsp_val, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err
+        return lr, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err
             
     
     # Make a placeholder to be able to update learning rate (Learning rate decaying) 
@@ -314,6 +509,10 @@ with tf.device('/gpu:0'):
     
     optimizer=init_optimizer(Lr)
     
+    if hsp_in_graph==True:
+        # One session call runs the optimizer step and the weight sparsity control together
+        Tg_hsp, Hsp, hsp_update = init_hsp_control()
+    
     if autoencoder==False:
         predict_ans=tf.argmax(tf.nn.softmax(layer_logRegression),1)
         correct_ans=tf.argmax(Y,1)
@@ -324,76 +523,29 @@ with tf.device('/gpu:0'):
     
     
     
-    lr, beta_val, beta, hsp_val, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
-    
-    
+    lr, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
     
     
     
-    if mode=='layer':
-        # Weight sparsity control with Hoyer's sparsness (Layer wise)  
-        def Hoyers_sparsity_control(w_,b,max_b,tg):
-            
-            # Get value of weight
-            W=sess.run(w_)
-            [dim,n_nodes]=W.shape  
-            num_elements=n_nodes*dim
-     
-            Wvec=W.flatten()
-             
-            # Calculate L1 and L2 norm     
-            L1=LA.norm(Wvec,1)
-            L2=LA.norm(Wvec,2)
-            
-            # Calculate hoyer's sparsness
-            h=(np.sqrt(num_elements)-(L1/L2))/(np.sqrt(num_elements)-1)
-            
-            # Update beta
-            b-=beta_lrates*np.sign(h-tg)
-            
-            # Trim value
-            b=0.0 if b<0.0 else b
-            b=max_b if b>max_b else b
-                             
-            return [h,b]
-        
-        
-    elif mode=='node':   
-        # Weight sparsity control with Hoyer's sparsness (Node wise)
-        def Hoyers_sparsity_control(w_,b_vec,max_b,tg):
-        
-            # Get value of weight
-            W=sess.run(w_)
-            [dim,n_nodes]=W.shape
-            
-            # Calculate L1 and L2 norm 
-            L1=LA.norm(W,1,axis=0)
-            L2=LA.norm(W,2,axis=0)
-            
-            h_vec = np.zeros((1,n_nodes))
-            tg_vec = np.ones(n_nodes)*tg
-            
-            # Calculate hoyer's sparsness
-            h_vec=(np.sqrt(dim)-(L1/L2))/(np.sqrt(dim)-1)
-            
-            # Update beta
-            b_vec-=beta_lrates*np.sign(h_vec-tg_vec)
-            
-            # Trim value
-            b_vec[b_vec<0.0]=0.0
-            b_vec[b_vec>max_b]=max_b
-            
-                   
-            return [h_vec,b_vec]
-    
     
     
-
 ############################################ Condition check #############################################
 
 
 condition=True
 
+if (hsp_async==True) & (hsp_in_graph==True):
+    print("Error : The asynchronous sparsity control needs hsp_in_graph = False.")
+    condition=False
+
+if len(check_float32(total_x=total_x, total_y=total_y)) > 0:
+    print("Error : The datasets are not float32 :", check_float32(total_x=total_x, total_y=total_y))
+    condition=False
+
+if early_stopping < 0:
+    print("Error : early_stopping should be 0 or a number of epochs.")
+    condition=False
+
     
 ################################################ Learning ################################################
 
@@ -404,6 +556,17 @@ if condition==True:
     # variables are not initialized when you call tf.Variable. 
     # To initialize all the variables in a TensorFlow program, you must explicitly call a special operation         
     init = tf.global_variables_initializer()              
+    
+    # Beta and Hoyer's sparsness of every hidden layer (sparsity.beta is the whole beta array fed to the graph,
+    # sparsity.layer_beta[i] and sparsity.layer_hsp[i] are the parts of the i-th hidden layer)
+    # the target sparsity is set and beta is reset before every fit
+    sparsity = SparsityControl(n_nodes[1:-1], tg_hspset_list[0], max_beta, beta_lrates, nodewise=(mode=='node'))
+    
+    # when to recompute beta (reset with the weights before every fit)
+    hsp_schedule = HspSchedule(hsp_every, hsp_async)
+    
+    # stop every inner fit on its validation error once the sparsity has converged (reset before every fit)
+    stopping = EarlyStopping(early_stopping, hsp_tol=hsp_tol, beta_tol=beta_tol) if early_stopping > 0 else None
 
     
 #    with tf.Session() as sess:
@@ -421,7 +584,7 @@ if condition==True:
         
             print("*********************** outer fold (",outer+1, ") **************************")        
             
-            lr, beta_val, beta, hsp_val, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
+            lr, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
 
             
             # outer_train_list
@@ -429,35 +592,39 @@ if condition==True:
             
             
             error_list=list() 
+            # mean best epoch of the inner fits of every candidate set (with early stopping)
+            best_epoch_list=list()
             
             # for each candidate sets
             for tg_hspset in tg_hspset_list:
                             
      
                 avg_err=0.0
+                inner_best_epochs=[]
                 
                 ######################################## Inner train ################################################
-                for inner in outer_train_list:
+                
+                # make the training and validation data sets of every inner fold
+                # (the next one is built in the background while the current one trains)
+                inner_folds = [(np.delete(outer_train_list, np.argwhere(outer_train_list == inner)), inner) for inner in outer_train_list]
+                
+                for inner, (train_x, train_y, valid_x, valid_y) in zip(outer_train_list, prefetch_each(make_fold, inner_folds, prefetch_folds)):
                     
-                    inner_train_list = np.delete(outer_train_list, np.argwhere(outer_train_list == inner))
+                    # the training set is never copied, the minibatches are gathered from a shuffled index
+                    # (in the graph by the input pipeline, or into a batch buffer fed through feed_dict)
+                    if input_pipeline==True:
+                        total_batch = pipeline.start(sess, train_x, train_y)
+                    else:
+                        batches = BatchGatherer([train_x, train_y], batch_size)
+                        total_batch = batches.n_batches
                     
-                    train_x = []
-                    train_y = []
-                    valid_x = []
-                    valid_y = []
-
-                    # make training data set
-                    for j in inner_train_list:
-                        if np.size(train_x) == 0 & np.size(train_y) == 0:
-                            train_x = total_x[j*num_1fold : (j+1)*num_1fold]
-                            train_y = total_y[j*num_1fold : (j+1)*num_1fold]
-                        else:
-                            train_x = np.vstack([train_x, total_x[j*num_1fold : (j+1)*num_1fold]])
-                            train_y = np.vstack([train_y, total_y[j*num_1fold : (j+1)*num_1fold]])
-
-                    valid_x = total_x[inner * num_1fold:(inner+1) * num_1fold]
-                    valid_y = total_y[inner * num_1fold:(inner+1) * num_1fold]
-
+                    # target sparsity of this candidate set
+                    sparsity.set_target(tg_hspset)
+                    if stopping is not None:
+                        stopping.reset(tg_hspset)
+                    
+                    # lag of the applied beta (in minibatches) in each epoch
+                    plot_beta_lag=[]
                     
                     # train and get cost    
                     for epoch in np.arange(n_epochs):            
@@ -470,53 +637,53 @@ if condition==True:
                             lr = max( lr_min, (-decay_rate*(epoch+1) + (1+decay_rate*beginAnneal)) * lr ) 
                             
                             
-                        # shuffle data in every epoch           
-                        total_sample = np.size(train_y, axis=0)
-                        sample_ids = np.arange(total_sample)
-                        np.random.shuffle(sample_ids) 
-
-                        
-                        train_x = train_x[[sample_ids]]
-                        train_y = train_y[[sample_ids]]
-                        
-                        # Calculate how many mini-batch iterations we need
-                        total_batch = int(np.shape(train_x)[0]/batch_size) 
+                        # shuffle the order of the training samples in every epoch (the pipeline reshuffles by itself)           
+                        if input_pipeline==False:
+                            batches.shuffle()
                         
                         cost_epoch=0.0
                         
                         # minibatch based training  
                         for batch in np.arange(total_batch):                       
-                            batch_x = train_x[batch*batch_size:(batch+1)*batch_size]
-                            batch_y = train_y[batch*batch_size:(batch+1)*batch_size]
-                                         
+                            # the input pipeline feeds the minibatch through its iterator, otherwise feed the batch buffer
+                            if input_pipeline==True:
+                                batch_feed={}
+                            else:
+                                batch_x, batch_y = batches.batch(batch)
+                                batch_feed={X:batch_x} if autoencoder==True else {X:batch_x, Y:batch_y}
                             
-                            # Get cost and optimize the model
-                            if autoencoder==False:
-                                cost_batch,_=sess.run([cost,optimizer],{Lr:lr, X:batch_x, Y:batch_y, Beta:beta })
+                            
+                            # Get cost, optimize the model and control the weight sparsity in one session call
+                            if hsp_in_graph==True:
+                                train_op=hsp_update if hsp_schedule.due(batch,total_batch) else optimizer
+                                cost_batch,_=sess.run([cost,train_op],{Lr:lr, Tg_hsp:tg_hspset, **batch_feed })
+                                    
+                            # Get cost and optimize the model, then control the weight sparsity in NumPy
+                            else:
+                                cost_batch,_=sess.run([cost,optimizer],{Lr:lr, Beta:sparsity.beta, **batch_feed })
                                 
-                            else:                      
-                                cost_batch,_=sess.run([cost,optimizer],{Lr:lr, X:batch_x, Beta:beta })
+                                # weight sparsity control on a snapshot of every hidden layer (one session call)    
+                                if hsp_schedule.due(batch,total_batch):
+                                    hsp_result=hsp_schedule.run(sparsity.hoyer, sess.run(w[:-1]))
+                                else:
+                                    hsp_result=hsp_schedule.poll()
+                                    
+                                # update beta of every hidden layer at once
+                                if hsp_result is not None:
+                                    sparsity.apply(hsp_result)
                                 
                             cost_epoch+=cost_batch/total_batch    
                             
-                            
-                            # weight sparsity control    
-                            for i in np.arange(np.shape(n_nodes)[0]-2):
-                                [hsp_val[i], beta_val[i]] = Hoyers_sparsity_control(w[i], beta_val[i], max_beta[i], tg_hspset[i]) 
-                                
-                            if mode=='layer':                     
-                                beta=beta_val                      
-            
-                            elif mode=='node':                              
-                                # flatten beta_val (shape (3, 100) -> (300,))
-                                beta=[item for sublist in beta_val for item in sublist]
+                        # Fetch Hoyer's sparsness and beta from the graph once per epoch
+                        if hsp_in_graph==True:
+                            sparsity.hsp[...], sparsity.beta[...] = sess.run([Hsp, Beta])
                         
                         if autoencoder==False:
                             
-                            train_err_epoch=sess.run(error,{X:train_x, Y:train_y})
+                            [train_err_epoch]=evaluate(lambda x,y: sess.run([error],{X:x, Y:y}), train_x, train_y, eval_chunk)
                             plot_train_err=np.hstack([plot_train_err,[train_err_epoch]])
                             
-                            test_err_epoch=sess.run(error,{X:valid_x, Y:valid_y})
+                            [test_err_epoch]=evaluate(lambda x,y: sess.run([error],{X:x, Y:y}), valid_x, valid_y, eval_chunk)
                             plot_test_err=np.hstack([plot_test_err,[test_err_epoch]])
             
             
@@ -524,15 +691,31 @@ if condition==True:
                         # Save the results to plot at the end
                         plot_lr=np.hstack([plot_lr,[lr]])
                         plot_cost=np.hstack([plot_cost,[cost_epoch]])
+                        plot_beta_lag.append(hsp_schedule.lag_summary()[0])
                         
                         if mode=='layer':
-                            plot_hsp=[np.vstack([plot_hsp[i],[hsp_val[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
-                            plot_beta=[np.vstack([plot_beta[i],[beta[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                            plot_hsp=[np.vstack([plot_hsp[i],[sparsity.hsp[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                            plot_beta=[np.vstack([plot_beta[i],[sparsity.beta[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
                             
                         elif mode=='node':
-                            plot_hsp=[np.vstack([plot_hsp[i],[np.transpose(hsp_val[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
-                            plot_beta=[np.vstack([plot_beta[i],[np.transpose(beta_val[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                            plot_hsp=[np.vstack([plot_hsp[i],[np.transpose(sparsity.layer_hsp[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                            plot_beta=[np.vstack([plot_beta[i],[np.transpose(sparsity.layer_beta[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
             
+                        # End the fit when the validation error stopped decreasing (keeps a copy of the weights of the lowest error)
+                        if (stopping is not None) and stopping.update(test_err_epoch if autoencoder==False else cost_epoch,
+                                                                      sparsity.layer_hsp, sparsity.layer_beta, lambda: sess.run(w+b)):
+                            break
+                    
+                    # Restore the weights of the lowest validation error, whose error is the error of this inner fold
+                    valid_err = plot_test_err[-1]
+                    if stopping is not None:
+                        print(stopping.summary())
+                        if stopping.best_params is not None:
+                            for var, value in zip(w+b, stopping.best_params):
+                                var.load(value, sess)
+                            if autoencoder==False:
+                                valid_err = stopping.best_value
+                        inner_best_epochs.append(stopping.best_epoch if stopping.best_params is not None else stopping.epoch)
                         
        
                     ######################################## Inner validate ################################################   
@@ -618,7 +801,9 @@ if condition==True:
                     print("")
                     print(">>>> (", np.argwhere([tg_hspset==i for i in tg_hspset_list])[0][0]+1 ,") Target hsp",tg_hspset ,"<<<<")
                     print("outer fold :",outer+1,"/",k_folds," &  inner fold :",np.argwhere(outer_train_list==inner)[0][0]+1,"/",k_folds-1)
-                    print("Accuracy :","{:.3f}".format(1-plot_test_err[-1]))
+                    print("Accuracy :","{:.3f}".format(1-valid_err))
+                    if hsp_async==True:
+                        print("beta lag : mean %.1f minibatches"%np.mean(plot_beta_lag))
                     
                     if mode=='layer':
                         print("beta :",['%.3f' %plot_beta[i][-1][0] for i in np.arange(np.shape(n_nodes)[0]-2)], " / hsp :",['%.3f' %plot_hsp[i][-1][0] for i in np.arange(np.shape(n_nodes)[0]-2)])
@@ -626,7 +811,7 @@ if condition==True:
                         print("beta :",['%.3f' %plot_beta[i][-1][0] for i in np.arange(np.shape(n_nodes)[0]-2)], " / hsp :",['%.3f' %np.mean(plot_hsp[i][-1]) for i in np.arange(np.shape(n_nodes)[0]-2)])
                     print(" ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~")
                         
-                    avg_err+=plot_test_err[-1]/np.size(outer_train_list)
+                    avg_err+=valid_err/np.size(outer_train_list)
                     
                     
                     
@@ -639,6 +824,7 @@ if condition==True:
                     sio.savemat(final_directory+"/result_validation_err.mat", mdict={'validationErr': plot_test_err})
                     sio.savemat(final_directory+"/result_beta.mat", mdict={'beta': plot_beta})
                     sio.savemat(final_directory+"/result_hsp.mat", mdict={'hsp': plot_hsp})
+                    sio.savemat(final_directory+"/result_beta_lag.mat", mdict={'beta_lag': plot_beta_lag})
                     sio.savemat(final_directory+"/result_init_weight.mat", mdict={'init_weight':sess.run(w_init)})
                     sio.savemat(final_directory+"/result_weight.mat", mdict={'weight':sess.run(w)})
                     sio.savemat(final_directory+"/result_init_bias.mat", mdict={'init_bias':sess.run(b_init)})
@@ -653,9 +839,13 @@ if condition==True:
                     
                     
                     sess.run(init)
-                    lr, beta_val, beta, hsp_val, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
+                    hsp_schedule.reset()
+                    sparsity.reset()
+                    lr, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
                     
                 error_list.append(avg_err)
+                if stopping is not None:
+                    best_epoch_list.append(np.mean(inner_best_epochs))
                 print("")
                 print("##############################################################################")
                 print("# Avg validation error on this iteration for (", np.argwhere([tg_hspset==i for i in tg_hspset_list])[0][0]+1 ,")",tg_hspset,"is" ,"{:.4f}".format(avg_err),"#")
@@ -668,36 +858,37 @@ if condition==True:
             where_is_best=np.argmin(error_list)
             # store selected set in a list
             tg_hsp_selected_list.append(tg_hspset_list[where_is_best])
+            # number of epochs of the outer fit
+            outer_epochs = n_epochs if stopping is None else max(1, int(round(best_epoch_list[where_is_best])))
             
         
             ######################################## Outer train ################################################ 
                          
-            train_x = []
-            train_y = []
-            valid_x = []
-            valid_y = []
-                   
-
             # make training data set
-            for j in outer_train_list:
-                if np.size(train_x) == 0 & np.size(train_y) == 0:
-                    train_x = total_x[j*num_1fold:(j+1) * num_1fold]
-                    train_y = total_y[j*num_1fold:(j+1) * num_1fold]
-                else:
-                    train_x = np.vstack([train_x, total_x[j * num_1fold:(j+1) * num_1fold]])
-                    train_y = np.vstack([train_y, total_y[j * num_1fold:(j+1) * num_1fold]])
-
-            test_x = total_x[outer*num_1fold : (outer+1)*num_1fold]
-            test_y = total_y[outer*num_1fold : (outer+1)*num_1fold]
-
-            train_predict_ans=np.zeros((n_epochs,np.size(train_y, axis=0)))
-            train_correct_ans=np.zeros((n_epochs,np.size(train_y, axis=0)))
-            test_predict_ans=np.zeros((n_epochs,np.size(test_y, axis=0)))
-            test_correct_ans=np.zeros((n_epochs,np.size(test_y, axis=0)))
+            train_x, train_y, test_x, test_y = make_fold(outer_train_list, outer)
+
+            train_predict_ans=np.zeros((outer_epochs,np.size(train_y, axis=0)))
+            train_correct_ans=np.zeros((outer_epochs,np.size(train_y, axis=0)))
+            test_predict_ans=np.zeros((outer_epochs,np.size(test_y, axis=0)))
+            test_correct_ans=np.zeros((outer_epochs,np.size(test_y, axis=0)))
+            
             
+            # the training set is never copied, the minibatches are gathered from a shuffled index
+            # (in the graph by the input pipeline, or into a batch buffer fed through feed_dict)
+            if input_pipeline==True:
+                total_batch = pipeline.start(sess, train_x, train_y)
+            else:
+                batches = BatchGatherer([train_x, train_y], batch_size)
+                total_batch = batches.n_batches
+            
+            # selected target sparsity
+            sparsity.set_target(tg_hsp_selected_list[-1])
+            
+            # lag of the applied beta (in minibatches) in each epoch
+            plot_beta_lag=[]
             
             # train and get cost    
-            for epoch in np.arange(n_epochs):            
+            for epoch in np.arange(outer_epochs):            
                 
                 # Begin Annealing
                 if beginAnneal == 0:
@@ -705,55 +896,53 @@ if condition==True:
                 elif epoch+1 > beginAnneal:
                     lr = max( lr_min, (-decay_rate*(epoch+1) + (1+decay_rate*beginAnneal)) * lr ) 
                     
-                # Shuffle training data at the begining of each epoch           
-                total_sample = np.size(train_y, axis=0)
-                sample_ids = np.arange(total_sample)
-                np.random.shuffle(sample_ids) 
-                
-                train_x = np.array([train_x[i] for i in sample_ids])
-                train_y = np.array([train_y[i] for i in sample_ids])
-                
-                    
-                    
-                # Calculate how many mini-batch iterations we need
-                total_batch=int(np.shape(train_y)[0]/batch_size) 
+                # Shuffle the order of the training samples at the begining of each epoch (the pipeline reshuffles by itself)           
+                if input_pipeline==False:
+                    batches.shuffle()
                 
                 cost_epoch=0.0
                 
                 # minibatch based training  
                 for batch in np.arange(total_batch):                       
-                    batch_x = train_x[batch*batch_size:(batch+1)*batch_size]
-                    batch_y = train_y[batch*batch_size:(batch+1)*batch_size]
+                    # the input pipeline feeds the minibatch through its iterator, otherwise feed the batch buffer
+                    if input_pipeline==True:
+                        batch_feed={}
+                    else:
+                        batch_x, batch_y = batches.batch(batch)
+                        batch_feed={X:batch_x} if autoencoder==True else {X:batch_x, Y:batch_y}
                     
-                    # Get cost and optimize the model
-                    if autoencoder==False:
-                        cost_batch,_=sess.run([cost,optimizer],{Lr:lr, X:batch_x, Y:batch_y, Beta:beta })
-                        
-                    else:                      
-                        cost_batch,_=sess.run([cost,optimizer],{Lr:lr, X:batch_x, Beta:beta })
+                    # Get cost, optimize the model and control the weight sparsity in one session call
+                    if hsp_in_graph==True:
+                        train_op=hsp_update if hsp_schedule.due(batch,total_batch) else optimizer
+                        cost_batch,_=sess.run([cost,train_op],{Lr:lr, Tg_hsp:tg_hsp_selected_list[-1], **batch_feed })
+                            
+                    # Get cost and optimize the model, then control the weight sparsity in NumPy
+                    else:
+                        cost_batch,_=sess.run([cost,optimizer],{Lr:lr, Beta:sparsity.beta, **batch_feed })
+        
+                        # weight sparsity control on a snapshot of every hidden layer (one session call)  
+                        if hsp_schedule.due(batch,total_batch):
+                            hsp_result=hsp_schedule.run(sparsity.hoyer, sess.run(w[:-1]))
+                        else:
+                            hsp_result=hsp_schedule.poll()
+                            
+                        # update beta of every hidden layer at once
+                        if hsp_result is not None:
+                            sparsity.apply(hsp_result)
                         
                     cost_epoch+=cost_batch/total_batch        
                 
-            
-
-                    # weight sparsity control  
-                    for i in np.arange(np.shape(n_nodes)[0]-2):
-                        [hsp_val[i], beta_val[i]] = Hoyers_sparsity_control(w[i], beta_val[i], max_beta[i], tg_hsp_selected_list[-1][i])  
-                    
-                    if mode=='layer':                                            
-                        beta=beta_val                      
-    
-                    elif mode=='node':                             
-                        # flatten beta_val (shape (3, 100) -> (300,))
-                        beta=[item for sublist in beta_val for item in sublist]
+                # Fetch Hoyer's sparsness and beta from the graph once per epoch
+                if hsp_in_graph==True:
+                    sparsity.hsp[...], sparsity.beta[...] = sess.run([Hsp, Beta])
 
                 
                 if autoencoder==False:            
                     
-                    [train_err_epoch,train_predict_ans[epoch],train_correct_ans[epoch]]=sess.run([error,predict_ans,correct_ans],{X:train_x, Y:train_y})
+                    [train_err_epoch,train_predict_ans[epoch],train_correct_ans[epoch]]=evaluate(lambda x,y: sess.run([error,predict_ans,correct_ans],{X:x, Y:y}), train_x, train_y, eval_chunk)
                     plot_train_err=np.hstack([plot_train_err,[train_err_epoch]])
                     
-                    [test_err_epoch,test_predict_ans[epoch],test_correct_ans[epoch]]=sess.run([error,predict_ans,correct_ans],{X:test_x, Y:test_y})
+                    [test_err_epoch,test_predict_ans[epoch],test_correct_ans[epoch]]=evaluate(lambda x,y: sess.run([error,predict_ans,correct_ans],{X:x, Y:y}), test_x, test_y, eval_chunk)
                     plot_test_err=np.hstack([plot_test_err,[test_err_epoch]])
                     
  
@@ -761,15 +950,16 @@ if condition==True:
                 # Save the results to plot at the end
                 plot_lr=np.hstack([plot_lr,[lr]])
                 plot_cost=np.hstack([plot_cost,[cost_epoch]])
+                plot_beta_lag.append(hsp_schedule.lag_summary()[0])
                 
           
                 if mode=='layer':
-                    plot_hsp=[np.vstack([plot_hsp[i],[hsp_val[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
-                    plot_beta=[np.vstack([plot_beta[i],[beta[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                    plot_hsp=[np.vstack([plot_hsp[i],[sparsity.hsp[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                    plot_beta=[np.vstack([plot_beta[i],[sparsity.beta[i]]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
                     
                 elif mode=='node':
-                    plot_hsp=[np.vstack([plot_hsp[i],[np.transpose(hsp_val[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
-                    plot_beta=[np.vstack([plot_beta[i],[np.transpose(beta_val[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                    plot_hsp=[np.vstack([plot_hsp[i],[np.transpose(sparsity.layer_hsp[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
+                    plot_beta=[np.vstack([plot_beta[i],[np.transpose(sparsity.layer_beta[i])]]) for i in np.arange(np.shape(n_nodes)[0]-2)]
             
 
          
@@ -858,7 +1048,11 @@ if condition==True:
             print("")
             print(">>>> (Selected) Target hsp",tg_hsp_selected_list[-1] ,"<<<<")
             print("outer fold :",outer+1,"/",k_folds)
+            if stopping is not None:
+                print("epochs :",outer_epochs,"(mean best epoch of the inner fits)")
             print("Accuracy :","{:.3f}".format(1-plot_test_err[-1]))
+            if hsp_async==True:
+                print("beta lag : mean %.1f minibatches"%np.mean(plot_beta_lag))
             
             if mode=='layer':
                 print("beta :",['%.3f' %plot_beta[i][-1][0] for i in np.arange(np.shape(n_nodes)[0]-2)], " / hsp :",['%.3f' %plot_hsp[i][-1][0] for i in np.arange(np.shape(n_nodes)[0]-2)])
@@ -875,14 +1069,27 @@ if condition==True:
             sio.savemat(final_directory+"/result_test_err.mat", mdict={'testErr': plot_test_err})
             sio.savemat(final_directory+"/result_beta.mat", mdict={'beta': plot_beta})
             sio.savemat(final_directory+"/result_hsp.mat", mdict={'hsp': plot_hsp})
+            sio.savemat(final_directory+"/result_beta_lag.mat", mdict={'beta_lag': plot_beta_lag})
             sio.savemat(final_directory+"/result_weight.mat", mdict={'weight':sess.run(w)})
             sio.savemat(final_directory+"/result_init_weight.mat", mdict={'init_weight':sess.run(w_init)})
             sio.savemat(final_directory+"/result_bias.mat", mdict={'bias':sess.run(b)})
             sio.savemat(final_directory+"/result_init_bias.mat", mdict={'init_bias':sess.run(b_init)})
+            if projection is not None:
+                # the first layer on the voxels, with the projection fitted on the training folds of this outer fold
+                outer_projection = fold_projections[outer, tuple(int(j) for j in outer_train_list)]
+                [w1, b1] = sess.run([w[0], b[0]])
+                sio.savemat(final_directory+"/result_voxel_weight.mat", mdict={'w1_voxel':outer_projection.voxel_weights(w1),
+                                                                               'b1_voxel':outer_projection.voxel_bias(w1, b1)})
             sio.savemat(final_directory+"/train_predict_ans.mat", mdict={'train_predict_ans':train_predict_ans})
             sio.savemat(final_directory+"/train_correct_ans.mat", mdict={'train_correct_ans':train_correct_ans})
             sio.savemat(final_directory+"/test_predict_ans.mat", mdict={'test_predict_ans':test_predict_ans})
             sio.savemat(final_directory+"/test_correct_ans.mat", mdict={'test_correct_ans':test_correct_ans})
+            
+            # Sparse export of the trained network for prediction with NumPy/SciPy
+            if (sparse_export==True) & (autoencoder==False):
+                report=export_sparse(final_directory+"/result_sparse_weight.mat", sess.run(w), sess.run(b), test_x, np.argmax(test_y,1),
+                                     'tanh', mode=='node', sparse_keep_scale)
+                print_report(report)
 
             # save time 
             f = open(final_directory+"/time_info.txt",'w')           # opens file with name of "time_info.txt"
@@ -894,10 +1101,14 @@ if condition==True:
             date_array.append(str(timeit.time.ctime()))
             
             sess.run(init)
-            lr, beta_val, beta, hsp_val, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
+            hsp_schedule.reset()
+            sparsity.reset()
+            lr, plot_beta, plot_hsp, plot_lr, plot_cost, plot_train_err, plot_test_err = init_otherVariables()
             
                                          
 
+        hsp_schedule.close()
+        
         # 7th element of date_array
         date_array.append(str(timeit.time.ctime()))
         end_time = timeit.default_timer()
@@ -30,44 +30,42 @@ try:
 except ImportError:
         from io import StringIO
 
-from numpy import linalg as LA # Linear algebra module for calculating L1 and L2 norm  
+# To import the shared dnnwsp modules from the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.sparsity import SparsityControl # Weight sparsity control of all hidden layers with one beta buffer
+from dnnwsp.schedule import HspSchedule # How often (and in which thread) the weight sparsity control runs
+from dnnwsp.inference import export_sparse, print_report # Sparse export of the trained network for prediction
+from dnnwsp import pruning # Structured pruning of dead hidden nodes
+from dnnwsp.dataset import load_dataset # Memory-mapped datasets (a directory made by python -m dnnwsp.dataset) or .mat files
+from dnnwsp.streaming import ShardStream # Out-of-core training on a shard directory (python -m dnnwsp.streaming)
+from dnnwsp.epoch_scan import scan_epoch as compile_scan_epoch # All minibatches of an epoch in one theano.scan call
+from dnnwsp.parallel import DataParallelMLP # Gradients of the shards of each minibatch in worker processes (NumPy engine)
+from dnnwsp.precision import PrecisionPolicy # Storage and compute dtypes with a dtype audit
+from dnnwsp.projection import InputProjection, project_datasets # PCA, randomized SVD or sparse random projection of the voxels
+from dnnwsp.cache import PreprocessCache # Cache of the projected samples, keyed by the content of the data file
+from dnnwsp.stopping import EarlyStopping # Early stopping once Hoyer's sparseness and beta have converged
+from dnnwsp.evaluation import evaluate # Evaluation of whole data sets in chunks
 
 ########################################## Function definition #################################################
 
 # Define the node-wise or layer-wise control of weight sparsity via Hoyer sparseness
 # (Hoyer, 2014, Kim and Lee PRNI2016, Kim and Lee ICASSP 2017)
-def hsp_fnc(beta_val_L1, W, max_beta, tg_hsp, beta_lrate,flag_nodewise):
-    W = np.array(W.get_value(borrow=True));
-    
-    cnt_L1_ly = beta_val_L1;
+# as Theano updates (the same rule as dnnwsp.sparsity), so that it runs inside the compiled training function
+# beta and hsp are shared variables (a vector for the node-wise control, a scalar for the layer-wise control)
+# W is the expression of the weight after the optimizer step
+def hsp_updates(beta, hsp, W, n_in, n_out, max_beta, tg_hsp, beta_lrate, flag_nodewise):
     
     if flag_nodewise==1:
-        
-        [dim, nodes] = W.shape # data dimensionaltiy x number of nodes 
-        hsp_vec = np.zeros((1,nodes));  
-        tg_hsp_vec = np.ones(nodes)*tg_hsp;
-        sqrt_nsamps = pow(dim,0.5)
-        n1_W = LA.norm(W,1,axis=0);    n2_W = LA.norm(W,2,axis=0);
-        hsp_vec = (sqrt_nsamps - (n1_W/n2_W))/(sqrt_nsamps-1)
-        cnt_L1_ly -= beta_lrate*np.sign(hsp_vec-tg_hsp_vec)
-
-        for ii in range(0,nodes):
-            cnt_L1_ly[ii] = 0 if cnt_L1_ly[ii] < 0 else cnt_L1_ly[ii]
-            cnt_L1_ly[ii] = max_beta if cnt_L1_ly[ii]>max_beta else cnt_L1_ly[ii]
-            
-        return [hsp_vec, cnt_L1_ly]
+        sqrt_nsamps = pow(n_in,0.5)
+        n1_W = abs(W).sum(axis=0);    n2_W = T.sqrt((W ** 2).sum(axis=0));
     else:
+        sqrt_nsamps = pow(n_in*n_out,0.5)
+        n1_W = abs(W).sum();    n2_W = T.sqrt((W ** 2).sum());
         
-        Wvec = W.flatten(); # vectorize weight matrix 
-        sqrt_nsamps = pow((Wvec.shape[0]),0.5)
-        n1_W = LA.norm(Wvec,1);    n2_W = LA.norm(Wvec,2);
-        hspvalue = (sqrt_nsamps-(n1_W/n2_W))/(sqrt_nsamps-1);
-        cnt_L1_ly -= beta_lrate*np.sign(hspvalue-tg_hsp) 
-        
-        cnt_L1_ly = 0 if cnt_L1_ly<0 else cnt_L1_ly
-        cnt_L1_ly = max_beta if cnt_L1_ly>max_beta else cnt_L1_ly
-
-        return [hspvalue, cnt_L1_ly]
+    hsp_new = (sqrt_nsamps - (n1_W/n2_W))/(sqrt_nsamps-1)
+    beta_new = T.clip(beta - beta_lrate*T.sgn(hsp_new-tg_hsp), 0, max_beta)
+    
+    return [(hsp, T.cast(hsp_new, hsp.dtype)), (beta, T.cast(beta_new, beta.dtype))]
 
 # Define a rectified linear unit 
 def relu1(x):
@@ -140,7 +138,7 @@ class HiddenLayer(object):
                 ),
                 dtype=theano.config.floatX
             )
-        W = theano.shared(value=W_values, name='W', borrow=True)
+            W = theano.shared(value=W_values, name='W', borrow=True)
             
         if b is None:
             b_values = numpy.zeros((n_out,), dtype=theano.config.floatX)
@@ -162,7 +160,14 @@ class HiddenLayer(object):
 
 class MLP(object):
     
-    def __init__(self, rng, input, n_nodes, activation=T.nnet.sigmoid):
+    def __init__(self, rng, input, n_nodes, activation=T.nnet.sigmoid, init_params=None):
+        
+        # init_params: [W, b] values of every layer to start from (e.g. a pruned network), or None
+        if init_params is None:
+            init_W = [None]*(len(n_nodes)-1); init_b = [None]*(len(n_nodes)-1);
+        else:
+            init_W = [theano.shared(numpy.asarray(W, dtype=theano.config.floatX), name='W', borrow=True) for W, b in init_params]
+            init_b = [theano.shared(numpy.asarray(numpy.ravel(b), dtype=theano.config.floatX), name='b', borrow=True) for W, b in init_params]
 
         if len(n_nodes) > 2:
             self.hiddenLayer = []
@@ -180,8 +185,8 @@ class MLP(object):
                         input=hidden_input,
                         n_in=n_nodes[i],
                         n_out=n_nodes[i+1],
-                        W=None,
-                        b=None,
+                        W=init_W[i],
+                        b=init_b[i],
                         activation=activation
                     )
                 )
@@ -195,7 +200,9 @@ class MLP(object):
         self.logRegressionLayer = LogisticRegression(
             input=logistic_input,
             n_in=n_nodes[len(n_nodes)-2],
-            n_out=n_nodes[len(n_nodes)-1]
+            n_out=n_nodes[len(n_nodes)-1],
+            W=init_W[len(n_nodes)-2],
+            b=init_b[len(n_nodes)-2]
         )
         
         self.L1 = []
@@ -229,10 +236,54 @@ class MLP(object):
         # keep track of model input
         self.input = input
         
+# Fine-tune a network (e.g. the pruned one) by gradient descent with momentum, with the L1 penalty of the final
+# beta of every hidden layer held fixed (L1_betas: a scalar per layer, or a vector per layer for the node-wise control)
+# returns the fine-tuned [W, b] of every layer and the test accuracy
+def finetune_mlp(init_params, train_x, train_y, test_x, test_y, activation, L1_betas, flag_nodewise,
+                 batch_size, n_epochs, learning_rate, momentum_val, L2_reg):
+    
+    n_nodes = [numpy.shape(init_params[0][0])[0]] + [numpy.shape(W)[1] for W, b in init_params]
+    index = T.lscalar();    x = T.matrix('x');    y = T.ivector('y');
+    classifier = MLP(rng=numpy.random.RandomState(1234), input=x, n_nodes=n_nodes, activation=activation, init_params=init_params)
+    
+    cost = classifier.negative_log_likelihood(y) + L2_reg * classifier.L2_sqr
+    for i in range(len(n_nodes)-2):
+        if flag_nodewise==1:
+            cost += (T.dot(abs(classifier.hiddenLayer[i].W), numpy.asarray(L1_betas[i], dtype=theano.config.floatX))).sum()
+        else:
+            cost += numpy.asarray(numpy.mean(L1_betas[i]), dtype=theano.config.floatX) * classifier.L1[i]
+    
+    updates = []
+    for param, gparam, oldparam in zip(classifier.params, T.grad(cost, classifier.params), classifier.oldparams):
+        delta = learning_rate * gparam + momentum_val * oldparam
+        updates.append((param, param - delta))
+        updates.append((oldparam, delta))
+    
+    train_set_x = theano.shared(numpy.asarray(train_x, dtype=theano.config.floatX), borrow=True)
+    train_set_y = theano.shared(numpy.asarray(numpy.ravel(train_y), dtype='int32'), borrow=True)
+    train_model = theano.function(
+        inputs=[index],
+        outputs=cost,
+        updates=updates,
+        givens={
+            x: train_set_x[index * batch_size: (index + 1) * batch_size],
+            y: train_set_y[index * batch_size: (index + 1) * batch_size]
+        }
+    )
+    test_model = theano.function(inputs=[x, y], outputs=classifier.errors(y), allow_input_downcast = True)
+    
+    n_train_batches = int(numpy.shape(train_x)[0] / batch_size)
+    for epoch in range(n_epochs):
+        for minibatch_index in range(n_train_batches):
+            train_model(minibatch_index)
+    
+    [test_error] = evaluate(lambda xb, yb: [test_model(xb, yb)], test_x, numpy.asarray(numpy.ravel(test_y), dtype='int32'), batch_size)
+    return [[classifier.params[2*i].get_value(), classifier.params[2*i+1].get_value()] for i in range(len(n_nodes)-1)], 1 - test_error
+
 ########################################## Parameters of dnnwsp #################################################
         
 def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
-             datasets='lhrhadvs_sample_data.mat',  # load data
+             datasets='lhrhadvs_sample_data.mat',  # load data (.mat file or a dataset directory made by python -m dnnwsp.dataset)
              
              # activation:  # sigmoid function: T.nnet.sigmoid, hyperbolic tangent function: T.tanh, Rectified Linear Unit: relu1
              batch_size = 40, n_epochs = 300, learning_rate=0.001,activation = T.tanh,
@@ -255,14 +306,87 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
              # flag_nodewise =0 is the layer-wise control of weight sparsity
             
              flag_nodewise = 0,
+             
+             # hsp_in_graph =1 updates beta inside the compiled training function (no weight copies per minibatch)
+             # hsp_in_graph =0 copies the weights with get_value and updates beta in NumPy after each minibatch
+             hsp_in_graph = 1,
+             
+             # hsp_every: recompute beta every k minibatches (1: after every minibatch) or 'epoch' (once per epoch)
+             # hsp_async =1 computes Hoyer's sparseness in a background thread on a copy of the weights
+             # while the next minibatches train (needs hsp_in_graph =0)
+             hsp_every = 1, hsp_async = 0,
+             
+             # sparse_export =1 also saves the hidden layers as sparse matrices (mlp_rst_*_sparse.mat) after thresholding
+             # the weights by the achieved Hoyer's sparseness, and prints the accuracy drift against the dense model
+             # sparse_keep_scale: keep sparse_keep_scale times the number of nonzeros implied by Hoyer's sparseness
+             sparse_export = 0, sparse_keep_scale = 1.0,
+             
+             # prune_nodes =1 removes the dead hidden nodes after training (weight norms and Hoyer's sparseness traces),
+             # prints the size, FLOPs and accuracy of the shrunken network, fine-tunes it for prune_finetune_epochs with the
+             # final beta held fixed (finetune_mlp) and saves it to mlp_rst_*_pruned.mat
+             # prune_norm_tol: a node is dead below this fraction of the median |W_in|*|W_out| of the layer
+             # prune_hsp_tol: a node is dead if its mean Hoyer's sparseness over the last 10 epochs is above it
+             prune_nodes = 0, prune_finetune_epochs = 50, prune_norm_tol = 1e-2, prune_hsp_tol = 0.98,
+             
+             # [W, b] values of every layer to start from (e.g. the pruned network), or None for random initialization
+             init_params = None,
+             
+             # stream_data: a shard directory (python -m dnnwsp.streaming) to train on a training set larger than memory,
+             # read from disk in every epoch instead of train_x and train_y of datasets, or None
+             # stream_buffer: number of samples shuffled together (the order of the shards is shuffled in every epoch)
+             stream_data = None, stream_buffer = 2000,
+             
+             # eval_every: evaluate the test set every k training minibatches, or 'epoch' (after the last minibatch of each epoch)
+             # capture_activations =1 stores the linear output of each hidden layer (chk_pre_output) in every test call
+             eval_every = 'epoch', capture_activations = 0,
+             
+             # scan_epoch =1 trains all minibatches of an epoch in one call of a theano.scan function
+             # (the optimizer and the in-graph weight sparsity control run inside the scan; needs hsp_in_graph =1)
+             scan_epoch = 0,
+             
+             # parallel_workers >0 trains with this number of worker processes, each computing the gradients of a shard
+             # of every minibatch with the NumPy engine; the averaged gradients update one copy of the weights in shared
+             # memory (needs hsp_in_graph =0, the weight sparsity control runs once per step on these weights)
+             parallel_workers = 0,
+             
+             # precision: None keeps theano.config.floatX everywhere, 'float32', or 'float16' (the samples are stored in float16
+             # and every minibatch is upcast to float32); needs floatX to be the compute dtype (float32)
+             # the dtypes of the graph are audited when it is built and beta and Hoyer's sparseness after every epoch,
+             # the run fails if anything is silently upcast
+             precision = None,
+             
+             # projection: None, or 'pca', 'randomized_svd' or 'sparse_random' to train on projection_components features
+             # of the voxels, fitted on train_x only (dnnwsp.projection); n_nodes[0] becomes projection_components and the first
+             # layer is also saved on the voxels (w1_voxel, b1_voxel) for interpretation
+             # projection_cache =1 keeps the projected samples on local disk (~/.cache/dnnwsp) for the next runs
+             projection = None, projection_components = 200, projection_cache = 1,
+             
+             # early_stopping >0 ends training (done_looping) after early_stopping epochs without a decrease of the training cost,
+             # counted once Hoyer's sparseness of every hidden layer is within hsp_tol of tg_hspset and the mean beta of every
+             # layer moved by at most beta_tol between two windows of 5 epochs (dnnwsp.stopping), and restores the weights of
+             # the lowest cost; test_mlp has no validation set, so the test error is never used to stop
+             early_stopping = 0, hsp_tol = 0.05, beta_tol = 0.01,
              # Save path  
              sav_path = '/Users/bspl/Downloads/dnnwsp-master/Theano_code', # a directory to save dnnwsp result  
               ):
+    
                
     ########################################## Input data  #################################################
 
+    precision_policy = PrecisionPolicy(precision if precision is not None else theano.config.floatX)
+    if precision_policy.compute_dtype != theano.config.floatX:
+        raise ValueError('precision=%r computes in %s, run Theano with floatX=%s' % (precision, precision_policy.compute_dtype, precision_policy.compute_dtype))
         
-    datasets=sio.loadmat(datasets) # load datasets
+    data_file = datasets
+    datasets=load_dataset(data_file) # load datasets (a dataset directory is memory-mapped in float32)
+    
+    # project the voxels onto projection_components features, fitted on train_x only
+    if projection is not None:
+        if stream_data is not None:
+            raise ValueError('the input projection is fitted on train_x, it needs stream_data=None')
+        [datasets, input_projection] = project_datasets(datasets, InputProjection(projection, projection_components), dtype=precision_policy.storage_dtype,
+                                                        cache=PreprocessCache() if projection_cache==1 else None, sources=data_file)
+        n_nodes = [projection_components] + list(n_nodes[1:])
     
     ############# lhrhadvs_sample_data.mat #############
     # train_x  = 240 volumes x 74484 voxels  
@@ -271,17 +395,29 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
     # test_y  = 120 volumes x 1 [0:left-hand clenching task, 1:right-hand clenching task, 2:auditory task, 3:visual task]
     ############################################################
 
-    train_x = datasets['train_x'];     train_y = datasets['train_y'];
     test_x  = datasets['test_x'];    test_y  = datasets['test_y'];
     
-    train_set_x = theano.shared(numpy.asarray(train_x, dtype=theano.config.floatX))
-    train_set_y = T.cast(theano.shared(train_y.flatten(),borrow=True),'int32')
+    if stream_data is None:
+        train_x = datasets['train_x'];     train_y = datasets['train_y'];
+        
+        # borrow the float32 array (no second copy of the data)
+        train_set_x = theano.shared(precision_policy.store(train_x), borrow=True)
+        train_set_y = T.cast(theano.shared(train_y.flatten(),borrow=True),'int32')
+        n_train_batches = int(train_set_x.get_value(borrow=True).shape[0] / batch_size)
+    else:
+        # the training set is read shard by shard in every epoch, the shared variables hold the current minibatch
+        train_stream = ShardStream(stream_data, batch_size, stream_buffer)
+        train_set_x = theano.shared(numpy.zeros((batch_size, n_nodes[0]), dtype=theano.config.floatX), borrow=True)
+        train_batch_y = theano.shared(numpy.zeros(batch_size, dtype='int32'), borrow=True)
+        train_set_y = T.cast(train_batch_y,'int32')
+        n_train_batches = train_stream.n_batches
     
-    test_set_x = theano.shared(numpy.asarray(test_x, dtype=theano.config.floatX))
+    test_set_x = theano.shared(precision_policy.store(test_x), borrow=True)
+    if precision_policy.name != 'float32':
+        print(precision_policy.describe(train_x=train_set_x.get_value(borrow=True), test_x=test_set_x.get_value(borrow=True)))
     test_set_y = T.cast(theano.shared(test_y.flatten(),borrow=True),'int32')
 
-    # compute number of minibatches for training, validation and testing
-    n_train_batches = int(train_set_x.get_value(borrow=True).shape[0] / batch_size)
+    # compute number of minibatches for testing
     n_test_batches = int(test_set_x.get_value(borrow=True).shape[0] / batch_size)
 
                    
@@ -306,19 +442,36 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
         input=x,
         n_nodes = n_nodes,
         activation = activation,
+        init_params = init_params,
     )
 
     # cost function
     cost = (classifier.negative_log_likelihood(y))
     
+    # Beta and Hoyer's sparseness of every hidden layer for the NumPy control (sparsity.beta is fed to l1_penalty_layer,
+    # sparsity.layer_beta[i] and sparsity.layer_hsp[i] are the parts of the i-th hidden layer)
+    sparsity = SparsityControl(n_nodes[1:-1], tg_hspset, max_beta, beta_lrates, nodewise=(flag_nodewise==1), dtype=precision_policy.compute_dtype)
+    
+    # L1-norm regularization parameter of each hidden layer 
+    L1_beta = []; hsp_shared = [];
+    for i in range(len(n_nodes)-2):
+        if hsp_in_graph==1:
+            # shared variables updated by the compiled training function
+            beta_shape = (n_nodes[i+1],) if flag_nodewise==1 else ()
+            L1_beta.append(theano.shared(numpy.zeros(beta_shape, dtype=theano.config.floatX), name='beta_l%d' % (i+1)))
+            hsp_shared.append(theano.shared(numpy.zeros(beta_shape, dtype=theano.config.floatX), name='hsp_l%d' % (i+1)))
+        elif flag_nodewise==1:
+            L1_beta.append(l1_penalty_layer[sparsity.index[i]:sparsity.index[i+1]])
+        else:
+            L1_beta.append(l1_penalty_layer[i])
+    
     # L1 regularization term for either node-wise or layer-wise control 
     if flag_nodewise==1:
         for i in range(len(n_nodes)-2):
-            node_size = n_nodes[i+1]; tg_index = np.arange((i * node_size),((i + 1) * node_size));
-            cost += (T.dot(abs(classifier.hiddenLayer[i].W),l1_penalty_layer[tg_index])).sum();
+            cost += (T.dot(abs(classifier.hiddenLayer[i].W),L1_beta[i])).sum();
     else:
         for i in range(len(n_nodes)-2):
-            cost += l1_penalty_layer[i] * classifier.L1[i]
+            cost += L1_beta[i] * classifier.L1[i]
 
     # L2 regularization 
     cost += L2_reg * classifier.L2_sqr    
@@ -342,30 +495,92 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
         
     elif optimizer_algorithm=='Rmsp' :
         updates = RMSprop(cost, classifier.params, learning_rate)
+    
+    if hsp_async==1 and hsp_in_graph==1:
+        raise ValueError('the asynchronous sparsity control needs hsp_in_graph=0')
+    if eval_every != 'epoch' and (int(eval_every) != eval_every or eval_every < 1):
+        raise ValueError("eval_every should be a positive number of minibatches or 'epoch', got %r" % (eval_every,))
+    if scan_epoch==1 and (hsp_in_graph==0 or stream_data is not None or eval_every!='epoch'):
+        raise ValueError("scan_epoch=1 needs hsp_in_graph=1, stream_data=None and eval_every='epoch'")
+    if parallel_workers>0 and (hsp_in_graph==1 or stream_data is not None):
+        raise ValueError('parallel_workers>0 needs hsp_in_graph=0 and stream_data=None')
+    
+    # the samples in the storage dtype, the cost and every updated variable (weights, optimizer state, beta) in the compute dtype
+    precision_policy.audit('graph', {'train_x':train_set_x, 'test_x':test_set_x}, cost=cost,
+                           **dict(('update %d (%s)' % (k, var.name), new) for k, (var, new) in enumerate(updates)))
+    
+    # Node-wise or layer-wise control of weight sparsity on the updated weights, in the same call
+    opt_updates = list(updates)
+    if hsp_in_graph==1:
+        new_params = dict(updates)
+        for i in range(len(n_nodes)-2):
+            updates.extend(hsp_updates(L1_beta[i], hsp_shared[i], new_params[classifier.hiddenLayer[i].W],
+                                       n_nodes[i], n_nodes[i+1], max_beta[i], tg_hspset[i], beta_lrates, flag_nodewise))
+        train_inputs = [index, ln_rate, momentum]
+    else:
+        train_inputs = [index, l1_penalty_layer, ln_rate, momentum]
   
     train_model = theano.function(
-        inputs=[index, l1_penalty_layer,ln_rate,momentum],
+        inputs=train_inputs,
         outputs=[cost,classifier.errors(y),classifier.mse(batch_size,n_nodes[-1],y)],
         updates=updates,
         givens={
-            x: train_set_x[index * batch_size: (index + 1) * batch_size],
+            x: T.cast(train_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
             y: train_set_y[index * batch_size: (index + 1) * batch_size]
         },
         allow_input_downcast = True,
         on_unused_input = 'ignore'
     )
     
+    # The same step without the weight sparsity control, for the minibatches between two updates of beta
+    if hsp_in_graph==1 and hsp_every!=1:
+        train_model_nohsp = theano.function(
+            inputs=train_inputs,
+            outputs=[cost,classifier.errors(y),classifier.mse(batch_size,n_nodes[-1],y)],
+            updates=opt_updates,
+            givens={
+                x: T.cast(train_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
+                y: train_set_y[index * batch_size: (index + 1) * batch_size]
+            },
+            allow_input_downcast = True,
+            on_unused_input = 'ignore'
+        )
+    
+    # All minibatches of the epoch in one call, returns the cost, error and MSE of every minibatch
+    if scan_epoch==1:
+        train_epoch = compile_scan_epoch(
+            inputs=[ln_rate, momentum],
+            outputs=[cost,classifier.errors(y),classifier.mse(batch_size,n_nodes[-1],y)],
+            updates=opt_updates,
+            x=x, y=y, data_x=train_set_x, data_y=train_set_y,
+            batch_size=batch_size, n_batches=n_train_batches,
+            every_updates=updates[len(opt_updates):], every=hsp_every,
+            allow_input_downcast = True,
+            on_unused_input = 'ignore'
+        )
+    
+    # Worker processes for the data-parallel training, starting from the weights of the classifier
+    act_names = {T.tanh:'tanh', T.nnet.sigmoid:'sigmoid', relu1:'relu'}
+    if parallel_workers>0:
+        trainer = DataParallelMLP(parallel_workers, n_nodes, batch_size, act_names[activation], 'softmax', optimizer_algorithm,
+                                  flag_nodewise, L2_reg, [[classifier.params[2*i].get_value(), classifier.params[2*i+1].get_value()]
+                                                          for i in range(len(n_nodes)-1)])
+        trainer.start(train_set_x.get_value(borrow=True), numpy.asarray(train_y.flatten(), dtype='int32'), sparsity.sizes)
+    
+    # the activation capture is an extra update of every hidden layer in each test call
     updates_test = []
-    for hiddenlayer in classifier.hiddenLayer:
-        for i in range(1):
-            updates_test.append( hiddenlayer.updates[i] )
+    if capture_activations==1:
+        for hiddenlayer in classifier.hiddenLayer:
+            for i in range(1):
+                updates_test.append( hiddenlayer.updates[i] )
            
+    # error and MSE of a test minibatch in one call
     test_model = theano.function(
         inputs=[index],
         outputs=[classifier.errors(y),classifier.mse(batch_size,n_nodes[-1],y)],
         updates=updates_test,
         givens={
-            x: test_set_x[index * batch_size:(index + 1) * batch_size],
+            x: T.cast(test_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
             y: test_set_y[index * batch_size:(index + 1) * batch_size]
         }
     )
@@ -374,19 +589,44 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
 
     print('... training')
 
-    test_score = 0. 
+    test_score = 0.;    test_mse_score = 0.
+    
+    # copy the weights trained by the worker processes into the classifier
+    def load_parallel_weights():
+        for i in range(len(n_nodes)-1):
+            classifier.params[2*i].set_value(numpy.array(trainer.W[i]))
+            classifier.params[2*i+1].set_value(numpy.array(trainer.b[i]))
+    
+    # copy of the current weights and biases, in the order of classifier.params (the master weights of the
+    # worker processes, which the classifier only gets in test_all)
+    def current_params():
+        if parallel_workers>0:
+            return [numpy.array(p) for i in range(len(n_nodes)-1) for p in (trainer.W[i], trainer.b[i])]
+        return [param.get_value() for param in classifier.params]
+    
+    # mean error and MSE over the test minibatches
+    def test_all():
+        if parallel_workers>0:
+            load_parallel_weights()
+        test_losses = []; test_mses = []
+        for i in range(n_test_batches):
+            test_loss, test_mse_batch = test_model(i)
+            test_losses.append(test_loss)
+            test_mses.append(test_mse_batch)
+        return numpy.mean(test_losses), numpy.mean(test_mses)
     start_time = timeit.default_timer()
 
     epoch = 0;    done_looping = False
+    stopping = EarlyStopping(early_stopping, tg_hsp=tg_hspset, hsp_tol=hsp_tol, beta_tol=beta_tol) if early_stopping>0 else None
     
     # Define variables to save/check training model 
     train_errors = np.zeros(n_epochs);    test_errors = np.zeros(n_epochs);
     train_mse = np.zeros(n_epochs);    test_mse = np.zeros(n_epochs);
     lrs = np.zeros(n_epochs); lrate_list = np.zeros(n_epochs);
+    beta_lags = np.zeros(n_epochs); hsp_schedule = HspSchedule(hsp_every, hsp_async==1);
     
     if flag_nodewise==1:
         hsp_avg_vals =[]; L1_beta_avg_vals=[];  all_hsp_vals =[]; all_L1_beta_vals=[];
-        L1_beta_vals = np.zeros(np.sum(n_nodes[1:(len(n_nodes)-1)]));
         cnt_hsp_val = np.zeros(len(n_nodes)-2); 
         cnt_beta_val = np.zeros(len(n_nodes)-2);
         
@@ -400,7 +640,6 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
         all_hsp_vals = np.zeros((n_epochs,len(n_nodes)-2));  
         all_L1_beta_vals = np.zeros((n_epochs,len(n_nodes)-2));
         
-        L1_beta_vals= np.zeros(len(n_nodes)-2)
         cnt_hsp_val = np.zeros(len(n_nodes)-2);    
 
     ###################
@@ -408,33 +647,81 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
     ###################
     while (epoch < n_epochs) and (not done_looping):
         epoch = epoch + 1
-        minibatch_all_avg_error = []; minibatch_all_avg_mse = []
+        minibatch_all_avg_error = []; minibatch_all_avg_mse = []; minibatch_all_avg_cost = []
         
-        # minibatch based training
-        for minibatch_index in range(n_train_batches):
+        # chunked shuffle of the shards for this epoch
+        if stream_data is not None:
+            stream_batches = iter(train_stream)
+        
+        # the whole epoch in one call of the scan function
+        if scan_epoch==1:
             disply_text = StringIO();
-            minibatch_avg_cost, minibatch_avg_error, minibatch_avg_mse = train_model(minibatch_index, L1_beta_vals,learning_rate,momentum_val)
-            minibatch_all_avg_error.append(minibatch_avg_error)
-            minibatch_all_avg_mse.append(minibatch_avg_mse)
-             
-            # Node-wise or layer-wise control of weight sparsity 
+            batch_costs, batch_errors, batch_mses = train_epoch(learning_rate,momentum_val,(epoch-1)*n_train_batches)
+            minibatch_all_avg_error = list(batch_errors);    minibatch_all_avg_mse = list(batch_mses);    minibatch_all_avg_cost = list(batch_costs);
+            test_score, test_mse_score = test_all()
+        else:
+            # minibatch based training
+            for minibatch_index in range(n_train_batches):
+                disply_text = StringIO();
+                # a streamed minibatch is copied into the shared variables and is always minibatch 0
+                if stream_data is not None:
+                    batch_x, batch_y = next(stream_batches)
+                    train_set_x.set_value(numpy.asarray(batch_x, dtype=theano.config.floatX), borrow=True)
+                    train_batch_y.set_value(numpy.asarray(batch_y, dtype='int32'), borrow=True)
+                    batch_index = 0
+                else:
+                    batch_index = minibatch_index
+                # The weight sparsity control is part of train_model
+                if hsp_in_graph==1:
+                    if hsp_schedule.due(minibatch_index, n_train_batches):
+                        minibatch_avg_cost, minibatch_avg_error, minibatch_avg_mse = train_model(batch_index,learning_rate,momentum_val)
+                    else:
+                        minibatch_avg_cost, minibatch_avg_error, minibatch_avg_mse = train_model_nohsp(batch_index,learning_rate,momentum_val)
+                elif parallel_workers>0:
+                    minibatch_avg_cost, minibatch_avg_error, minibatch_avg_mse = trainer.step(batch_index, sparsity.layer_beta,learning_rate,momentum_val)
+                else:
+                    minibatch_avg_cost, minibatch_avg_error, minibatch_avg_mse = train_model(batch_index, sparsity.beta,learning_rate,momentum_val)
+                
+                if hsp_in_graph==0:
+                    # Node-wise or layer-wise control of weight sparsity (the asynchronous mode needs a copy of the weights)
+                    if hsp_schedule.due(minibatch_index, n_train_batches):
+                        if parallel_workers>0:
+                            W_list = [numpy.array(trainer.W[i], copy=(hsp_async==1)) for i in range(len(n_nodes)-2)]
+                        else:
+                            W_list = [classifier.hiddenLayer[i].W.get_value(borrow=(hsp_async==0)) for i in range(len(n_nodes)-2)]
+                        hsp_result = hsp_schedule.run(sparsity.hoyer, W_list)
+                    else:
+                        hsp_result = hsp_schedule.poll()
+                    
+                    # Update beta of every hidden layer at once
+                    if hsp_result is not None:
+                        sparsity.apply(hsp_result)
+                        
+                minibatch_all_avg_error.append(minibatch_avg_error)
+                minibatch_all_avg_cost.append(minibatch_avg_cost)
+                minibatch_all_avg_mse.append(minibatch_avg_mse)
+                
+                # iteration number
+                iter = (epoch - 1) * n_train_batches + minibatch_index
+                # test it on the test set (every eval_every minibatches, or after the last minibatch of the epoch)
+                if (eval_every=='epoch' and minibatch_index==n_train_batches-1) or (eval_every!='epoch' and (iter+1) % eval_every == 0):
+                    test_score, test_mse_score = test_all()
+        
+        # Read beta and Hoyer's sparseness of the last minibatch from the shared variables
+        if hsp_in_graph==1:
+            for i in range(len(n_nodes)-2):
+                sparsity.layer_hsp[i][...] = hsp_shared[i].get_value(borrow=True)
+                sparsity.layer_beta[i][...] = L1_beta[i].get_value(borrow=True)
+        
+        # the run fails if beta or Hoyer's sparseness were upcast during the epoch
+        precision_policy.audit('epoch %d' % epoch, beta=sparsity.beta, hsp=sparsity.hsp)
+                
+        for i in range(len(n_nodes)-2):
             if flag_nodewise==1:
-                for i in range(len(n_nodes)-2):
-                    node_size = n_nodes[i+1]; tg_index = np.arange((i * node_size),((i + 1) * node_size));
-                    [all_hsp_vals[i][epoch-1], L1_beta_vals[tg_index]] = hsp_fnc(L1_beta_vals[tg_index],classifier.hiddenLayer[i].W,max_beta[i],tg_hspset[i],beta_lrates,flag_nodewise);
-                    all_L1_beta_vals[i][epoch-1]= L1_beta_vals[tg_index];
+                all_hsp_vals[i][epoch-1] = sparsity.layer_hsp[i];
+                all_L1_beta_vals[i][epoch-1] = sparsity.layer_beta[i];
             else:
-                for i in range(len(n_nodes)-2):
-                    [cnt_hsp_val[i], L1_beta_vals[i]] = hsp_fnc(L1_beta_vals[i],classifier.hiddenLayer[i].W,max_beta[i],tg_hspset[i],beta_lrates,flag_nodewise);
-                
-            # iteration number
-            iter = (epoch - 1) * n_train_batches + minibatch_index
-            # test it on the test set
-            test_losses = []; test_mses = []
-            for i in range(n_test_batches):
-                test_losses.append(test_model(i)[0])
-                test_mses.append(test_model(i)[1])
-            test_score = numpy.mean(test_losses);
+                cnt_hsp_val[i] = sparsity.hsp[i];
              
         # Begin Annealing
         if beginAnneal == 0:
@@ -442,11 +729,14 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
         elif epoch > beginAnneal:
             learning_rate = max(min_annel_lrate, (-decay_rate*epoch + (1+decay_rate*beginAnneal)) * learning_rate )
             
+        # Mean lag of the applied beta (in minibatches)
+        [beta_lags[epoch-1], lag_max] = hsp_schedule.lag_summary()
+        
         # Save variables to check training
         train_errors[epoch-1] = np.mean(minibatch_all_avg_error)*100
         test_errors[epoch-1] = test_score*100
         train_mse[epoch-1] = np.mean(minibatch_all_avg_mse)
-        test_mse[epoch-1] = np.mean(test_mses)
+        test_mse[epoch-1] = test_mse_score
         
         # Node-wise or layer-wise control of weight sparsity to display the current state of training 
         if flag_nodewise ==1:
@@ -459,8 +749,8 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
             disply_text.write("Layer-wise control, epoch %i/%d, Tr.err= %.2f, Ts.err= %.2f, lr = %.6f, " % (epoch,n_epochs,train_errors[epoch-1],test_errors[epoch-1],learning_rate))
             
             all_hsp_vals[epoch-1,:] = cnt_hsp_val;
-            all_L1_beta_vals[epoch-1,:] = L1_beta_vals;
-            cnt_beta_val = L1_beta_vals;
+            all_L1_beta_vals[epoch-1,:] = sparsity.beta;
+            cnt_beta_val = sparsity.beta;
             
         for layer_idx in range(len(n_nodes)-2):
             if (layer_idx==len(n_nodes)-3):
@@ -468,11 +758,37 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
             else:
                 disply_text.write("hsp_l%d = %.2f/%.2f, beta_l%d = %.2f, " % (layer_idx+1,cnt_hsp_val[layer_idx],tg_hspset[layer_idx],layer_idx+1,cnt_beta_val[layer_idx]))
                     
+        if hsp_async==1:
+            disply_text.write(", beta lag = %.1f/%d" % (beta_lags[epoch-1],lag_max))
+            
         # Display variables                 
         print(disply_text.getvalue())
         disply_text.close()
         
         lrs[epoch-1] = learning_rate
+        
+        # End training once the sparsity has converged and the training cost stopped decreasing
+        if stopping is not None and stopping.update(np.mean(minibatch_all_avg_cost), sparsity.layer_hsp, sparsity.layer_beta, current_params):
+            done_looping = True
+
+    hsp_schedule.close()
+    if parallel_workers>0:
+        load_parallel_weights()
+        trainer.close()
+    
+    # Restore the weights of the lowest training cost after the convergence of the sparsity
+    test_score = test_errors[epoch-1]/100
+    if stopping is not None:
+        print(stopping.summary())
+        if stopping.best_params is not None:
+            for param, value in zip(classifier.params, stopping.best_params):
+                param.set_value(value)
+            if parallel_workers>0:
+                for i in range(len(n_nodes)-1):
+                    trainer.W[i][...] = stopping.best_params[2*i]
+                    trainer.b[i][...] = stopping.best_params[2*i+1]
+            test_score = test_all()[0]
+            print('restored the weights of epoch %d, Ts.err= %.2f' % (stopping.best_epoch, test_score*100))
 
     ########################################## Save variables #################################################
 
@@ -520,10 +836,54 @@ def test_mlp(n_nodes=[74484,100,100,100,4],  # input-hidden-nodees
     data_variable['beta_lrates'] = beta_lrates;    data_variable['max_beta'] = max_beta;    data_variable['tg_hspset'] = tg_hspset;
     data_variable['batch_size'] = batch_size;    data_variable['n_epochs'] = n_epochs;    data_variable['min_annel_lrate'] = min_annel_lrate;
     data_variable['n_nodes'] = n_nodes; data_variable['lrate_list'] = lrate_list;
+    data_variable['hsp_every'] = hsp_every; data_variable['hsp_async'] = hsp_async; data_variable['beta_lag'] = beta_lags;
+    data_variable['scan_epoch'] = scan_epoch; data_variable['parallel_workers'] = parallel_workers;
+    data_variable['precision'] = precision_policy.name;
+    data_variable['projection'] = str(projection); data_variable['projection_components'] = projection_components;
+    data_variable['early_stopping'] = early_stopping; data_variable['trained_epochs'] = epoch;
+    data_variable['best_epoch'] = stopping.best_epoch if stopping is not None else epoch;
+    if projection is not None:
+        # the first layer on the voxels
+        data_variable['w1_voxel'] = input_projection.voxel_weights(data_variable['w1'])
+        data_variable['b1_voxel'] = input_projection.voxel_bias(data_variable['w1'], data_variable['b1'])
     
     sio.savemat(sav_name,data_variable)
 
+    # Trained network for the NumPy/SciPy forward pass
+    weights = [data_variable["w%d" % (i+1)] for i in range(len(n_nodes)-1)]
+    biases = [data_variable["b%d" % (i+1)] for i in range(len(n_nodes)-1)]
+
+    # Sparse export of the trained network for prediction with NumPy/SciPy
+    if sparse_export==1:
+        report = export_sparse(sav_name.replace('.mat','_sparse.mat'), weights, biases, test_x, test_y,
+                               act_names[activation], flag_nodewise==1, sparse_keep_scale)
+        print_report(report)
+
+    # Remove the dead hidden nodes and fine-tune the shrunken network
+    if prune_nodes==1:
+        hsp_traces = all_hsp_vals if flag_nodewise==1 else None
+        
+        [pruned_weights, pruned_biases, report] = pruning.shrink_network(weights, biases, test_x, test_y, hsp_traces,
+                                                         act_names[activation], prune_norm_tol, prune_hsp_tol)
+        pruning.print_report(report)
+        
+        pruned_params = [[W, b] for W, b in zip(pruned_weights, pruned_biases)]
+        if prune_finetune_epochs > 0 and report['pruned_n_nodes'] != report['n_nodes'] and stream_data is None:
+            # the final beta of the nodes that are kept
+            L1_betas = [sparsity.layer_beta[i][~report['dead_masks'][i]] if flag_nodewise==1 else sparsity.layer_beta[i]
+                        for i in range(len(n_nodes)-2)]
+            [pruned_params, finetune_accuracy] = finetune_mlp(pruned_params, train_x, train_y, test_x, test_y, activation, L1_betas,
+                                                              flag_nodewise, batch_size, prune_finetune_epochs, learning_rate, momentum_val, L2_reg)
+            print('node pruning : fine-tuned accuracy %.3f' % finetune_accuracy)
+        
+        pruned_variable = {'n_nodes': report['pruned_n_nodes'], 'dead_nodes': report['dead_nodes']}
+        for i, (W, b) in enumerate(pruned_params):
+            pruned_variable["w%d" % (i+1)] = W;    pruned_variable["b%d" % (i+1)] = b;
+        sio.savemat(sav_name.replace('.mat','_pruned.mat'), pruned_variable)
+
     print('...done!')
+    
+    return 1 - test_score
 
 if __name__ == '__main__':
     test_mlp()
@@ -44,7 +44,7 @@ class LogisticRegression(object):
     determine a class membership probability.
     """
 
-    def __init__(self, input, n_in, n_out):
+    def __init__(self, input, n_in, n_out, W=None, b=None):
         """ Initialize the parameters of the logistic regression
 
         :type input: theano.tensor.TensorType
@@ -59,22 +59,30 @@ class LogisticRegression(object):
         :param n_out: number of output units, the dimension of the space in
                       which the labels lie
 
+        :type W: theano.tensor.sharedvar.TensorSharedVariable
+        :param W: initial weights (n_in x n_out), randomly initialized if None
+
+        :type b: theano.tensor.sharedvar.TensorSharedVariable
+        :param b: initial bias (n_out), zeros if None
+
         """
         rng = numpy.random.RandomState(1234)
 
-        W_values = numpy.asarray(
-                rng.uniform(
-                    low=-4 * numpy.sqrt(6. / (n_in + n_out)),
-                    high=4 * numpy.sqrt(6. / (n_in + n_out)),
-                    size=(n_in, n_out)
-                ),
-                dtype=theano.config.floatX
-            )
-        
-        W = theano.shared(value=W_values, name='W', borrow=True)
+        if W is None:
+            W_values = numpy.asarray(
+                    rng.uniform(
+                        low=-4 * numpy.sqrt(6. / (n_in + n_out)),
+                        high=4 * numpy.sqrt(6. / (n_in + n_out)),
+                        size=(n_in, n_out)
+                    ),
+                    dtype=theano.config.floatX
+                )
+            
+            W = theano.shared(value=W_values, name='W', borrow=True)
             
-        b_values = numpy.zeros((n_out,), dtype=theano.config.floatX)
-        b = theano.shared(value=b_values, name='b', borrow=True)
+        if b is None:
+            b_values = numpy.zeros((n_out,), dtype=theano.config.floatX)
+            b = theano.shared(value=b_values, name='b', borrow=True)
             
         self.W = W
         self.b = b
@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of Hoyer's sparseness: two numpy.linalg.norm calls (the previous
+implementation) against the fused single-pass kernel in dnnwsp.hoyer.
+
+Run from the root of the repository:
+    python benchmarks/bench_hoyer.py [n_rows n_cols]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from numpy import linalg as LA
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.hoyer import hoyer_sparseness
+
+
+def hoyer_linalg(W, axis):
+    # Previous implementation in hsp_fnc / Hoyers_sparsity_control
+    if axis == 0:
+        sqrt_nsamps = np.sqrt(W.shape[0])
+        L1norm = LA.norm(W, 1, axis=0)
+        L2norm = LA.norm(W, 2, axis=0)
+    else:
+        Wvec = W.flatten()
+        sqrt_nsamps = np.sqrt(Wvec.shape[0])
+        L1norm = LA.norm(Wvec, 1)
+        L2norm = LA.norm(Wvec, 2)
+    return (sqrt_nsamps-(L1norm/L2norm))/(sqrt_nsamps-1)
+
+
+def main(n_rows=74484, n_cols=100, repeat=20):
+    rng = np.random.RandomState(1234)
+    W = (rng.standard_normal((n_rows, n_cols)) * (rng.uniform(size=(n_rows, n_cols)) > 0.7)).astype(np.float32)
+
+    print('W : %d x %d float32' % (n_rows, n_cols))
+    for axis, name in [(0, 'node-wise'), (None, 'layer-wise')]:
+        t_old = min(timeit.repeat(lambda: hoyer_linalg(W, axis), number=1, repeat=repeat))
+        t_new = min(timeit.repeat(lambda: hoyer_sparseness(W, axis), number=1, repeat=repeat))
+
+        # reference in float64
+        ref = hoyer_linalg(W.astype(np.float64), axis)
+        err = np.max(np.abs(hoyer_sparseness(W, axis) - ref))
+
+        print('%-10s  linalg.norm x2 %7.2f ms   fused %7.2f ms   speed-up %.2fx   max |err| %.1e'
+              % (name, t_old*1e3, t_new*1e3, t_old/t_new, err))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
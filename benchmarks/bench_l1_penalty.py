@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the node-wise L1 penalty of dnnwsp_hsp_tensorflow.py: the
+previous |w| x diag(beta) matmul against the broadcast column-weighted sum.
+Each step evaluates the penalty and its gradient with respect to the weights,
+as the optimizer does on every minibatch.
+
+Run from the root of the repository (TensorFlow 1.x):
+    python benchmarks/bench_l1_penalty.py [repeat]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+import tensorflow as tf
+
+
+nodes=[74484,100,100,100,4]
+nodes_index= [int(np.sum(nodes[1:i+1])) for i in np.arange(np.shape(nodes)[0]-1)]
+
+
+def l1_diag(w, Beta):
+    # Previous implementation in init_L1
+    return [tf.reduce_sum(tf.matmul(abs(w[i]),tf.cast(tf.diag(Beta[nodes_index[i]:nodes_index[i+1]]),tf.float32))) for i in np.arange(np.shape(nodes)[0]-2)]
+
+
+def l1_broadcast(w, Beta):
+    return [tf.reduce_sum(abs(w[i])*Beta[nodes_index[i]:nodes_index[i+1]]) for i in np.arange(np.shape(nodes)[0]-2)]
+
+
+def main(repeat=20):
+    rng = np.random.RandomState(1234)
+    w_init = [rng.standard_normal((nodes[i], nodes[i+1])).astype(np.float32) for i in np.arange(np.shape(nodes)[0]-2)]
+    beta_val = rng.uniform(0, 0.05, np.sum(nodes[1:-1])).astype(np.float32)
+
+    w = [tf.Variable(w_init[i]) for i in np.arange(np.shape(nodes)[0]-2)]
+    Beta = tf.placeholder(tf.float32, [np.sum(nodes[1:-1])])
+
+    steps = {}
+    for name, init_L1 in [('diag matmul', l1_diag), ('broadcast', l1_broadcast)]:
+        L1 = tf.reduce_sum(init_L1(w, Beta))
+        steps[name] = [L1] + tf.gradients(L1, w)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+
+        print('layers : %s, node-wise beta' % (nodes,))
+        results = {}
+        for name in ['diag matmul', 'broadcast']:
+            # warm up, then keep the best of the repeats
+            results[name] = sess.run(steps[name], {Beta:beta_val})
+            t = min(timeit.repeat(lambda: sess.run(steps[name], {Beta:beta_val}), number=1, repeat=repeat))
+            results[name + ' time'] = t
+            print('%-12s  %8.2f ms / step' % (name, t*1e3))
+
+        err_L1 = abs(results['diag matmul'][0]-results['broadcast'][0])/abs(results['diag matmul'][0])
+        err_grad = max(np.max(np.abs(a-b)) for a, b in zip(results['diag matmul'][1:], results['broadcast'][1:]))
+        print('speed-up %.2fx   rel. |err| of penalty %.1e   max |err| of gradient %.1e'
+              % (results['diag matmul time']/results['broadcast time'], err_L1, err_grad))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:2]])
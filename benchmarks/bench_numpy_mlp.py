@@ -0,0 +1,95 @@
+"""
+Benchmark of the NumPy training engine (dnnwsp.numpy_mlp) against the Theano
+training step of dnnwsp_hsp_theano.py: both start from the same initial weights,
+train the same minibatches with the same fixed node-wise beta, and the weights
+after the steps are compared. Reports the time per training step of each engine.
+
+Run from the root of the repository (the Theano part is skipped without Theano):
+    python benchmarks/bench_numpy_mlp.py [n_steps] [optimizer]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.numpy_mlp import NumpyMLP
+
+
+n_nodes = [74484,100,100,100,4]
+batch_size = 40
+learning_rate = 1e-3;    momentum_val = 0.01;    L2_reg = 1e-4;
+
+
+def theano_step(optimizer_algorithm, x_val, y_val, beta):
+    # the training step of test_mlp with hsp_in_graph=0 (beta fed to the compiled function)
+    import theano
+    import theano.tensor as T
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Theano_code'))
+    from dnnwsp_hsp_theano import MLP, adam, RMSprop
+
+    x = T.matrix('x');    y = T.ivector('y');    l1_penalty_layer = T.fvector();
+    ln_rate = T.scalar();    momentum = T.scalar();
+    classifier = MLP(rng=np.random.RandomState(1234), input=x, n_nodes=n_nodes, activation=T.tanh)
+
+    index = np.concatenate([[0], np.cumsum(n_nodes[1:-1])])
+    cost = classifier.negative_log_likelihood(y)
+    for i in range(len(n_nodes)-2):
+        cost += (T.dot(abs(classifier.hiddenLayer[i].W), l1_penalty_layer[index[i]:index[i+1]])).sum()
+    cost += L2_reg * classifier.L2_sqr
+
+    updates = []
+    if optimizer_algorithm == 'Grad':
+        for param, oldparam in zip(classifier.params, classifier.oldparams):
+            delta = ln_rate * T.grad(cost, param) + momentum * oldparam
+            updates.append((param, param - delta))
+            updates.append((oldparam, delta))
+    elif optimizer_algorithm == 'Adam':
+        updates = adam(cost, classifier.params, learning_rate)
+    else:
+        updates = RMSprop(cost, classifier.params, learning_rate)
+
+    train_x = theano.shared(np.asarray(x_val, dtype=theano.config.floatX), borrow=True)
+    train_y = theano.shared(np.asarray(y_val, dtype='int32'), borrow=True)
+    train_model = theano.function([l1_penalty_layer, ln_rate, momentum], classifier.errors(y), updates=updates,
+                                  givens={x: train_x, y: train_y}, allow_input_downcast=True, on_unused_input='ignore')
+    step = lambda: train_model(beta, learning_rate, momentum_val)
+    weights = lambda: [layer.W.get_value() for layer in classifier.hiddenLayer] + [classifier.logRegressionLayer.W.get_value()]
+    return step, weights
+
+
+def main(n_steps=20, optimizer_algorithm='Grad'):
+    rng = np.random.RandomState(0)
+    x_val = rng.standard_normal((batch_size, n_nodes[0])).astype(np.float32)
+    y_val = rng.randint(0, n_nodes[-1], batch_size)
+    beta = rng.uniform(0, 0.01, np.sum(n_nodes[1:-1])).astype(np.float32)
+
+    model = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, optimizer_algorithm, flag_nodewise=1, L2_reg=L2_reg)
+    index = np.concatenate([[0], np.cumsum(n_nodes[1:-1])])
+    beta_list = [beta[index[i]:index[i+1]] for i in range(len(n_nodes)-2)]
+    numpy_step = lambda: model.train_step(x_val, y_val, beta_list, learning_rate, momentum_val, compute_penalty=False)
+
+    print('layers : %s, batch size %d, %s, %d steps' % (n_nodes, batch_size, optimizer_algorithm, n_steps))
+    t_numpy = min(timeit.repeat(numpy_step, number=1, repeat=n_steps))
+    print('%-8s  %8.2f ms / step' % ('numpy', t_numpy*1e3))
+
+    try:
+        step, weights = theano_step(optimizer_algorithm, x_val, y_val, beta)
+    except ImportError:
+        print('theano is not installed, no comparison')
+        return
+
+    # the same number of steps from the same initial weights
+    model = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, optimizer_algorithm, flag_nodewise=1, L2_reg=L2_reg)
+    t_theano = min(timeit.repeat(step, number=1, repeat=n_steps))
+    for _ in range(n_steps):
+        numpy_step()
+    err = max(np.max(np.abs(a-b))/np.max(np.abs(a)) for a, b in zip(weights(), model.W))
+    print('%-8s  %8.2f ms / step' % ('theano', t_theano*1e3))
+    print('speed-up %.2fx   max rel. |err| of the weights after %d steps %.1e' % (t_theano/t_numpy, n_steps, err))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20, *sys.argv[2:3])
@@ -0,0 +1,64 @@
+"""
+Scaling benchmark of the data-parallel training (dnnwsp.parallel): the time per
+training step with 1 to N worker processes on the minibatches of a random
+training set, the speed-up against the single-process NumPy step, and the
+largest difference of the weights after the same steps from the same initial
+weights (the mean of the gradients of the shards is the gradient of the minibatch).
+
+Run from the root of the repository:
+    python benchmarks/bench_parallel.py [max_workers] [n_steps] [batch_size]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.numpy_mlp import NumpyMLP
+from dnnwsp.parallel import DataParallelMLP
+
+
+n_nodes = [74484,100,100,100,4]
+learning_rate = 1e-3;    momentum_val = 0.01;    L2_reg = 1e-4;
+
+
+def main(max_workers=os.cpu_count(), n_steps=20, batch_size=40):
+    rng = np.random.RandomState(0)
+    n_batches = 4
+    x = rng.standard_normal((n_batches*batch_size, n_nodes[0])).astype(np.float32)
+    y = rng.randint(0, n_nodes[-1], n_batches*batch_size)
+    beta = [rng.uniform(0, 0.01, n).astype(np.float32) for n in n_nodes[1:-1]]
+
+    model = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, 'Grad', flag_nodewise=1, L2_reg=L2_reg)
+    step = iter(range(10**9))
+    def numpy_step():
+        batch = next(step) % n_batches
+        model.train_step(x[batch*batch_size:(batch+1)*batch_size], y[batch*batch_size:(batch+1)*batch_size],
+                         beta, learning_rate, momentum_val, compute_penalty=False)
+
+    print('layers : %s, batch size %d, %d steps, %d cores' % (n_nodes, batch_size, n_steps, os.cpu_count()))
+    t_single = min(timeit.repeat(numpy_step, number=1, repeat=n_steps))
+    print('%-10s  %8.2f ms / step' % ('1 process', t_single*1e3))
+
+    for n_workers in range(1, min(max_workers, batch_size)+1):
+        # the same steps from the same initial weights, in one process and with n_workers workers
+        model = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, 'Grad', flag_nodewise=1, L2_reg=L2_reg)
+        trainer = DataParallelMLP(n_workers, n_nodes, batch_size, 'tanh', 'softmax', 'Grad', flag_nodewise=1, L2_reg=L2_reg)
+        trainer.start(x, y, [len(b) for b in beta])
+        step = iter(range(10**9))
+        parallel_step = lambda: trainer.step(next(step) % n_batches, beta, learning_rate, momentum_val, compute_penalty=False)
+        t_parallel = min(timeit.repeat(parallel_step, number=1, repeat=n_steps))
+        trainer.close()
+
+        step = iter(range(10**9))
+        for _ in range(n_steps):
+            numpy_step()
+        err = max(np.max(np.abs(a-b)) for a, b in zip(model.W, trainer.W))
+        print('%2d workers  %8.2f ms / step   speed-up %.2fx   max |diff| of the weights %.1e'
+              % (n_workers, t_parallel*1e3, t_single/t_parallel, err))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,61 @@
+"""
+Benchmark of the input projection (dnnwsp.projection): the time to fit each
+projection on a random training set of 74484 voxels and to project it, and the
+time per training step of the NumPy engine (dnnwsp.numpy_mlp) on the voxels and
+on the projected features. Also reports the largest relative difference between
+the first layer on the projected features and its map back to the voxels.
+
+Run from the root of the repository:
+    python benchmarks/bench_projection.py [n_samples] [n_steps]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.numpy_mlp import NumpyMLP
+from dnnwsp.projection import InputProjection
+
+
+n_nodes = [74484,100,100,100,4]
+batch_size = 40
+projections = [('pca', 200), ('randomized_svd', 200), ('sparse_random', 2000)]
+learning_rate = 1e-3;    momentum_val = 0.01;    L2_reg = 1e-4;
+
+
+def step_time(x, y, beta, n_steps):
+    model = NumpyMLP([x.shape[1]]+n_nodes[1:], 'tanh', 'softmax', batch_size, 'Grad', flag_nodewise=1, L2_reg=L2_reg)
+    step = lambda: model.train_step(x[:batch_size], y[:batch_size], beta, learning_rate, momentum_val, compute_penalty=False)
+    return min(timeit.repeat(step, number=1, repeat=n_steps)), model
+
+
+def main(n_samples=240, n_steps=20):
+    rng = np.random.RandomState(0)
+    x = rng.standard_normal((n_samples, n_nodes[0])).astype(np.float32)
+    y = rng.randint(0, n_nodes[-1], n_samples)
+    beta = [rng.uniform(0, 0.01, n).astype(np.float32) for n in n_nodes[1:-1]]
+
+    print('layers : %s, %d training samples, batch size %d' % (n_nodes, n_samples, batch_size))
+    t_voxels, _ = step_time(x, y, beta, n_steps)
+    print('%-16s %5d features                         %8.2f ms / step' % ('voxels', n_nodes[0], t_voxels*1e3))
+
+    for method, n_components in projections:
+        projection = InputProjection(method, n_components)
+        start = timeit.default_timer()
+        features = projection.fit_transform(x)
+        t_fit = timeit.default_timer() - start
+        t_step, model = step_time(features, y, beta, n_steps)
+
+        # the first layer on the features and on the voxels gives the same pre-activations
+        W = projection.voxel_weights(model.W[0]);    b = projection.voxel_bias(model.W[0], model.b[0]);
+        z = np.dot(features, model.W[0]) + model.b[0]
+        err = np.max(np.abs(z - (np.dot(x, W) + b)))/np.max(np.abs(z))
+        print('%-16s %5d features   fit %6.2f s   %8.2f ms / step   speed-up %.1fx   max rel. |diff| on the voxels %.1e'
+              % (method, n_components, t_fit, t_step*1e3, t_voxels/t_step, err))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,67 @@
+"""
+Benchmark of the training of a sparse first layer (NumpyMLP.sparsify_layer): the
+time of an epoch of minibatches with the dense first layer, and with the first
+layer trained on its surviving weights only, with dense BLAS products on the
+weights with their zeros ('masked') and with the sparse products ('sparse'), at
+a few densities of surviving weights. Also reports the largest difference of the
+gradients of the surviving weights against the dense gradients of the same weights.
+
+Run from the root of the repository:
+    python benchmarks/bench_sparse_layer.py [n_batches] [optimizer]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.numpy_mlp import NumpyMLP
+
+
+n_nodes = [74484,100,100,100,4]
+batch_size = 40
+densities = [0.3, 0.09, 0.01]
+learning_rate = 1e-3;    momentum_val = 0.01;    L2_reg = 1e-4;
+
+
+def main(n_batches=20, optimizer_algorithm='Grad'):
+    rng = np.random.RandomState(0)
+    x = rng.standard_normal((n_batches*batch_size, n_nodes[0])).astype(np.float32)
+    y = rng.randint(0, n_nodes[-1], n_batches*batch_size)
+    beta = [rng.uniform(0, 0.01, n).astype(np.float32) for n in n_nodes[1:-1]]
+
+    def epoch_time(model):
+        def epoch():
+            for batch in range(n_batches):
+                model.train_step(x[batch*batch_size:(batch+1)*batch_size], y[batch*batch_size:(batch+1)*batch_size],
+                                 beta, learning_rate, momentum_val, compute_penalty=False)
+        return min(timeit.repeat(epoch, number=1, repeat=3))
+
+    print('layers : %s, batch size %d, %s, %d minibatches / epoch' % (n_nodes, batch_size, optimizer_algorithm, n_batches))
+    t_dense = epoch_time(NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, optimizer_algorithm, flag_nodewise=1, L2_reg=L2_reg))
+    print('%-8s %-7s  %8.3f s / epoch' % ('dense', '', t_dense))
+
+    n_weights = n_nodes[0]*n_nodes[1]
+    for density in densities:
+        support = np.sort(rng.choice(n_weights, int(density*n_weights), replace=False))
+        for products in ['masked', 'sparse']:
+            model = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, optimizer_algorithm, flag_nodewise=1, L2_reg=L2_reg)
+            model.sparsify_layer(0, support=support)
+            model._sparse_products[0] = (products == 'sparse')
+
+            # gradients of the surviving weights against the dense gradients of the same network
+            dense = NumpyMLP(n_nodes, 'tanh', 'softmax', batch_size, optimizer_algorithm, flag_nodewise=1, L2_reg=L2_reg,
+                             init_params=list(zip(model.W, model.b)))
+            dense.gradients(x[:batch_size], y[:batch_size], beta)
+            model.gradients(x[:batch_size], y[:batch_size], beta)
+            err = np.max(np.abs(dense.grads[0].ravel()[support] - model.grads[0]))
+
+            t = epoch_time(model)
+            print('%-8s %-7s  %8.3f s / epoch   speed-up %.2fx   max |diff| of the gradients %.1e'
+                  % ('%g%%' % (density*100), products, t, t_dense/t, err))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20, *sys.argv[2:3])
@@ -0,0 +1,7 @@
+"""
+Shared modules of the DNN with weight sparsity control (DNN-WSP).
+
+The Theano, TensorFlow and emotion prediction scripts add the root of the repository
+to sys.path and import the modules of this package directly, e.g.
+from dnnwsp.hoyer import hoyer_sparseness
+"""
@@ -0,0 +1,85 @@
+"""
+Copy-free minibatches of a shuffled training set.
+
+Shuffling the training matrix at the beginning of every epoch copies the whole
+set (240 x 74484 float32 samples are about 70 MB per copy). BatchGatherer keeps
+the training arrays as they are and only shuffles a permutation of the sample
+indices in place; each minibatch is gathered from the permuted index slice into
+a batch buffer that is allocated once. Nothing proportional to the dataset is
+allocated after the first epoch.
+
+The indices of a minibatch are sorted before gathering, so the rows of a
+memory-mapped dataset are read in ascending order. The batch buffers are reused
+by the next minibatch, so they must be consumed (fed to sess.run, which copies
+them) before the next call of batch.
+
+A batch buffer can have another dtype than its array (e.g. float32 minibatches
+of float16 samples): the rows are gathered in the dtype of the array and
+upcast into the buffer.
+"""
+
+import numpy as np
+
+
+class BatchGatherer(object):
+
+    def __init__(self, arrays, batch_size, rng=np.random, dtypes=None):
+        """
+        :type arrays: list of numpy.ndarray
+        :param arrays: arrays with the same number of samples in the first axis (e.g. [train_x, train_y])
+
+        :type batch_size: int
+        :param batch_size: number of samples of a minibatch
+
+        :type rng: numpy.random.RandomState
+        :param rng: random generator used to shuffle the samples
+
+        :type dtypes: list of numpy.dtype
+        :param dtypes: dtype of the batch buffer of each array, or None for the dtypes of the arrays
+        """
+        self.arrays = arrays
+        self.batch_size = int(batch_size)
+        self.rng = rng
+
+        self.n_samples = np.shape(arrays[0])[0]
+        for arr in arrays:
+            if np.shape(arr)[0] != self.n_samples:
+                raise ValueError('the arrays do not have the same number of samples')
+        self.n_batches = self.n_samples//self.batch_size
+
+        # permutation of the samples, shuffled in place every epoch
+        self.order = np.arange(self.n_samples)
+        # indices and samples of the current minibatch
+        self._ids = np.empty(self.batch_size, dtype=self.order.dtype)
+        if dtypes is None:
+            dtypes = [arr.dtype for arr in arrays]
+        self.buffers = [np.empty((self.batch_size,)+np.shape(arr)[1:], dtype=dtype) for arr, dtype in zip(arrays, dtypes)]
+        # rows gathered in the dtype of the array before they are upcast into the buffer
+        self._gathered = [np.empty_like(buf, dtype=arr.dtype) if buf.dtype != arr.dtype else buf
+                          for arr, buf in zip(arrays, self.buffers)]
+
+    def shuffle(self):
+        """Shuffle the order of the samples for a new epoch."""
+        self.rng.shuffle(self.order)
+        # batch gathers with mode='clip', which would clamp an out-of-range index to the last sample
+        # instead of failing, so the order (e.g. set from outside) is checked once per epoch
+        if self.n_samples > 0 and (self.order.min() < 0 or self.order.max() >= self.n_samples):
+            raise ValueError('the order has indices out of the range of the %d samples' % self.n_samples)
+
+    def batch(self, i):
+        """Gather the i-th minibatch of the current order into the batch buffers and return them."""
+        self._ids[...] = self.order[i*self.batch_size:(i+1)*self.batch_size]
+        self._ids.sort()
+        for arr, gathered, buf in zip(self.arrays, self._gathered, self.buffers):
+            # mode='clip' writes straight into buf (mode='raise' gathers into a temporary first),
+            # the indices are in range (checked by shuffle)
+            np.take(arr, self._ids, axis=0, out=gathered, mode='clip')
+            if gathered is not buf:
+                np.copyto(buf, gathered)
+        return self.buffers
+
+    def __iter__(self):
+        """Shuffle, then yield every minibatch of the epoch."""
+        self.shuffle()
+        for i in range(self.n_batches):
+            yield self.batch(i)
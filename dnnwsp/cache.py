@@ -0,0 +1,171 @@
+"""
+Content-addressed cache of preprocessed inputs.
+
+Loading a .mat file, casting it to float32, one-hot encoding the labels or
+z-scoring the samples is repeated every time a script starts, although the
+result only depends on the source files and the preprocessing parameters.
+PreprocessCache.load keys the result by a hash of the content of the source
+files (data, mask, ...), of the parameters and of the code of the preprocessing
+modules of the package (CODE_MODULES, so a change to prepare_* or to the
+projections invalidates the old entries; a script with its own preprocessing
+puts a version of it in the parameters), computes it only on a miss and
+stores it on local disk as a dataset directory (see dnnwsp.dataset), which is
+memory-mapped on the next hits.
+
+The hash of a file is kept with its size and modification time, so an unchanged
+file is not read again to be hashed. The least recently used entries are
+evicted when the cache grows over max_bytes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from .dataset import META_FILE, load_dataset, save_dataset
+
+SOURCES_FILE = 'sources.json'
+
+# modules of the package whose code is part of every key
+CODE_MODULES = ('prepare.py', 'projection.py', 'dataset.py')
+
+_code_version = None
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 24), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version():
+    """Hash of the code of the preprocessing modules (CODE_MODULES), computed once per process."""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha1()
+        for name in CODE_MODULES:
+            h.update(_file_hash(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)).encode('utf-8'))
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class PreprocessCache(object):
+
+    def __init__(self, cache_dir=None, max_bytes=20e9):
+        """
+        :type cache_dir: str
+        :param cache_dir: directory of the cache (DNNWSP_CACHE, or ~/.cache/dnnwsp if None)
+
+        :type max_bytes: float
+        :param max_bytes: size budget of the cache in bytes
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get('DNNWSP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'dnnwsp'))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def source_hash(self, path):
+        """Hash of the content of a file, or of every file of a directory (e.g. a dataset directory)."""
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            names = sorted(os.path.relpath(os.path.join(root, name), path)
+                           for root, _, files in os.walk(path) for name in files)
+            h = hashlib.sha1()
+            for name in names:
+                h.update(name.encode('utf-8'))
+                h.update(self.source_hash(os.path.join(path, name)).encode('utf-8'))
+            return h.hexdigest()
+
+        # the hash of a file is recomputed only when its size or modification time changed
+        sources_file = os.path.join(self.cache_dir, SOURCES_FILE)
+        sources = {}
+        if os.path.exists(sources_file):
+            with open(sources_file) as f:
+                sources = json.load(f)
+        stat = os.stat(path)
+        known = sources.get(path)
+        if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            return known['sha1']
+
+        # (a temporary file of this process, so concurrent jobs on the same cache do not write the same file)
+        sources[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': _file_hash(path)}
+        tmp = sources_file+'.tmp%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(sources, f, indent=2)
+        os.replace(tmp, sources_file)
+        return sources[path]['sha1']
+
+    def key(self, sources, params):
+        """Key of the result of preprocessing the source files with the parameters (a JSON-serializable dict)
+        by the current code of the preprocessing modules."""
+        h = hashlib.sha1(code_version().encode('utf-8'))
+        for source in sources:
+            h.update(self.source_hash(source).encode('utf-8'))
+        h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, sources, params, compute):
+        """Return the cached result of compute() (a dict of arrays), memory-mapped.
+
+        :type sources: str or list of str
+        :param sources: the files (or directories) the result is computed from
+
+        :type params: dict
+        :param params: the preprocessing parameters the result depends on
+
+        :type compute: callable
+        :param compute: computes the dict of arrays on a cache miss
+        """
+        if isinstance(sources, str):
+            sources = [sources]
+        key = self.key(sources, params)
+        entry = os.path.join(self.cache_dir, key)
+
+        if not os.path.exists(os.path.join(entry, META_FILE)):
+            # write to a temporary directory first, so an interrupted run leaves no partial entry
+            tmp = entry+'.tmp%d' % os.getpid()
+            save_dataset(tmp, compute(), sources=[os.path.abspath(s) for s in sources],
+                         params=json.loads(json.dumps(params, sort_keys=True, default=str)))
+            if os.path.exists(entry):
+                shutil.rmtree(tmp)
+            else:
+                os.rename(tmp, entry)
+            self.evict(keep=key)
+
+        # the modification time of meta.json is the last use of the entry
+        os.utime(os.path.join(entry, META_FILE), None)
+        return load_dataset(entry)
+
+    def entries(self):
+        """Return the (last use, bytes, key) of every entry, least recently used first."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_file = os.path.join(self.cache_dir, key, META_FILE)
+            if os.path.exists(meta_file):
+                entries.append((os.path.getmtime(meta_file), _dir_bytes(os.path.join(self.cache_dir, key)), key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries (but keep) until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key))
+            total -= nbytes
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        for _, _, key in self.entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key))
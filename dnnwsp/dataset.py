@@ -0,0 +1,101 @@
+"""
+Memory-mapped on-disk format of the datasets.
+
+sio.loadmat parses the whole .mat file into float64 arrays in RAM before training
+starts. A dataset directory instead holds one row-major (C order) .npy file per
+array, with the samples (train_x, test_x, ...) in float32, and a meta.json file
+with the name, shape and dtype of every array and the file it was converted from.
+load_dataset memory-maps the .npy files read-only, so opening a dataset is instant,
+only the rows that are sliced (e.g. one minibatch) are read from disk, and jobs
+running side by side on a node share the same pages of the page cache.
+
+Convert a .mat file once (from the root of the repository):
+    python -m dnnwsp.dataset lhrhadvs_sample_data.mat lhrhadvs_sample_data
+then pass the directory wherever the .mat file was loaded:
+    datasets = load_dataset('lhrhadvs_sample_data')
+With --float16 the floating point arrays are stored in float16 (half the disk and
+page cache), for the float16 precision policy (dnnwsp.precision):
+    python -m dnnwsp.dataset --float16 lhrhadvs_sample_data.mat lhrhadvs_sample_data_f16
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.io as sio
+
+META_FILE = 'meta.json'
+
+
+def convert_mat(mat_file, out_dir, keys=None, dtype=np.float32):
+    """Convert the arrays of a .mat file into a dataset directory.
+
+    :type keys: list of str
+    :param keys: names of the arrays to convert, or None for all of them
+
+    :type dtype: numpy.dtype
+    :param dtype: dtype of the floating point arrays (integer labels keep their dtype)
+    """
+    data = sio.loadmat(mat_file)
+    if keys is None:
+        keys = [key for key in data if not key.startswith('__')]
+
+    arrays = {}
+    for key in keys:
+        arr = data[key]
+        if np.issubdtype(arr.dtype, np.floating):
+            arr = arr.astype(dtype)
+        arrays[key] = arr
+    return save_dataset(out_dir, arrays, source=os.path.abspath(mat_file))
+
+
+def save_dataset(out_dir, arrays, **info):
+    """Save a dict of arrays as a dataset directory (one .npy file per array and meta.json).
+
+    The keyword arguments (e.g. source) are added to meta.json.
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    meta = dict(info, created=time.ctime(), arrays={})
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        np.save(os.path.join(out_dir, key+'.npy'), arr)
+        meta['arrays'][key] = {'shape': list(arr.shape), 'dtype': arr.dtype.str}
+
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_dataset(path, mmap_mode='r'):
+    """Load a dataset directory (memory-mapped) or a .mat file.
+
+    Returns a dict of arrays indexed by name, like sio.loadmat.
+    """
+    if not os.path.isdir(path):
+        return sio.loadmat(path)
+
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+
+    datasets = {}
+    for key, info in meta['arrays'].items():
+        arr = np.load(os.path.join(path, key+'.npy'), mmap_mode=mmap_mode)
+        if list(arr.shape) != info['shape'] or arr.dtype.str != info['dtype']:
+            raise ValueError('%s/%s.npy does not match %s (shape %s, dtype %s)'
+                             % (path, key, META_FILE, info['shape'], info['dtype']))
+        datasets[key] = arr
+    return datasets
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--float16']
+    if len(args) < 2:
+        print('usage: python -m dnnwsp.dataset [--float16] <file.mat> <output directory> [array names ...]')
+        sys.exit(1)
+    meta = convert_mat(args[0], args[1], args[2:] or None, np.float16 if '--float16' in sys.argv else np.float32)
+    for key, info in sorted(meta['arrays'].items()):
+        print('%-10s %-16s %s' % (key, 'x'.join(str(n) for n in info['shape']), info['dtype']))
@@ -0,0 +1,87 @@
+"""
+Whole-epoch training function of the Theano trainers.
+
+The compiled training function of a minibatch is called once per minibatch from
+Python, so with small minibatches (e.g. 2 samples in the denoise script) most
+of the time goes to the call overhead. scan_epoch compiles the same training
+step into one theano.scan over the minibatches of the epoch: every iteration
+replaces the symbolic minibatch x, y by its slice of the shared training set,
+applies the updates (the optimizer with its momentum, and the weight sparsity
+control when it is part of the graph) before the next minibatch, and the
+outputs of every minibatch (e.g. the cost and the error) are returned as arrays,
+one row per minibatch.
+
+The updates in every_updates (the in-graph sparsity control) are only applied
+every `every` minibatches, or after the last minibatch of the epoch for 'epoch',
+the same schedule as dnnwsp.schedule.HspSchedule.
+"""
+
+from collections import OrderedDict
+
+import theano
+import theano.tensor as T
+
+
+def scan_epoch(inputs, outputs, updates, x, y, data_x, data_y, batch_size, n_batches,
+               every_updates=(), every=1, givens=None, **kwargs):
+    """Compile f(*inputs, step) that trains on the n_batches minibatches of the epoch in one call.
+
+    :type inputs: list of theano variables
+    :param inputs: the inputs of the training step (e.g. the learning rate), the same in every minibatch
+
+    :type outputs: list of theano variables
+    :param outputs: the outputs of the training step, returned for every minibatch
+
+    :type updates: list of (shared variable, expression)
+    :param updates: the updates of every minibatch (e.g. the optimizer)
+
+    :type x, y: theano variables
+    :param x, y: the symbolic minibatch of the training step
+
+    :type data_x, data_y: theano variables
+    :param data_x, data_y: the (shared) training set, sliced into the minibatches in their order
+
+    :type every_updates: list of (shared variable, expression)
+    :param every_updates: the updates applied every `every` minibatches (e.g. the weight sparsity control)
+
+    :type every: int or str
+    :param every: a number of minibatches, or 'epoch' for after the last minibatch
+
+    :type givens: dict
+    :param givens: other replacements of the training step (e.g. a training flag)
+
+    The last input `step` of the compiled function is the number of minibatches trained
+    before this epoch (to keep the schedule of every_updates across epochs).
+    """
+    inputs = list(inputs)
+    updates = list(updates)
+    every_updates = list(every_updates)
+    step = T.lscalar('step')
+
+    def train_step(i, *args):
+        replace = dict(zip(inputs+[step], args))
+        # a minibatch of samples stored in a smaller dtype (e.g. float16) is upcast to the dtype of x
+        replace[x] = T.cast(data_x[i*batch_size:(i+1)*batch_size], x.dtype)
+        replace[y] = data_y[i*batch_size:(i+1)*batch_size]
+        if givens is not None:
+            replace.update(givens)
+
+        # one clone of the outputs and updates, so they share the forward pass of the minibatch
+        cloned = theano.clone(list(outputs)+[new for _, new in updates+every_updates], replace=replace)
+        new_updates = OrderedDict(zip([var for var, _ in updates], cloned[len(outputs):len(outputs)+len(updates)]))
+
+        if len(every_updates) > 0:
+            if every == 'epoch':
+                due = T.eq(i, n_batches-1)
+            else:
+                due = T.eq((args[-1]+i+1) % every, 0)
+            for (var, _), new in zip(every_updates, cloned[len(outputs)+len(updates):]):
+                new_updates[var] = T.switch(due, new, var)
+
+        return cloned[:len(outputs)], new_updates
+
+    results, scan_updates = theano.scan(train_step, sequences=[T.arange(n_batches)], non_sequences=inputs+[step])
+    if not isinstance(results, (list, tuple)):
+        results = [results]
+
+    return theano.function(inputs=inputs+[step], outputs=list(results), updates=scan_updates, **kwargs)
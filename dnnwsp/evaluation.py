@@ -0,0 +1,73 @@
+"""
+Memory-bounded evaluation of a whole data set.
+
+Running the error op on the whole training or test set in one call pushes every
+sample through the network at once, so the activations of the whole set are in
+memory together. evaluate feeds the set in chunks of chunk_size samples and
+combines the outputs of the chunks: the scalar outputs (means over the chunk,
+e.g. the error or the cost) are averaged with the number of samples of each
+chunk as weight, and the outputs with one entry per sample (e.g. the predicted
+classes) are concatenated, so the result is the same as one call on the whole set.
+
+RunningMean accumulates the outputs already computed by the training steps (e.g.
+the error of every minibatch) into an estimate for the epoch without another
+pass over the training set. The estimate averages the model over the epoch, as
+the weights change from one minibatch to the next.
+"""
+
+import numpy as np
+
+
+class RunningMean(object):
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value, n=1):
+        """Add the mean value of n samples."""
+        self.total += float(value)*n
+        self.count += n
+
+    def mean(self):
+        return self.total/self.count if self.count > 0 else 0.0
+
+    def reset(self):
+        self.total = 0.0
+        self.count = 0
+
+
+def evaluate(run, x, y=None, chunk_size=256):
+    """Run the evaluation function on the data set chunk by chunk.
+
+    :type run: callable
+    :param run: run(x_chunk, y_chunk) returns a list of outputs for the chunk, e.g.
+                lambda x, y: sess.run([error, predict_ans], {X:x, Y:y})
+
+    :type chunk_size: int
+    :param chunk_size: maximum number of samples of a chunk
+
+    Returns the outputs for the whole set, in the order of run.
+    """
+    n_samples = np.shape(x)[0]
+    means = None
+    parts = None
+
+    for start in range(0, n_samples, chunk_size):
+        x_chunk = x[start:start+chunk_size]
+        y_chunk = None if y is None else y[start:start+chunk_size]
+        outputs = run(x_chunk, y_chunk)
+        n = np.shape(x_chunk)[0]
+
+        if means is None:
+            means = [RunningMean() for _ in outputs]
+            parts = [[] for _ in outputs]
+        for i, out in enumerate(outputs):
+            if np.ndim(out) == 0:
+                means[i].add(out, n)
+            else:
+                parts[i].append(np.asarray(out))
+
+    if means is None:
+        return []
+    return [np.concatenate(parts[i]) if len(parts[i]) > 0 else means[i].mean() for i in range(len(means))]
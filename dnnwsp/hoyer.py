@@ -0,0 +1,78 @@
+"""
+Hoyer's sparseness of weight matrices (Hoyer, 2004, Kim and Lee PRNI2016, Kim and Lee ICASSP 2017).
+
+        sqrt(n) - L1/L2
+    h = ---------------        (0: dense ~ 1: sparse)
+          sqrt(n) - 1
+
+The L1 and L2 norms are accumulated together over blocks of rows, so each block of
+the weight matrix is read from memory once (the squares are taken from the cached
+absolute values) and the matrix is never flattened or copied. Sums are kept in
+float32: every block is reduced on its own and added to the running totals, which
+keeps the rounding error proportional to the block size instead of the number of rows.
+
+A scipy.sparse CSR matrix (e.g. a layer trained on its surviving weights only,
+dnnwsp.numpy_mlp) is reduced from its stored values: the implicit zeros add
+nothing to the norms but count in n.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+# Number of rows reduced at once (1024 x 100 float32 = 400KB, fits in L2 cache)
+BLOCK_ROWS = 1024
+
+
+def l1_l2_norms(W, axis=0, block_rows=BLOCK_ROWS):
+    """Return the L1 and L2 norms of a weight matrix in one pass.
+
+    :type W: numpy.ndarray
+    :param W: weight matrix (input dimensionality x number of nodes)
+
+    :type axis: int or None
+    :param axis: 0 for the norms of each column (node), None for the norms
+                 of the whole matrix
+    """
+    if axis not in (0, None):
+        raise ValueError('axis should be 0 (node-wise) or None (layer-wise), got %r' % (axis,))
+
+    if sp.isspmatrix_csr(W):
+        absW = np.abs(W.data)
+        if axis is None:
+            return np.float32(absW.sum()), np.float32(np.sqrt(np.dot(absW, absW)))
+        L1norm = np.bincount(W.indices, weights=absW, minlength=W.shape[1])
+        L2sqr = np.bincount(W.indices, weights=absW*absW, minlength=W.shape[1])
+        return L1norm.astype(np.float32), np.sqrt(L2sqr).astype(np.float32)
+
+    W = np.asarray(W)
+    if W.ndim == 1:
+        W = W.reshape(-1, 1)
+    n_rows, n_cols = W.shape
+
+    L1norm = np.zeros(n_cols, dtype=np.float32)
+    L2sqr = np.zeros(n_cols, dtype=np.float32)
+    buf = np.empty((min(block_rows, n_rows), n_cols), dtype=np.float32)
+
+    for start in range(0, n_rows, block_rows):
+        block = W[start:start+block_rows]
+        tmp = buf[:block.shape[0]]
+
+        np.abs(block, out=tmp, casting='same_kind')
+        L1norm += tmp.sum(axis=0)
+        np.multiply(tmp, tmp, out=tmp)
+        L2sqr += tmp.sum(axis=0)
+
+    if axis is None:
+        return L1norm.sum(dtype=np.float32), np.sqrt(L2sqr.sum(dtype=np.float32))
+
+    return L1norm, np.sqrt(L2sqr)
+
+
+def hoyer_sparseness(W, axis=0, block_rows=BLOCK_ROWS):
+    """Return Hoyer's sparseness of each column (axis=0) or of the whole matrix (axis=None)."""
+    L1norm, L2norm = l1_l2_norms(W, axis, block_rows)
+
+    n = np.shape(W)[0] if axis == 0 else int(np.prod(np.shape(W)))
+    sqrt_nsamps = float(np.sqrt(n))
+
+    return (sqrt_nsamps - (L1norm/L2norm))/(sqrt_nsamps-1)
@@ -0,0 +1,168 @@
+"""
+Sparse export and NumPy/SciPy prediction of a trained DNN-WSP.
+
+With a high target sparsity most weights of the hidden layers end up near zero.
+export_sparse zeroes the weights below a magnitude threshold tied to the achieved
+Hoyer's sparseness of each node (or layer), stores the hidden layers as sparse
+matrices (CSC in the .mat file, the sparse format of MATLAB, and CSR in memory,
+which is the faster one to multiply from the left by a dense batch) and reports
+the accuracy drift against the dense model, the prediction time and the size of
+the weights. predict runs the forward pass on dense or sparse weights.
+
+Below a density of a few percent the sparse product is faster than the dense one;
+around 10% it is about as fast for a single sample and slower for large batches
+(dense BLAS is much faster per multiply-add), while the weights still take several
+times less memory and disk space.
+
+The number of nonzeros of a vector of n entries of equal magnitude with Hoyer's
+sparseness h is
+
+    k = (sqrt(n) - h*(sqrt(n)-1))^2
+
+so the threshold of a node keeps its k*keep_scale largest weights.
+"""
+
+import timeit
+
+import numpy as np
+import scipy.io as sio
+import scipy.sparse as sp
+
+from .hoyer import hoyer_sparseness
+
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1.0/(1.0+np.exp(-x)),
+    'relu': lambda x: np.maximum(x, 0),
+}
+
+
+def hoyer_nnz(hsp, n):
+    """Number of nonzeros of a vector of n equal-magnitude entries with Hoyer's sparseness hsp."""
+    sqrt_n = np.sqrt(n)
+    return (sqrt_n - hsp*(sqrt_n-1))**2
+
+
+def magnitude_threshold(W, nodewise=True, keep_scale=1.0):
+    """Return the magnitude threshold of each node (nodewise) or of the whole layer.
+
+    :type W: numpy.ndarray
+    :param W: weight matrix (n_in x n_out)
+
+    :type keep_scale: float
+    :param keep_scale: keep keep_scale times the number of nonzeros implied by Hoyer's sparseness
+    """
+    absW = np.abs(W)
+    if nodewise:
+        n = W.shape[0]
+        k = np.ceil(keep_scale*hoyer_nnz(hoyer_sparseness(W, axis=0), n)).astype(int)
+        k = np.clip(k, 1, n)
+        # k-th largest magnitude of each column
+        sorted_absW = -np.sort(-absW, axis=0)
+        return sorted_absW[k-1, np.arange(W.shape[1])]
+    else:
+        n = W.size
+        k = int(np.clip(np.ceil(keep_scale*hoyer_nnz(hoyer_sparseness(W, axis=None), n)), 1, n))
+        return np.partition(absW.ravel(), n-k)[n-k]
+
+
+def sparsify(weights, nodewise=True, keep_scale=1.0):
+    """Threshold the hidden layers (all weights but the last) and convert them to CSR.
+
+    Returns the list of weights (sparse hidden layers, dense output layer) and the thresholds.
+    """
+    sparse_weights = []
+    thresholds = []
+    for W in weights[:-1]:
+        thre = magnitude_threshold(W, nodewise, keep_scale)
+        sparse_weights.append(sp.csr_matrix(np.where(np.abs(W) >= thre, W, 0).astype(W.dtype)))
+        thresholds.append(thre)
+    sparse_weights.append(np.asarray(weights[-1]))
+    return sparse_weights, thresholds
+
+
+def _dot(x, W):
+    # x (dense) times W (dense, or sparse CSR: W.T is CSC times the dense x.T)
+    if sp.issparse(W):
+        return np.asarray(W.T.dot(x.T)).T
+    return np.dot(x, W)
+
+
+def predict(weights, biases, x, activation='tanh'):
+    """Forward pass of the MLP, returns the index of the predicted class of each sample.
+
+    The output activation is monotonic (tanh or softmax), so the class is the argmax
+    of the linear output.
+    """
+    act = ACTIVATIONS[activation]
+    h = np.asarray(x, dtype=np.float32)
+    for W, b in zip(weights[:-1], biases[:-1]):
+        h = act(_dot(h, W) + np.ravel(b))
+    return np.argmax(_dot(h, weights[-1]) + np.ravel(biases[-1]), axis=1)
+
+
+def weight_nbytes(weights):
+    """Bytes taken by the weights (values, row indices and column pointers for sparse ones)."""
+    nbytes = 0
+    for W in weights:
+        if sp.issparse(W):
+            nbytes += W.data.nbytes + W.indices.nbytes + W.indptr.nbytes
+        else:
+            nbytes += np.asarray(W).nbytes
+    return nbytes
+
+
+def export_sparse(file_name, weights, biases, x, y, activation='tanh', nodewise=True, keep_scale=1.0, repeat=5):
+    """Save the sparse model to file_name (.mat) and return a report against the dense model.
+
+    :type weights: list of numpy.ndarray
+    :param weights: dense weights of every layer (input-hidden ... hidden-output)
+
+    :type x: numpy.ndarray
+    :param x: samples to measure the accuracy drift and the prediction time (e.g. test_x)
+
+    :type y: numpy.ndarray
+    :param y: class index of each sample
+    """
+    weights = [np.asarray(W) for W in weights]
+    sparse_weights, thresholds = sparsify(weights, nodewise, keep_scale)
+    y = np.ravel(y)
+
+    report = {}
+    for name, ws in [('dense', weights), ('sparse', sparse_weights)]:
+        report[name+'_accuracy'] = np.mean(predict(ws, biases, x, activation) == y)
+        report[name+'_time'] = min(timeit.repeat(lambda: predict(ws, biases, x, activation), number=1, repeat=repeat))
+        report[name+'_nbytes'] = weight_nbytes(ws)
+    report['accuracy_drift'] = report['sparse_accuracy'] - report['dense_accuracy']
+    report['density'] = [W.nnz/float(np.prod(W.shape)) for W in sparse_weights[:-1]]
+
+    data_variable = {}
+    for i in range(len(weights)):
+        data_variable['w%d' % (i+1)] = sparse_weights[i]
+        data_variable['b%d' % (i+1)] = np.ravel(biases[i])
+    for i in range(len(thresholds)):
+        data_variable['threshold%d' % (i+1)] = thresholds[i]
+    data_variable['activation'] = activation
+    data_variable['keep_scale'] = keep_scale
+    data_variable['density'] = report['density']
+    data_variable['accuracy_drift'] = report['accuracy_drift']
+    sio.savemat(file_name, data_variable)
+
+    return report
+
+
+def load_sparse(file_name):
+    """Load a model saved by export_sparse, returns weights, biases and the activation."""
+    data = sio.loadmat(file_name)
+    n_layers = len([key for key in data if key.startswith('w') and key[1:].isdigit()])
+    weights = [data['w%d' % (i+1)].tocsr() if sp.issparse(data['w%d' % (i+1)]) else data['w%d' % (i+1)] for i in range(n_layers)]
+    biases = [np.ravel(data['b%d' % (i+1)]) for i in range(n_layers)]
+    return weights, biases, str(np.ravel(data['activation'])[0])
+
+
+def print_report(report):
+    print('sparse export : density %s, accuracy %.3f -> %.3f (drift %+.3f), predict %.1f -> %.1f ms, weights %.1f -> %.1f MB'
+          % (', '.join('%.3f' % d for d in report['density']), report['dense_accuracy'], report['sparse_accuracy'],
+             report['accuracy_drift'], report['dense_time']*1e3, report['sparse_time']*1e3,
+             report['dense_nbytes']/1e6, report['sparse_nbytes']/1e6))
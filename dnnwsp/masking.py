@@ -0,0 +1,185 @@
+"""
+Masked feature extraction of fMRI volumes with a 3D brain mask (e.g. vMsk_3d.mat).
+
+The trainers take one row of voxels per volume. extract_dataset turns the 4D
+volume arrays (X x Y x Z x n_volumes, one .mat or .npy file per run) into such a
+feature matrix with the voxels of the mask, in the column-major (MATLAB) voxel
+order, so the features match vectors made in MATLAB with vol(mask). The runs
+are extracted in parallel by a process pool: the size of every run is read from
+the file headers first, then each worker writes its rows straight into the
+memory-mapped output, so no volume data goes between the processes.
+
+The output is a dataset directory (see dnnwsp.dataset) with <name>_x (float32),
+<name>_y (the labels, if given), and mask_index and mask_shape, the flat
+(column-major) index of every feature in the volume, to project weights or
+features back to 3D with unmask. Extracting 'train' and 'test' into the same
+directory gives the train_x, train_y, test_x and test_y of the trainers.
+
+Extract the runs (from the root of the repository):
+    python -m dnnwsp.masking KHBM2019/Sensorimotor_classification/vMsk_3d.mat sensorimotor train \\
+        run1.mat:y_sensorimotor_sbj1.mat run2.mat:y_sensorimotor_sbj2.mat
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.io as sio
+
+from .dataset import META_FILE
+
+
+def _mat_array(mat_file, key=None):
+    # the array key of a .mat file, or its only array
+    data = sio.loadmat(mat_file)
+    if key is None:
+        keys = [k for k in data if not k.startswith('__')]
+        if len(keys) != 1:
+            raise ValueError('%s should hold one array, found %s' % (mat_file, keys))
+        key = keys[0]
+    return data[key]
+
+
+def load_mask(mask_file, key=None):
+    """Load a 3D mask (.mat or .npy) as a boolean array."""
+    mask = np.load(mask_file) if mask_file.endswith('.npy') else _mat_array(mask_file, key)
+    return np.asarray(mask) > 0
+
+
+def mask_index(mask):
+    """Flat column-major index of the voxels of the mask (the order of vol(mask) in MATLAB)."""
+    return np.flatnonzero(np.ravel(mask, order='F'))
+
+
+def apply_mask(volumes, index):
+    """Return the masked features of the volumes (X x Y x Z x n_volumes) as n_volumes x n_voxels."""
+    volumes = np.asarray(volumes)
+    n_volumes = volumes.shape[3] if volumes.ndim == 4 else 1
+    return volumes.reshape((-1, n_volumes), order='F')[index].T
+
+
+def unmask(features, index, mask_shape):
+    """Project features or weights (n_voxels x k) back to volumes (X x Y x Z x k), zero outside the mask."""
+    features = np.asarray(features)
+    k = features.shape[1] if features.ndim == 2 else 1
+    vol = np.zeros((int(np.prod(mask_shape)), k), dtype=features.dtype)
+    vol[index] = features.reshape((-1, k))
+    return vol.reshape(tuple(mask_shape)+(k,), order='F')
+
+
+def _load_volumes(vol_file, key=None, mmap_mode=None):
+    if vol_file.endswith('.npy'):
+        return np.load(vol_file, mmap_mode=mmap_mode)
+    return _mat_array(vol_file, key)
+
+
+def _volume_shape(vol_file, key=None):
+    # the shape from the file header, without reading the volumes
+    if vol_file.endswith('.npy'):
+        return np.load(vol_file, mmap_mode='r').shape
+    shapes = [(name, shape) for name, shape, _ in sio.whosmat(vol_file) if key is None or name == key]
+    if len(shapes) != 1:
+        raise ValueError('%s should hold one array, found %s' % (vol_file, [name for name, _ in shapes]))
+    return shapes[0][1]
+
+
+def _extract_run(vol_file, key, index, out_file, start):
+    # worker: write the features of one run into rows start... of the output
+    features = apply_mask(_load_volumes(vol_file, key, mmap_mode='r'), index)
+    out = np.lib.format.open_memmap(out_file, mode='r+')
+    out[start:start+features.shape[0]] = features
+    out.flush()
+    del out
+    return features.shape[0]
+
+
+def extract_dataset(vol_files, mask_file, out_dir, name='train', label_files=None, key=None, n_workers=None):
+    """Extract the masked features of every run into the dataset directory out_dir.
+
+    :type vol_files: list of str
+    :param vol_files: 4D volumes (X x Y x Z x n_volumes) of each run, .mat or .npy files
+
+    :type name: str
+    :param name: the arrays are saved as <name>_x and <name>_y
+
+    :type label_files: list of str
+    :param label_files: labels of the volumes of each run (.mat or .npy), or None
+
+    :type n_workers: int
+    :param n_workers: number of worker processes (the number of CPUs if None)
+
+    Returns the meta data of the directory.
+    """
+    mask = load_mask(mask_file)
+    index = mask_index(mask)
+
+    # rows of every run in the output
+    shapes = [_volume_shape(f, key) for f in vol_files]
+    for f, shape in zip(vol_files, shapes):
+        if tuple(shape[:3]) != mask.shape:
+            raise ValueError('%s has volumes of %s, the mask is %s' % (f, tuple(shape[:3]), mask.shape))
+    n_volumes = [shape[3] if len(shape) == 4 else 1 for shape in shapes]
+    starts = np.concatenate([[0], np.cumsum(n_volumes)]).astype(int)
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    meta_file = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+    else:
+        meta = {'arrays': {}, 'runs': {}}
+    meta['source'] = os.path.abspath(mask_file)
+    meta['created'] = time.ctime()
+
+    x_file = os.path.join(out_dir, name+'_x.npy')
+    out = np.lib.format.open_memmap(x_file, mode='w+', dtype=np.float32, shape=(int(starts[-1]), np.size(index)))
+    del out
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        jobs = [executor.submit(_extract_run, f, key, index, x_file, int(start)) for f, start in zip(vol_files, starts)]
+        for job in jobs:
+            job.result()
+    meta['arrays'][name+'_x'] = {'shape': [int(starts[-1]), int(np.size(index))], 'dtype': np.dtype(np.float32).str}
+
+    if label_files is not None:
+        labels = [np.ravel(np.load(f) if f.endswith('.npy') else _mat_array(f)) for f in label_files]
+        for f, y, n in zip(label_files, labels, n_volumes):
+            if np.size(y) != n:
+                raise ValueError('%s has %d labels for %d volumes' % (f, np.size(y), n))
+        y = np.concatenate(labels).reshape((-1, 1))
+        np.save(os.path.join(out_dir, name+'_y.npy'), y)
+        meta['arrays'][name+'_y'] = {'shape': list(y.shape), 'dtype': y.dtype.str}
+
+    np.save(os.path.join(out_dir, 'mask_index.npy'), index)
+    np.save(os.path.join(out_dir, 'mask_shape.npy'), np.array(mask.shape))
+    meta['arrays']['mask_index'] = {'shape': [int(np.size(index))], 'dtype': index.dtype.str}
+    meta['arrays']['mask_shape'] = {'shape': [3], 'dtype': np.array(mask.shape).dtype.str}
+
+    meta['runs'][name] = [{'file': os.path.abspath(f), 'start': int(start), 'n_samples': int(n)}
+                          for f, start, n in zip(vol_files, starts, n_volumes)]
+
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the masked features of 4D volumes into a dataset directory.')
+    parser.add_argument('mask', help='.mat or .npy file of the 3D brain mask')
+    parser.add_argument('out_dir', help='output dataset directory')
+    parser.add_argument('name', help="name of the arrays, e.g. 'train' for train_x and train_y")
+    parser.add_argument('runs', nargs='+', help='<volumes> or <volumes>:<labels> of each run')
+    parser.add_argument('--key', help='name of the volumes in the .mat files (if they hold several arrays)')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    args = parser.parse_args()
+
+    pairs = [run.split(':') for run in args.runs]
+    label_files = [pair[1] for pair in pairs] if all(len(pair) == 2 for pair in pairs) else None
+    start_time = time.time()
+    meta = extract_dataset([pair[0] for pair in pairs], args.mask, args.out_dir, args.name, label_files,
+                           args.key, args.workers)
+    print('%s_x : %s in %.1f s' % (args.name, 'x'.join(str(n) for n in meta['arrays'][args.name+'_x']['shape']),
+                                   time.time()-start_time))
@@ -0,0 +1,111 @@
+"""
+Multi-step training inside one session call.
+
+With one sess.run call per minibatch, every training step pays the overhead of a
+call (feeding the batch, launching the graph, fetching the cost). MultiStepLoop
+keeps the training set in graph variables and runs n_steps training steps as one
+tf.while_loop: the sample order is reshuffled in the graph at the beginning of
+every epoch, each step gathers its minibatch from the shuffled index and runs
+the training step built by step_fn, and the tensors step_fn returns (e.g. the
+cost and the sparsity after the step) are written into TensorArrays and
+returned stacked, one row per step, at the end of the call.
+
+The steps run one after another (parallel_iterations=1). step_fn must read the
+variables it uses with read_value() inside the loop: a variable used directly
+is read once when the loop starts, not after the previous step.
+
+The samples can be kept in the graph in a smaller dtype (e.g. float16), every
+minibatch is cast to float32 after it is gathered.
+"""
+
+import tensorflow as tf
+
+
+class MultiStepLoop(object):
+
+    def __init__(self, n_in, n_out, batch_size, dtype=tf.float32):
+        """
+        :type n_in: int
+        :param n_in: number of input features (columns of the samples)
+
+        :type n_out: int
+        :param n_out: number of output nodes (columns of the one-hot labels)
+
+        :type batch_size: int
+        :param batch_size: number of samples of a minibatch
+
+        :type dtype: tf.DType
+        :param dtype: dtype of the samples kept in the graph
+        """
+        self.batch_size = int(batch_size)
+        self.n_in = n_in
+        self.n_out = n_out
+
+        # the training set, assigned once per fit by start (not by the global initializer)
+        self._x = tf.placeholder(dtype, [None, n_in])
+        self._y = tf.placeholder(tf.float32, [None, n_out])
+        self.data_x = tf.Variable(self._x, trainable=False, collections=[], validate_shape=False)
+        self.data_y = tf.Variable(self._y, trainable=False, collections=[], validate_shape=False)
+        n_samples = tf.shape(self._x)[0]
+
+        # the shuffled sample order of the current epoch and the number of steps trained in this fit
+        self.perm = tf.Variable(tf.range(n_samples), trainable=False, collections=[], validate_shape=False)
+        self.n_batches = tf.Variable(n_samples//self.batch_size, trainable=False, collections=[])
+        self.step = tf.Variable(0, trainable=False, collections=[])
+
+        # number of steps run by one session call
+        self.n_steps = tf.placeholder(tf.int32, [])
+
+        self._initializer = tf.group(self.data_x.initializer, self.data_y.initializer, self.perm.initializer,
+                                     self.n_batches.initializer, self.step.initializer)
+
+    def build(self, step_fn, dtypes):
+        """Build the loop of n_steps training steps.
+
+        :type step_fn: callable
+        :param step_fn: step_fn(x, y, epoch, batch) builds one training step on the minibatch x, y
+                        (batch is its index in the epoch) and returns the list of tensors traced
+                        after the step
+
+        :type dtypes: list of tf.DType
+        :param dtypes: types of the tensors returned by step_fn
+
+        Returns the traced tensors stacked over the steps of the call.
+        """
+        def body(k, *traces):
+            step = self.step.read_value()
+            epoch = step//self.n_batches
+            batch = step%self.n_batches
+
+            # reshuffle the samples at the beginning of every epoch
+            n_samples = tf.shape(self.data_x)[0]
+            perm = tf.cond(tf.equal(batch, 0),
+                           lambda: tf.identity(tf.assign(self.perm, tf.random_shuffle(tf.range(n_samples)), validate_shape=False)),
+                           lambda: self.perm.read_value())
+            ids = perm[batch*self.batch_size:(batch+1)*self.batch_size]
+
+            x = tf.cast(tf.gather(self.data_x, ids), tf.float32)
+            y = tf.gather(self.data_y, ids)
+            x.set_shape([self.batch_size, self.n_in])
+            y.set_shape([self.batch_size, self.n_out])
+
+            outputs = step_fn(x, y, epoch, batch)
+            with tf.control_dependencies(outputs):
+                next_step = tf.assign_add(self.step, 1)
+            with tf.control_dependencies([next_step]):
+                traces = [trace.write(k, output) for trace, output in zip(traces, outputs)]
+                return [k+1]+traces
+
+        traces = [tf.TensorArray(dtype, size=self.n_steps) for dtype in dtypes]
+        loop = tf.while_loop(lambda k, *traces: k < self.n_steps, body, [tf.constant(0)]+traces,
+                             parallel_iterations=1, back_prop=False)
+        return [trace.stack() for trace in loop[1:]]
+
+    def start(self, sess, x, y):
+        """Copy the arrays x (samples in the dtype of the loop) and y (float32 one-hot labels) into the graph
+        and train on them from the first step.
+
+        Returns the number of minibatches of an epoch.
+        """
+        sess.run(self._initializer, {self._x: x, self._y: y})
+        return int(sess.run(self.n_batches))
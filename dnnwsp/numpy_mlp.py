@@ -0,0 +1,684 @@
+"""
+Pure NumPy training of the DNN with weight sparsity control, for CPU-only machines
+without Theano or TensorFlow.
+
+NumpyMLP is the MLP of Theano_code/dnnwsp_hsp_theano.py: tanh, sigmoid or relu
+hidden layers, a softmax output (classification, negative log likelihood; or
+'tanh_softmax', the softmax of tanh of the output layer of
+Tensorflow_code/dnnwsp_hsp_tensorflow.py) or a linear output (regression,
+mean squared error), the node-wise or layer-wise
+Hoyer-controlled L1 penalty of the hidden layers (beta from
+dnnwsp.sparsity.SparsityControl), the L2 penalty of all layers, and the
+SGD+momentum, Adam and RMSprop rules of the Theano script with the same
+constants. The weights are initialized as in the Theano script (the same random
+draws of RandomState(1234)), so both start from the same network.
+
+Every buffer of a training step (activations, deltas, gradients, optimizer state
+and a scratch matrix of the size of the largest layer) is allocated once: the
+matrix products write into them with np.dot(..., out=) (BLAS), and the
+penalties and the optimizer update the weights in place, so a step allocates
+nothing of the size of a weight matrix.
+
+Once the Hoyer control has made a layer sparse (the first layer holds almost all
+the weights), sparsify_layer trains it on its surviving weights only: the weights
+below the magnitude threshold implied by its Hoyer's sparseness
+(dnnwsp.inference.magnitude_threshold) are set to zero for good, and the gradient,
+the penalties and the optimizer state of the layer are kept for the surviving
+weights only. Above SPARSE_DENSITY of surviving weights the products stay dense
+BLAS products on the weights with their zeros (the penalties and the optimizer
+update, which run on every weight of a dense layer, are most of the time of a
+step); below it the forward product uses the CSR matrix of the surviving weights
+and only their gradients are computed. regrow drops the surviving weights that
+fell below the threshold and adds back, at most as many, the pruned weights whose
+gradient has grown the most past their beta (the L1 penalty no longer holds them
+at zero), so the density of the layer never grows.
+
+train_mlp takes the hyperparameters of test_mlp and runs its training loop.
+Train on the sample data (from the root of the repository):
+    python -m dnnwsp.numpy_mlp lhrhadvs_sample_data.mat
+"""
+
+import argparse
+import os
+import timeit
+
+import numpy as np
+import scipy.io as sio
+import scipy.sparse as sp
+
+from .dataset import load_dataset
+from .evaluation import evaluate
+from .hoyer import l1_l2_norms
+from .inference import magnitude_threshold
+from .precision import POLICIES, PrecisionPolicy
+from .schedule import HspSchedule
+from .sparsity import SparsityControl
+
+OPTIMIZERS = ('Grad', 'Adam', 'Rmsp')
+
+# below this fraction of surviving weights a sparse layer uses sparse products instead of dense BLAS
+SPARSE_DENSITY = 0.02
+# number of surviving weights whose gradients are computed at once by the sparse products
+SPARSE_CHUNK = 65536
+
+
+def _tanh_grad(h, out):
+    # 1 - h^2 from the output of the layer
+    np.multiply(h, h, out=out)
+    np.subtract(1.0, out, out=out)
+
+
+def _sigmoid(z, out):
+    np.negative(z, out=out)
+    np.exp(out, out=out)
+    out += 1.0
+    np.reciprocal(out, out=out)
+
+
+def _sigmoid_grad(h, out):
+    # h*(1-h) from the output of the layer
+    np.subtract(1.0, h, out=out)
+    out *= h
+
+
+def _relu_grad(h, out):
+    np.greater(h, 0, out=out, casting='unsafe')
+
+
+ACTIVATIONS = {
+    'tanh': (lambda z, out: np.tanh(z, out=out), _tanh_grad),
+    'sigmoid': (_sigmoid, _sigmoid_grad),
+    'relu': (lambda z, out: np.maximum(z, 0, out=out), _relu_grad),
+}
+
+
+class NumpyMLP(object):
+
+    def __init__(self, n_nodes, activation='tanh', output='softmax', batch_size=40,
+                 optimizer_algorithm='Grad', flag_nodewise=0, L2_reg=1e-4, init_params=None, dtype=np.float32,
+                 share_params=False, optimizer_state=True):
+        """
+        :type n_nodes: list of int
+        :param n_nodes: number of nodes of the input, hidden and output layers
+
+        :type activation: str
+        :param activation: 'tanh', 'sigmoid' or 'relu' for the hidden layers
+
+        :type output: str
+        :param output: 'softmax' or 'tanh_softmax' (classification, integer labels) or 'linear' (regression)
+
+        :type batch_size: int
+        :param batch_size: number of samples of a training minibatch
+
+        :type optimizer_algorithm: str
+        :param optimizer_algorithm: 'Grad' (SGD with momentum), 'Adam' or 'Rmsp'
+
+        :type flag_nodewise: int
+        :param flag_nodewise: 1 for one beta per hidden node, 0 for one beta per hidden layer
+
+        :type init_params: list of [W, b]
+        :param init_params: weights and biases of every layer to start from, or None
+
+        :type share_params: bool
+        :param share_params: train the arrays of init_params in place (e.g. arrays in shared memory,
+                             in dtype) instead of copies
+
+        :type optimizer_state: bool
+        :param optimizer_state: False for a model that only computes gradients (no update),
+                                e.g. the workers of dnnwsp.parallel
+        """
+        if activation not in ACTIVATIONS:
+            raise ValueError("activation should be one of %s, got %r" % (sorted(ACTIVATIONS), activation))
+        if output not in ('softmax', 'tanh_softmax', 'linear'):
+            raise ValueError("output should be 'softmax', 'tanh_softmax' or 'linear', got %r" % (output,))
+        if optimizer_algorithm not in OPTIMIZERS:
+            raise ValueError("optimizer_algorithm should be one of %s, got %r" % (OPTIMIZERS, optimizer_algorithm))
+
+        self.n_nodes = [int(n) for n in n_nodes]
+        self.n_layers = len(self.n_nodes)-1
+        self.activation = activation
+        self.output = output
+        self.batch_size = int(batch_size)
+        self.optimizer_algorithm = optimizer_algorithm
+        self.flag_nodewise = flag_nodewise
+        self.L2_reg = L2_reg
+        self.dtype = np.dtype(dtype)
+
+        if init_params is None:
+            self.W, self.b = self._init_params()
+        elif share_params:
+            self.W = [W for W, b in init_params]
+            self.b = [b for W, b in init_params]
+        else:
+            self.W = [np.array(W, dtype=self.dtype) for W, b in init_params]
+            self.b = [np.array(np.ravel(b), dtype=self.dtype) for W, b in init_params]
+        self.params = self.W+self.b
+
+        # buffers of a training step: the output of every layer, its delta and the gradients
+        bs = self.batch_size
+        self._h = [np.empty((bs, n), dtype=self.dtype) for n in self.n_nodes[1:]]
+        self._delta = [np.empty((bs, n), dtype=self.dtype) for n in self.n_nodes[1:]]
+        self._act_grad = [np.empty((bs, n), dtype=self.dtype) for n in self.n_nodes[1:-1]]
+        self._logits = np.empty((bs, self.n_nodes[-1]), dtype=self.dtype)
+        self.grads = [np.empty_like(p) for p in self.params]
+        self._scratch = np.empty(max(W.size for W in self.W), dtype=self.dtype)
+
+        # layers trained on their surviving weights: their flat index in W, and the CSR matrix and row
+        # and column of every surviving weight (None for a dense layer)
+        self.support = [None]*self.n_layers
+        self._csr = [None]*self.n_layers
+        self._rows = [None]*self.n_layers
+        self._cols = [None]*self.n_layers
+        self._sparse_products = [False]*self.n_layers
+        self._support_beta = [None]*self.n_layers
+
+        # optimizer state (the momentum of SGD, the moments of Adam, the running average of RMSprop)
+        self._state = [np.zeros_like(p) for p in self.params] if optimizer_state else None
+        self._state2 = [np.zeros_like(p) for p in self.params] if optimizer_state and optimizer_algorithm == 'Adam' else None
+        self._t = 1.0
+
+    def _init_params(self):
+        # the initialization of the Theano script: the hidden layers draw from one RandomState(1234)
+        # in order, the output layer from its own RandomState(1234), and the biases are zero
+        rng = np.random.RandomState(1234)
+        W = []
+        for i in range(self.n_layers):
+            if i == self.n_layers-1:
+                rng = np.random.RandomState(1234)
+            bound = 4*np.sqrt(6. / (self.n_nodes[i] + self.n_nodes[i+1]))
+            W.append(np.asarray(rng.uniform(low=-bound, high=bound, size=(self.n_nodes[i], self.n_nodes[i+1])), dtype=self.dtype))
+        b = [np.zeros(n, dtype=self.dtype) for n in self.n_nodes[1:]]
+        return W, b
+
+    def _scratch_like(self, a):
+        # a view of the scratch buffer with the shape of a weight or bias
+        return self._scratch[:a.size].reshape(a.shape)
+
+    def set_params(self, W_list, b_list):
+        """Train the given arrays in place (e.g. arrays in shared memory) instead of copies (dense layers only)."""
+        self.W = list(W_list)
+        self.b = list(b_list)
+        self.params = self.W+self.b
+
+    def sparsify_layer(self, i, keep_scale=1.0, support=None):
+        """Train the i-th layer on its surviving weights only.
+
+        :type keep_scale: float
+        :param keep_scale: keep keep_scale times the number of nonzeros implied by Hoyer's sparseness
+                           (node-wise or layer-wise, as the sparsity control)
+
+        :type support: numpy.ndarray
+        :param support: flat index of the surviving weights in W[i], instead of the magnitude threshold
+
+        The other weights are set to zero. W[i] stays a dense array (with the zeros) and the
+        trained values are params[i], the surviving weights in the order of support.
+        """
+        W = self.W[i]
+        if support is None:
+            thre = magnitude_threshold(W, self.flag_nodewise == 1, keep_scale)
+            support = np.flatnonzero((np.abs(W) >= thre) & (W != 0))
+        support = np.asarray(support, dtype=np.intp)
+
+        # the optimizer state of the new support (zero for the weights that were not trained)
+        states = [s for s in (self._state, self._state2) if s is not None]
+        new_states = []
+        for s in states:
+            if self.support[i] is None:
+                new_states.append(np.take(s[i], support))
+            else:
+                dense = np.zeros(W.size, dtype=self.dtype)
+                dense[self.support[i]] = s[i]
+                new_states.append(np.take(dense, support))
+
+        values = np.take(W, support)
+        W[...] = 0
+        np.put(W, support, values)
+
+        self.support[i] = support
+        self.params[i] = values
+        self.grads[i] = np.empty_like(values)
+        self._support_beta[i] = np.empty_like(values)
+        for s, new in zip(states, new_states):
+            s[i] = new
+
+        # CSR matrix of the surviving weights, its values are the trained values
+        self._rows[i], self._cols[i] = np.divmod(support, W.shape[1])
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(self._rows[i], minlength=W.shape[0]))])
+        self._csr[i] = sp.csr_matrix((values, self._cols[i], indptr), shape=W.shape, copy=False)
+        self._sparse_products[i] = support.size < SPARSE_DENSITY*W.size
+
+    def density(self, i):
+        """Fraction of the weights of the i-th layer that are trained."""
+        return 1.0 if self.support[i] is None else self.support[i].size/float(self.W[i].size)
+
+    def regrow(self, i, x, y, beta_list, keep_scale=1.0):
+        """Update the surviving weights of the sparse i-th layer.
+
+        The surviving weights below the magnitude threshold (see sparsify_layer) are dropped, and
+        as many pruned weights at most are added back with the value zero: the ones with the largest
+        gradient on the minibatch x, y among those whose gradient is larger than their beta (the L1
+        penalty would move them away from zero). The density of the layer never grows.
+
+        Returns the number of weights added and dropped.
+        """
+        W = self.W[i]
+        thre = magnitude_threshold(W, self.flag_nodewise == 1, keep_scale)
+        if np.ndim(thre) > 0:
+            thre = np.take(thre, self._cols[i])
+        above = np.abs(self.params[i]) >= thre
+        kept = self.support[i][above]
+        n_dropped = int(np.sum(~above))
+
+        self.gradients(x, y, beta_list, compute_penalty=False)
+        h_in = np.asarray(x, dtype=self.dtype) if i == 0 else self._h[i-1]
+        grad = self._scratch_like(W)
+        np.dot(h_in.T, self._delta[i], out=grad)
+        np.abs(grad, out=grad)
+        grad -= np.asarray(beta_list[i], dtype=self.dtype)
+        grad.ravel()[self.support[i]] = 0
+        added = np.flatnonzero(grad > 0)
+        if n_dropped == 0:
+            added = added[:0]
+        elif added.size > n_dropped:
+            # the n_dropped largest gradients
+            added = added[np.argpartition(grad.ravel()[added], added.size-n_dropped)[added.size-n_dropped:]]
+
+        self.sparsify_layer(i, support=np.union1d(kept, added))
+        return added.size, n_dropped
+
+    def hidden_weights(self):
+        """Weights of the hidden layers for the sparsity control (the CSR matrix of a sparse layer)."""
+        return [self.W[i] if self.support[i] is None else self._csr[i] for i in range(self.n_layers-1)]
+
+    def arrays(self):
+        """Weights, biases, gradients and optimizer state by name (e.g. for the dtype audit of dnnwsp.precision)."""
+        arrays = {}
+        for i in range(self.n_layers):
+            for name, k in [('w%d' % (i+1), i), ('b%d' % (i+1), self.n_layers+i)]:
+                arrays[name] = self.params[k]
+                arrays['grad_'+name] = self.grads[k]
+                if self._state is not None:
+                    arrays['state_'+name] = self._state[k]
+                if self._state2 is not None:
+                    arrays['state2_'+name] = self._state2[k]
+        return arrays
+
+    def forward(self, x, out=None, logits=None):
+        """Output of every layer for the samples x (the probabilities of the classes for a softmax output).
+
+        out is the list of output buffers (one per layer), or None to allocate them,
+        and logits a buffer for the tanh of the output layer of 'tanh_softmax'.
+        """
+        act = ACTIVATIONS[self.activation][0]
+        h = x
+        outputs = []
+        for i in range(self.n_layers):
+            if self._sparse_products[i]:
+                z = self._csr[i].T.dot(h.T).T
+                if out is not None:
+                    out[i][...] = z
+                    z = out[i]
+            else:
+                z = np.dot(h, self.W[i]) if out is None else np.dot(h, self.W[i], out=out[i])
+            z += self.b[i]
+            if i < self.n_layers-1:
+                act(z, z)
+            elif self.output != 'linear':
+                if self.output == 'tanh_softmax':
+                    np.tanh(z, out=z)
+                    if logits is not None:
+                        logits[...] = z
+                z -= z.max(axis=1, keepdims=True)
+                np.exp(z, out=z)
+                z /= z.sum(axis=1, keepdims=True)
+            outputs.append(z)
+            h = z
+        return outputs
+
+    def predict(self, x):
+        """Predicted class (softmax) or response (linear) of every sample."""
+        y_out = self.forward(np.asarray(x, dtype=self.dtype))[-1]
+        return y_out if self.output == 'linear' else np.argmax(y_out, axis=1)
+
+    def scores(self, y_out, y):
+        """Data cost, error and MSE of the outputs y_out for the targets y (as the Theano script reports them)."""
+        n = y_out.shape[0]
+        if self.output != 'linear':
+            y = np.asarray(y, dtype=int).ravel()
+            p_true = y_out[np.arange(n), y]
+            cost = -np.mean(np.log(p_true))
+            error = np.mean(np.argmax(y_out, axis=1) != y)
+            # squared distance to the one-hot labels
+            mse = (np.sum(y_out**2) - 2*np.sum(p_true) + n)/n
+        else:
+            diff = y_out - np.asarray(y, dtype=self.dtype).reshape(y_out.shape)
+            cost = np.sum(diff**2)/n
+            error = np.mean(np.abs(diff))
+            mse = cost
+        return cost, error, mse
+
+    def penalty(self, beta_list):
+        """L1 (with the beta of every hidden layer) and L2 penalties of the current weights."""
+        axis = 0 if self.flag_nodewise == 1 else None
+        cost = 0.0
+        for i in range(self.n_layers):
+            L1norm, L2norm = l1_l2_norms(self.W[i], axis)
+            if i < self.n_layers-1:
+                cost += float(np.sum(L1norm*beta_list[i]))
+            cost += self.L2_reg*float(np.sum(L2norm**2))
+        return cost
+
+    def train_step(self, x, y, beta_list, learning_rate, momentum=0.0, compute_penalty=True):
+        """One update of the weights on the minibatch x, y (batch_size samples).
+
+        :type beta_list: list of numpy.ndarray
+        :param beta_list: beta of every hidden layer (a vector node-wise, one value layer-wise)
+
+        Returns the cost (with the penalties of the weights before the update, if compute_penalty),
+        the error and the MSE of the minibatch.
+        """
+        scores = self.gradients(x, y, beta_list, compute_penalty)
+        self.update(learning_rate, momentum)
+        return scores
+
+    def gradients(self, x, y, beta_list, compute_penalty=True):
+        """Compute the gradients of the cost on the minibatch x, y into self.grads (the weights, then the biases).
+
+        Returns the cost, the error and the MSE of the minibatch, as train_step.
+        """
+        bs = self.batch_size
+        x = np.asarray(x, dtype=self.dtype)
+        outputs = self.forward(x, out=self._h, logits=self._logits)
+        cost, error, mse = self.scores(outputs[-1], y)
+        if compute_penalty:
+            cost += self.penalty(beta_list)
+
+        # delta of the output layer: d(cost)/d(linear output)
+        delta = self._delta[-1]
+        if self.output != 'linear':
+            delta[...] = outputs[-1]
+            delta[np.arange(bs), np.asarray(y, dtype=int).ravel()] -= 1.0
+            delta /= bs
+            if self.output == 'tanh_softmax':
+                _tanh_grad(self._logits, self._logits)
+                delta *= self._logits
+        else:
+            np.subtract(outputs[-1], np.asarray(y, dtype=self.dtype).reshape(delta.shape), out=delta)
+            delta *= 2.0/bs
+
+        act_grad = ACTIVATIONS[self.activation][1]
+        for i in reversed(range(self.n_layers)):
+            h_in = x if i == 0 else outputs[i-1]
+            gW = self.grads[i]
+            gb = self.grads[self.n_layers+i]
+            if self.support[i] is None:
+                np.dot(h_in.T, self._delta[i], out=gW)
+            elif self._sparse_products[i]:
+                self._support_gradients(i, h_in, gW)
+            else:
+                tmp = self._scratch_like(self.W[i])
+                np.dot(h_in.T, self._delta[i], out=tmp)
+                np.take(tmp, self.support[i], out=gW)
+            np.sum(self._delta[i], axis=0, out=gb)
+
+            # back-propagate the delta before the weights of this layer change
+            if i > 0:
+                if self._sparse_products[i]:
+                    self._delta[i-1][...] = self._csr[i].dot(self._delta[i].T).T
+                else:
+                    np.dot(self._delta[i], self.W[i].T, out=self._delta[i-1])
+                act_grad(outputs[i-1], self._act_grad[i-1])
+                self._delta[i-1] *= self._act_grad[i-1]
+
+            # L1 (hidden layers) and L2 penalties, on the surviving weights of a sparse layer
+            W = self.params[i]
+            tmp = self._scratch_like(W)
+            if i < self.n_layers-1:
+                np.sign(W, out=tmp)
+                beta = np.asarray(beta_list[i], dtype=self.dtype)
+                if self.support[i] is not None and beta.size > 1:
+                    beta = np.take(beta, self._cols[i], out=self._support_beta[i])
+                tmp *= beta
+                gW += tmp
+            np.multiply(W, 2*self.L2_reg, out=tmp)
+            gW += tmp
+
+        return cost, error, mse
+
+    def _support_gradients(self, i, h_in, out):
+        # gradient of the surviving weights only: the dot product of the input column (row of the
+        # weight) and the delta column (node) of every surviving weight, SPARSE_CHUNK weights at a time
+        rows, cols = self._rows[i], self._cols[i]
+        for start in range(0, rows.size, SPARSE_CHUNK):
+            stop = min(start+SPARSE_CHUNK, rows.size)
+            np.einsum('ij,ij->j', np.take(h_in, rows[start:stop], axis=1), np.take(self._delta[i], cols[start:stop], axis=1),
+                      out=out[start:stop])
+
+    def update(self, learning_rate, momentum=0.0):
+        """Apply the optimizer to the weights with the gradients in self.grads (which are overwritten)."""
+        if self._state is None:
+            raise ValueError('the model computes gradients only, it was built with optimizer_state=False')
+        if self.optimizer_algorithm == 'Grad':
+            # delta = lr*g + momentum*delta_old;  p -= delta
+            for p, g, delta in zip(self.params, self.grads, self._state):
+                delta *= momentum
+                g *= learning_rate
+                delta += g
+                p -= delta
+
+        elif self.optimizer_algorithm == 'Adam':
+            # the rule and constants of adam() of the Theano script
+            b1 = 0.99
+            b2 = 0.999
+            e = 1e-8
+            gamma = 1-1e-8
+            b1_t = b1*gamma**(self._t-1)
+            step = learning_rate/(1-b1**self._t)
+            v_scale = 1.0/(1-b2**self._t)
+            for p, g, m, v in zip(self.params, self.grads, self._state, self._state2):
+                tmp = self._scratch_like(g)
+                m *= b1_t
+                np.multiply(g, 1-b1_t, out=tmp)
+                m += tmp
+                np.multiply(g, g, out=g)
+                v *= b2
+                g *= (1-b2)
+                v += g
+                # g <- lr*m_hat/(sqrt(v_hat)+e)
+                np.multiply(v, v_scale, out=g)
+                np.sqrt(g, out=g)
+                g += e
+                np.divide(m, g, out=g)
+                g *= step
+                p -= g
+            self._t += 1.0
+
+        elif self.optimizer_algorithm == 'Rmsp':
+            # the rule and constants of RMSprop() of the Theano script
+            rho = 0.9
+            epsilon = 1e-6
+            for p, g, acc in zip(self.params, self.grads, self._state):
+                acc *= rho
+                tmp = self._scratch_like(g)
+                np.multiply(g, g, out=tmp)
+                tmp *= (1-rho)
+                acc += tmp
+                np.add(acc, epsilon, out=tmp)
+                np.sqrt(tmp, out=tmp)
+                g /= tmp
+                g *= learning_rate
+                p -= g
+
+        # the dense weights of the sparse layers (zero outside the surviving weights)
+        for i in range(self.n_layers):
+            if self.support[i] is not None:
+                np.put(self.W[i], self.support[i], self.params[i])
+
+
+def train_mlp(n_nodes=[74484,100,100,100,4], datasets='lhrhadvs_sample_data.mat',
+              batch_size=40, n_epochs=300, learning_rate=0.001, activation='tanh', output='softmax',
+              beginAnneal=50, min_annel_lrate=1e-4, decay_rate=0.0005, momentum_val=0.01,
+              optimizer_algorithm='Grad', tg_hspset=[0.7, 0.7, 0.5], max_beta=[0.05, 0.95, 0.7],
+              beta_lrates=1e-2, L2_reg=1e-4, flag_nodewise=0, hsp_every=1, init_params=None,
+              eval_chunk=256, n_workers=1, precision='float32', sparse_hsp=None, sparse_keep_scale=1.0, regrow_every=5,
+              sav_path=None, verbose=True):
+    """Train the MLP with the hyperparameters and the training loop of test_mlp (dnnwsp_hsp_theano.py).
+
+    The minibatches are taken in order, beta is updated after the optimizer step on the
+    hsp_every schedule and the learning rate is annealed after every epoch, as in test_mlp.
+    datasets is a data file or dataset directory (dnnwsp.dataset) or a dict with train_x,
+    train_y, test_x and test_y (integer labels for a softmax output, responses for a linear one).
+    With n_workers > 1, the gradients of every minibatch are computed by n_workers processes
+    (dnnwsp.parallel.DataParallelMLP). precision is the policy of dnnwsp.precision: the samples
+    are kept in its storage dtype, and the weights, optimizer state and sparsity control are
+    audited after every epoch. Once the mean Hoyer's sparseness of the first layer reaches
+    sparse_hsp, the first layer is trained on its surviving weights only (NumpyMLP.sparsify_layer
+    with sparse_keep_scale), and its pruned weights are checked for regrowth every regrow_every
+    epochs (NumpyMLP.regrow, on the first minibatch). The wall-clock time of every epoch is
+    recorded in epoch_time.
+
+    Returns the trained NumpyMLP and the dict of results (the variables test_mlp saves).
+    """
+    if isinstance(datasets, str):
+        datasets = load_dataset(datasets)
+    precision_policy = PrecisionPolicy(precision)
+    train_x = precision_policy.store(datasets['train_x'])
+    test_x = precision_policy.store(datasets['test_x'])
+    train_y = np.ravel(datasets['train_y']) if output != 'linear' else datasets['train_y']
+    test_y = np.ravel(datasets['test_y']) if output != 'linear' else datasets['test_y']
+    n_train_batches = int(np.shape(train_x)[0] / batch_size)
+    if sparse_hsp is not None and n_workers > 1:
+        raise ValueError('sparse_hsp is not supported with n_workers > 1 (the workers train dense layers)')
+
+    sparsity = SparsityControl(n_nodes[1:-1], tg_hspset, max_beta, beta_lrates, nodewise=(flag_nodewise==1),
+                               dtype=precision_policy.compute_dtype)
+    if n_workers > 1:
+        from .parallel import DataParallelMLP
+        trainer = DataParallelMLP(n_workers, n_nodes, batch_size, activation, output, optimizer_algorithm, flag_nodewise,
+                                  L2_reg, init_params)
+        model = trainer.model
+        train_step = lambda batch: trainer.step(batch, sparsity.layer_beta, learning_rate, momentum_val, compute_penalty=False)
+    else:
+        model = NumpyMLP(n_nodes, activation, output, batch_size, optimizer_algorithm, flag_nodewise, L2_reg, init_params,
+                         dtype=precision_policy.compute_dtype)
+        train_step = lambda batch: model.train_step(train_x[batch*batch_size:(batch+1)*batch_size], train_y[batch*batch_size:(batch+1)*batch_size],
+                                                    sparsity.layer_beta, learning_rate, momentum_val, compute_penalty=False)
+    hsp_schedule = HspSchedule(hsp_every)
+    n_hidden = len(n_nodes)-2
+    precision_policy.audit('start', {'train_x': train_x, 'test_x': test_x}, **model.arrays())
+    if n_workers > 1:
+        trainer.start(train_x, train_y, sparsity.sizes)
+
+    train_errors = np.zeros(n_epochs)
+    test_errors = np.zeros(n_epochs)
+    train_mse = np.zeros(n_epochs)
+    test_mse = np.zeros(n_epochs)
+    lrs = np.zeros(n_epochs)
+    epoch_time = np.zeros(n_epochs)
+    density = np.ones(n_epochs)
+    sparse_epoch = 0
+    all_hsp_vals = [np.zeros((n_epochs, sparsity.sizes[i])) for i in range(n_hidden)]
+    all_L1_beta_vals = [np.zeros((n_epochs, sparsity.sizes[i])) for i in range(n_hidden)]
+
+    start_time = timeit.default_timer()
+    for epoch in range(1, n_epochs+1):
+        epoch_start = timeit.default_timer()
+        batch_errors = np.zeros(n_train_batches)
+        batch_mses = np.zeros(n_train_batches)
+
+        for minibatch_index in range(n_train_batches):
+            # the cost is not reported by test_mlp, so the penalties are not computed
+            _, batch_errors[minibatch_index], batch_mses[minibatch_index] = train_step(minibatch_index)
+
+            if hsp_schedule.due(minibatch_index, n_train_batches):
+                sparsity.update(model.hidden_weights())
+
+        [test_err, test_mse_epoch] = evaluate(lambda x, y: model.scores(model.forward(np.asarray(x, dtype=model.dtype))[-1], y)[1:],
+                                              test_x, test_y, eval_chunk)
+
+        # the run fails if anything was upcast during the epoch
+        precision_policy.audit('epoch %d' % epoch, beta=sparsity.beta, hsp=sparsity.hsp, **model.arrays())
+
+        for i in range(n_hidden):
+            all_hsp_vals[i][epoch-1] = sparsity.layer_hsp[i]
+            all_L1_beta_vals[i][epoch-1] = sparsity.layer_beta[i]
+        train_errors[epoch-1] = np.mean(batch_errors)*100
+        test_errors[epoch-1] = test_err*100
+        train_mse[epoch-1] = np.mean(batch_mses)
+        test_mse[epoch-1] = test_mse_epoch
+
+        # Begin Annealing
+        if beginAnneal != 0 and epoch > beginAnneal:
+            learning_rate = max(min_annel_lrate, (-decay_rate*epoch + (1+decay_rate*beginAnneal)) * learning_rate)
+        lrs[epoch-1] = learning_rate
+
+        # train the first layer on its surviving weights once it is sparse enough
+        if sparse_epoch == 0 and sparse_hsp is not None and np.mean(sparsity.layer_hsp[0]) >= sparse_hsp:
+            model.sparsify_layer(0, sparse_keep_scale)
+            sparse_epoch = epoch
+        elif sparse_epoch > 0 and (epoch-sparse_epoch) % regrow_every == 0:
+            n_added, n_dropped = model.regrow(0, train_x[:batch_size], train_y[:batch_size], sparsity.layer_beta, sparse_keep_scale)
+            if verbose:
+                print('regrowth of layer 1 : %d weights added, %d dropped' % (n_added, n_dropped))
+        density[epoch-1] = model.density(0)
+        epoch_time[epoch-1] = timeit.default_timer() - epoch_start
+
+        if verbose:
+            print('%s control, epoch %i/%d, Tr.err= %.2f, Ts.err= %.2f, lr = %.6f, %.2f s, density_l1 = %.3f, %s'
+                  % ('Node-wise' if flag_nodewise == 1 else 'Layer-wise', epoch, n_epochs, train_errors[epoch-1],
+                     test_errors[epoch-1], lrs[epoch-1], epoch_time[epoch-1], density[epoch-1],
+                     ', '.join('hsp_l%d = %.2f/%.2f, beta_l%d = %.2f' % (i+1, np.mean(sparsity.layer_hsp[i]), tg_hspset[i],
+                                                                         i+1, np.mean(sparsity.layer_beta[i])) for i in range(n_hidden))))
+
+    if n_workers > 1:
+        trainer.close()
+
+    results = {'train_errors': train_errors, 'test_errors': test_errors, 'train_mse': train_mse, 'test_mse': test_mse,
+               'l_rate': lrs, 'hsp_vals': all_hsp_vals, 'L1_vals': all_L1_beta_vals,
+               'epoch_time': epoch_time, 'density': density, 'sparse_epoch': sparse_epoch,
+               'cst_time': (timeit.default_timer() - start_time) / 60.}
+
+    if sav_path is not None:
+        if not os.path.exists(sav_path):
+            os.makedirs(sav_path)
+        data_variable = dict(results)
+        for i in range(model.n_layers):
+            data_variable['w%d' % (i+1)] = model.W[i]
+            data_variable['b%d' % (i+1)] = model.b[i]
+        data_variable['momtentum'] = momentum_val
+        data_variable['beginAnneal'] = beginAnneal
+        data_variable['decay_lr'] = decay_rate
+        data_variable['beta_lrates'] = beta_lrates
+        data_variable['max_beta'] = max_beta
+        data_variable['tg_hspset'] = tg_hspset
+        data_variable['batch_size'] = batch_size
+        data_variable['n_epochs'] = n_epochs
+        data_variable['min_annel_lrate'] = min_annel_lrate
+        data_variable['n_nodes'] = n_nodes
+        data_variable['hsp_every'] = hsp_every
+        data_variable['optimizer_algorithm'] = optimizer_algorithm
+        data_variable['precision'] = precision
+        data_variable['sparse_hsp'] = -1 if sparse_hsp is None else sparse_hsp
+        sio.savemat('%s/mlp_rst_%s_%s_numpy.mat' % (sav_path, 'node' if flag_nodewise == 1 else 'layer',
+                                                    '-'.join(str(n) for n in n_nodes[1:-1])), data_variable)
+
+    return model, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the DNN with weight sparsity control in NumPy.')
+    parser.add_argument('datasets', help='.mat file or dataset directory with train_x, train_y, test_x and test_y')
+    parser.add_argument('--nodes', default='74484,100,100,100,4', help='number of nodes of every layer')
+    parser.add_argument('--epochs', type=int, default=300, help='number of training epochs')
+    parser.add_argument('--optimizer', default='Grad', choices=OPTIMIZERS, help='optimizer of test_mlp')
+    parser.add_argument('--activation', default='tanh', choices=sorted(ACTIVATIONS), help='activation of the hidden layers')
+    parser.add_argument('--nodewise', action='store_true', help='node-wise control of weight sparsity (layer-wise by default)')
+    parser.add_argument('--precision', default='float32', choices=sorted(POLICIES), help='precision policy (dnnwsp.precision)')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes computing the gradients of a minibatch')
+    parser.add_argument('--sparse-hsp', type=float, help='train the first layer on its surviving weights from this Hoyer\'s sparseness')
+    parser.add_argument('--save', help='directory to save the results')
+    args = parser.parse_args()
+
+    train_mlp(n_nodes=[int(n) for n in args.nodes.split(',')], datasets=args.datasets, n_epochs=args.epochs,
+              optimizer_algorithm=args.optimizer, activation=args.activation, flag_nodewise=int(args.nodewise),
+              n_workers=args.workers, precision=args.precision, sparse_hsp=args.sparse_hsp, sav_path=args.save)
@@ -0,0 +1,252 @@
+"""
+Data-parallel training of the MLP on the cores of one machine.
+
+One TensorFlow session or Theano process does not keep many cores busy with
+minibatches of 40 samples. DataParallelMLP splits every minibatch into n_workers
+shards: each worker process computes the gradients of its shard with the NumPy
+engine (dnnwsp.numpy_mlp) on the master weights, which live in shared memory
+and are read without a copy. The gradients are averaged (weighted by the size of
+the shards) in shared memory, every worker reducing its own slice of the
+parameters, and the coordinator applies one optimizer step to the master
+weights. The weight sparsity control then runs once per step on the master
+weights, in the coordinator (e.g. SparsityControl.update(trainer.W[:-1])).
+
+The workers synchronize with the coordinator on one barrier, three times per step:
+the minibatch is set, the gradients are computed, the gradients are reduced. A
+worker that fails aborts the barrier, the coordinator checks that no worker has
+exited (e.g. killed by the system) before every wait and waits at most timeout
+seconds for the workers within a step, so step raises BrokenBarrierError
+instead of waiting forever.
+
+The training set is given to the workers when they start (inherited without a
+copy with the fork start method, e.g. a memory-mapped dataset).
+"""
+
+import multiprocessing as mp
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from .numpy_mlp import NumpyMLP
+
+# control values shared with the workers: the first position of the minibatch in the order,
+# whether to compute the penalties in the cost, and the stop flag
+_START, _PENALTY, _STOP = range(3)
+
+# seconds the coordinator waits for the workers within a step
+TIMEOUT = 300.0
+
+
+def _shared(shape, dtype=np.float32):
+    # a numpy array in shared memory, with the raw array to hand to the workers
+    raw = mp.RawArray(np.ctypeslib.as_ctypes_type(np.dtype(dtype)), int(np.prod(shape)))
+    return raw, np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _view(raw, shape, dtype=np.float32):
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _worker(k, model_args, shapes, shard_sizes, x, y, raw_params, raw_grads, raw_master_grads, raw_order,
+            raw_beta, beta_index, raw_scores, raw_control, barrier, timeout):
+    try:
+        _work(k, model_args, shapes, shard_sizes, x, y, raw_params, raw_grads, raw_master_grads, raw_order,
+              raw_beta, beta_index, raw_scores, raw_control, barrier, timeout)
+    except BrokenBarrierError:
+        # the coordinator or another worker failed
+        pass
+    except BaseException:
+        # release the coordinator and the other workers, the traceback is printed by the process
+        barrier.abort()
+        raise
+
+
+def _work(k, model_args, shapes, shard_sizes, x, y, raw_params, raw_grads, raw_master_grads, raw_order,
+          raw_beta, beta_index, raw_scores, raw_control, barrier, timeout):
+    n_workers = len(shard_sizes)
+    offset = int(np.sum(shard_sizes[:k]))
+    weights = np.asarray(shard_sizes, dtype=np.float32)/np.sum(shard_sizes)
+
+    # the master weights and the gradient slots of every worker, without copies
+    # (the model only computes gradients: no initialization and no optimizer state)
+    n_layers = len(model_args['n_nodes'])-1
+    params = [_view(raw, shape) for raw, shape in zip(raw_params, shapes)]
+    model = NumpyMLP(batch_size=shard_sizes[k], init_params=list(zip(params[:n_layers], params[n_layers:])),
+                     share_params=True, optimizer_state=False, **model_args)
+    grads = [[_view(raw, shape) for raw, shape in zip(raw_grads[m], shapes)] for m in range(n_workers)]
+    model.grads = grads[k]
+    master_grads = [_view(raw, shape) for raw, shape in zip(raw_master_grads, shapes)]
+
+    order = _view(raw_order, (len(raw_order),), np.int64)
+    beta = _view(raw_beta, (len(raw_beta),))
+    beta_list = [beta[beta_index[i]:beta_index[i+1]] for i in range(len(beta_index)-1)]
+    scores = _view(raw_scores, (n_workers, 3), np.float64)
+    control = _view(raw_control, (3,), np.int64)
+
+    while True:
+        # (no timeout between two steps, the coordinator evaluates or saves the network)
+        barrier.wait()
+        if control[_STOP]:
+            break
+
+        # gradients of the shard of the minibatch
+        start = control[_START]+offset
+        ids = np.sort(order[start:start+shard_sizes[k]])
+        scores[k] = model.gradients(np.take(x, ids, axis=0), np.take(y, ids, axis=0), beta_list, bool(control[_PENALTY]))
+        barrier.wait(timeout)
+
+        # weighted mean of the gradients of all workers, on the k-th slice of every parameter
+        for j in range(len(shapes)):
+            size = master_grads[j].size
+            lo = size*k//n_workers
+            hi = size*(k+1)//n_workers
+            out = master_grads[j].reshape(-1)[lo:hi]
+            np.multiply(grads[0][j].reshape(-1)[lo:hi], weights[0], out=out)
+            for m in range(1, n_workers):
+                part = grads[m][j].reshape(-1)[lo:hi]
+                part *= weights[m]
+                out += part
+        barrier.wait(timeout)
+
+
+class DataParallelMLP(object):
+
+    def __init__(self, n_workers, n_nodes, batch_size, activation='tanh', output='softmax', optimizer_algorithm='Grad',
+                 flag_nodewise=0, L2_reg=1e-4, init_params=None, timeout=TIMEOUT):
+        """
+        :type n_workers: int
+        :param n_workers: number of worker processes (each computes the gradients of a shard of the minibatch)
+
+        :type n_nodes: list of int
+        :param n_nodes: number of nodes of the input, hidden and output layers
+
+        :type batch_size: int
+        :param batch_size: number of samples of a minibatch (split into n_workers shards)
+
+        :type timeout: float
+        :param timeout: seconds to wait for the workers within a step before step raises BrokenBarrierError
+
+        The other parameters are the ones of NumpyMLP.
+        """
+        if n_workers < 1 or n_workers > batch_size:
+            raise ValueError('n_workers should be between 1 and the batch size %d, got %r' % (batch_size, n_workers))
+
+        self.n_workers = int(n_workers)
+        self.batch_size = int(batch_size)
+        self.shard_sizes = [len(shard) for shard in np.array_split(np.arange(batch_size), n_workers)]
+        self.timeout = timeout
+        self._model_args = dict(n_nodes=n_nodes, activation=activation, output=output, optimizer_algorithm=optimizer_algorithm,
+                                flag_nodewise=flag_nodewise, L2_reg=L2_reg)
+
+        # the master model: its weights and its (averaged) gradients are in shared memory
+        self.model = NumpyMLP(batch_size=1, init_params=init_params, **self._model_args)
+        self._shapes = [p.shape for p in self.model.params]
+        shared = [_shared(shape) for shape in self._shapes]
+        for (_, param), p in zip(shared, self.model.params):
+            param[...] = p
+        self._raw_params = [raw for raw, _ in shared]
+        self.model.set_params([param for _, param in shared[:self.model.n_layers]], [param for _, param in shared[self.model.n_layers:]])
+        shared = [_shared(shape) for shape in self._shapes]
+        self._raw_master_grads = [raw for raw, _ in shared]
+        self.model.grads = [grad for _, grad in shared]
+
+        self._workers = []
+
+    @property
+    def W(self):
+        """Master weights of every layer (in shared memory)."""
+        return self.model.W
+
+    @property
+    def b(self):
+        """Master biases of every layer (in shared memory)."""
+        return self.model.b
+
+    def start(self, x, y, beta_sizes):
+        """Start the workers on the training set x (samples), y (labels or responses).
+
+        :type beta_sizes: list of int
+        :param beta_sizes: number of betas of each hidden layer (SparsityControl.sizes)
+
+        Returns the number of minibatches of an epoch.
+        """
+        self.close()
+        n_samples = np.shape(x)[0]
+        self._raw_order, self.order = _shared((n_samples,), np.int64)
+        self.order[...] = np.arange(n_samples)
+        beta_index = np.concatenate([[0], np.cumsum(beta_sizes)]).astype(int)
+        self._raw_beta, self._beta = _shared((beta_index[-1],))
+        self._beta_list = [self._beta[beta_index[i]:beta_index[i+1]] for i in range(len(beta_sizes))]
+        raw_scores, self._scores = _shared((self.n_workers, 3), np.float64)
+        raw_control, self._control = _shared((3,), np.int64)
+        self._barrier = mp.Barrier(self.n_workers+1)
+
+        raw_grads = [[_shared(shape)[0] for shape in self._shapes] for _ in range(self.n_workers)]
+        for k in range(self.n_workers):
+            worker = mp.Process(target=_worker, args=(k, self._model_args, self._shapes, self.shard_sizes, x, y,
+                                                      self._raw_params, raw_grads, self._raw_master_grads, self._raw_order,
+                                                      self._raw_beta, beta_index, raw_scores, raw_control, self._barrier,
+                                                      self.timeout))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self.n_batches = n_samples//self.batch_size
+        return self.n_batches
+
+    def shuffle(self, rng=np.random):
+        """Shuffle the order of the training samples (for the next epoch)."""
+        self.order[...] = rng.permutation(self.order.size)
+
+    def step(self, batch, beta_list, learning_rate, momentum=0.0, compute_penalty=True):
+        """Train on the batch-th minibatch: gradients in the workers, one optimizer step on the master weights.
+
+        Returns the cost, the error and the MSE of the minibatch, as NumpyMLP.train_step. Raises
+        BrokenBarrierError (and stops the workers) if a worker failed or did not answer within timeout.
+        """
+        for beta, b in zip(self._beta_list, beta_list):
+            beta[...] = b
+        self._control[_START] = batch*self.batch_size
+        self._control[_PENALTY] = int(compute_penalty)
+
+        # minibatch set -> gradients computed -> gradients reduced
+        self._wait()
+        self._wait()
+        self._wait()
+
+        self.model.update(learning_rate, momentum)
+        weights = np.asarray(self.shard_sizes, dtype=np.float64)/self.batch_size
+        return tuple(np.dot(weights, self._scores))
+
+    def _wait(self):
+        # a worker killed by the system (e.g. out of memory) while it waits never wakes up from the barrier,
+        # check that all the workers are alive before waiting for them
+        exitcodes = [worker.exitcode for worker in self._workers]
+        if any(code is not None for code in exitcodes):
+            self._terminate()
+            raise BrokenBarrierError('a worker process exited, exit codes %s' % exitcodes)
+        try:
+            self._barrier.wait(self.timeout)
+        except BrokenBarrierError:
+            self._terminate()
+            raise
+
+    def _terminate(self):
+        # stop the workers of a broken barrier (without the barrier, a dead worker may be one of its waiters)
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        self._workers = []
+
+    def close(self):
+        """Stop the workers."""
+        if len(self._workers) == 0:
+            return
+        self._control[_STOP] = 1
+        try:
+            self._wait()
+        except BrokenBarrierError:
+            return
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
@@ -0,0 +1,109 @@
+"""
+tf.data input pipeline of the TensorFlow trainers.
+
+With feed_dict the next minibatch is gathered in Python only after the previous
+sess.run call has returned, so batch preparation and the training step never
+overlap. InputPipeline shuffles the sample indices in the graph, gathers the
+minibatches from the (in-memory or memory-mapped) training arrays in
+n_threads parallel calls and keeps the next batches prefetched while the current
+step runs. The graph reads X and Y from the iterator; they are
+placeholder_with_default tensors, so feeding them (e.g. the whole test set to
+the error op) still works as before and does not touch the iterator.
+
+The index dataset is repeated, so one initialization (start) per fit serves all
+epochs and the prefetch runs across the epoch boundaries; every epoch is
+reshuffled and has exactly n_batches minibatches (the last incomplete batch is
+dropped, like the feed_dict loop).
+
+prefetch_each builds the data of the next fold in a background thread while the
+current fold trains.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+
+class InputPipeline(object):
+
+    def __init__(self, n_in, n_out, batch_size, n_threads=2, prefetch=2):
+        """
+        :type n_in: int
+        :param n_in: number of input features (columns of the samples)
+
+        :type n_out: int
+        :param n_out: number of output nodes (columns of the one-hot labels)
+
+        :type batch_size: int
+        :param batch_size: number of samples of a minibatch
+
+        :type n_threads: int
+        :param n_threads: number of minibatches gathered in parallel
+
+        :type prefetch: int
+        :param prefetch: number of minibatches prepared ahead of the training step
+        """
+        self.batch_size = int(batch_size)
+        self.n_batches = 0
+        # the arrays of every start by number, fed to the iterator at its initialization, so a gather still
+        # running for the previous fold (in a prefetch thread) never reads the arrays of the next one
+        self._arrays = {}
+        self._n_starts = 0
+
+        # the input ops run on the CPU, whatever device the model is placed on
+        with tf.device('/cpu:0'):
+            self._n_samples = tf.placeholder(tf.int64, [])
+            self._start = tf.placeholder(tf.int64, [])
+
+            dataset = tf.data.Dataset.range(self._n_samples)
+            dataset = dataset.shuffle(self._n_samples, reshuffle_each_iteration=True)
+            dataset = dataset.batch(self.batch_size, drop_remainder=True).repeat()
+            dataset = dataset.map(lambda ids: tuple(tf.py_func(self._gather, [ids, self._start], [tf.float32, tf.float32])),
+                                  num_parallel_calls=n_threads)
+            dataset = dataset.prefetch(prefetch)
+
+            self.iterator = dataset.make_initializable_iterator()
+            batch_x, batch_y = self.iterator.get_next()
+
+        batch_x.set_shape([self.batch_size, n_in])
+        batch_y.set_shape([self.batch_size, n_out])
+        self.X = tf.placeholder_with_default(batch_x, [None, n_in])
+        self.Y = tf.placeholder_with_default(batch_y, [None, n_out])
+
+    def _gather(self, ids, start):
+        # rows in ascending order (sequential reads of a memory-mapped dataset)
+        ids = np.sort(ids)
+        x, y = self._arrays[int(start)]
+        # float32 minibatches, whatever dtype the samples are stored in (e.g. float16)
+        return np.asarray(np.take(x, ids, axis=0), dtype=np.float32), np.asarray(np.take(y, ids, axis=0), dtype=np.float32)
+
+    def start(self, sess, x, y):
+        """Train on the arrays x (float32 samples) and y (float32 one-hot labels) from now on.
+
+        Returns the number of minibatches of an epoch.
+        """
+        self._n_starts += 1
+        self._arrays[self._n_starts] = (x, y)
+        sess.run(self.iterator.initializer, {self._n_samples: np.shape(x)[0], self._start: self._n_starts})
+        # keep the previous arrays for a gather of the old iterator that may still be running
+        self._arrays = {n: arrays for n, arrays in self._arrays.items() if n >= self._n_starts-1}
+        self.n_batches = np.shape(x)[0]//self.batch_size
+        return self.n_batches
+
+
+def prefetch_each(fn, args_list, background=True):
+    """Yield fn(*args) for every args of args_list, computing the next one in a
+    background thread while the current one is used."""
+    if not background:
+        for args in args_list:
+            yield fn(*args)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        job = executor.submit(fn, *args_list[0]) if len(args_list) > 0 else None
+        for i in range(len(args_list)):
+            result = job.result()
+            if i+1 < len(args_list):
+                job = executor.submit(fn, *args_list[i+1])
+            yield result
@@ -0,0 +1,96 @@
+"""
+Precision policy of the trainers.
+
+The dtype of the data and the weights is decided in many places (sio.loadmat
+gives float64, the TensorFlow placeholders are float32, the Theano layers use
+theano.config.floatX), so a float64 array can make every step convert or
+compute in float64 without anyone noticing. A PrecisionPolicy names two dtypes:
+
+    storage : the dtype the input samples are kept in (in RAM, in the graph,
+              in a dataset directory)
+    compute : the dtype of the weights, the optimizer state, the betas and
+              Hoyer's sparseness, and of the minibatches once they are gathered
+
+'float32' keeps everything in float32. 'float16' stores the samples in float16
+(half the memory of the 74484-wide inputs) and upcasts every minibatch to
+float32 when it is gathered. 'float64' is the double precision of Theano with
+floatX=float64.
+
+audit raises a ValueError that lists every array (or graph tensor, or Theano
+variable) whose floating dtype is not the one of the policy, so a silent
+upcast fails the run instead of doubling its memory and time.
+"""
+
+import numpy as np
+
+# storage and compute dtypes of each policy
+POLICIES = {
+    'float32': (np.float32, np.float32),
+    'float16': (np.float16, np.float32),
+    'float64': (np.float64, np.float64),
+}
+
+
+def dtype_of(a):
+    """numpy dtype of an array, a TensorFlow tensor or variable, or a Theano variable."""
+    dtype = getattr(a, 'dtype', None)
+    if dtype is None:
+        dtype = np.asarray(a).dtype
+    # TensorFlow: reference dtypes of variables and tf.DType
+    dtype = getattr(dtype, 'base_dtype', dtype)
+    dtype = getattr(dtype, 'as_numpy_dtype', dtype)
+    return np.dtype(dtype)
+
+
+class PrecisionPolicy(object):
+
+    def __init__(self, name='float32'):
+        """
+        :type name: str
+        :param name: 'float32', 'float16' (float16 samples, float32 computations) or 'float64'
+        """
+        if name not in POLICIES:
+            raise ValueError('precision should be one of %s, got %r' % (', '.join(sorted(POLICIES)), name))
+        self.name = name
+        self.storage_dtype, self.compute_dtype = [np.dtype(dtype) for dtype in POLICIES[name]]
+
+    def store(self, x):
+        """Return the samples x in the storage dtype (no copy if they already are)."""
+        return np.asarray(x, dtype=self.storage_dtype)
+
+    def compute(self, x, out=None):
+        """Return the minibatch x in the compute dtype, upcast into out if it is given."""
+        if out is None:
+            return np.asarray(x, dtype=self.compute_dtype)
+        np.copyto(out, x)
+        return out
+
+    def mismatches(self, inputs=None, **arrays):
+        """Names and dtypes of the floating arrays that do not follow the policy.
+
+        :type inputs: dict
+        :param inputs: the stored samples, expected in the storage dtype
+
+        The other arrays (weights, optimizer state, betas, costs) are expected in the
+        compute dtype. Integer arrays (e.g. labels and indices) are not checked.
+        """
+        found = []
+        for expected, group in [(self.storage_dtype, inputs or {}), (self.compute_dtype, arrays)]:
+            for name, a in sorted(group.items()):
+                dtype = dtype_of(a)
+                if np.issubdtype(dtype, np.floating) and dtype != expected:
+                    found.append('%s (%s)' % (name, dtype))
+        return found
+
+    def audit(self, stage, inputs=None, **arrays):
+        """Raise a ValueError if any floating array does not follow the policy (see mismatches)."""
+        found = self.mismatches(inputs, **arrays)
+        if len(found) > 0:
+            raise ValueError('precision audit (%s) failed under the %s policy (%s samples, %s computations): %s'
+                             % (stage, self.name, self.storage_dtype, self.compute_dtype, ', '.join(found)))
+
+    def describe(self, **inputs):
+        """One line with the policy and the memory of the stored samples."""
+        n_bytes = sum(np.asarray(x).nbytes for x in inputs.values())
+        return 'precision : %s (%s samples, %s computations), %.1f MB of samples' % (
+            self.name, self.storage_dtype, self.compute_dtype, n_bytes/2.**20)
@@ -0,0 +1,53 @@
+"""
+Preparation of the datasets for the TensorFlow scripts.
+
+The placeholders X and Y are float32. Feeding float64 arrays makes TensorFlow
+convert them on every sess.run call (every minibatch and every evaluation on the
+whole set), so the inputs are converted to float32 once when they are loaded, the
+labels are one-hot encoded in float32 without a Python loop over the samples, and
+check_float32 lists the arrays that a later step (e.g. np.vstack with a float64
+array) silently turned back into another dtype.
+
+With a float16 precision policy (dnnwsp.precision) the samples are stored in
+float16 instead and upcast to float32 minibatch by minibatch.
+"""
+
+import numpy as np
+
+
+def to_float32(x):
+    """Return x as a float32 array (no copy if it already is, e.g. a memory-mapped dataset)."""
+    return np.asarray(x, dtype=np.float32)
+
+
+def one_hot(labels, n_classes=None, dtype=np.float32):
+    """One-hot encode integer class labels.
+
+    :type labels: numpy.ndarray
+    :param labels: class index of each sample (n_samples or n_samples x 1)
+
+    :type n_classes: int
+    :param n_classes: number of classes, max(labels)+1 if None
+    """
+    labels = np.ravel(labels).astype(np.intp)
+    if n_classes is None:
+        n_classes = np.max(labels)+1
+    y = np.zeros((np.size(labels), n_classes), dtype=dtype)
+    y[np.arange(np.size(labels)), labels] = 1
+    return y
+
+
+def check_float32(**arrays):
+    """Return the names of the arrays that are not float32."""
+    return [name for name, arr in sorted(arrays.items()) if np.asarray(arr).dtype != np.float32]
+
+
+def prepare_classification(datasets, n_classes, names=('train', 'test'), dtype=np.float32):
+    """Samples (float32, or dtype) and float32 one-hot labels of the <name>_x and <name>_y arrays found in datasets."""
+    prepared = {}
+    for name in names:
+        if name+'_x' in datasets:
+            prepared[name+'_x'] = np.asarray(datasets[name+'_x'], dtype=dtype)
+        if name+'_y' in datasets:
+            prepared[name+'_y'] = one_hot(datasets[name+'_y'], n_classes)
+    return prepared
@@ -0,0 +1,225 @@
+"""
+Projection of the voxel inputs onto a few hundred or thousand features before the MLP.
+
+Every training step starts with the product of the 74484-voxel samples and the
+first layer. An InputProjection is fitted on the training samples only (the
+training folds of a cross-validation, so nothing of the validation or test
+samples leaks into the features) and maps every sample to n_components features:
+
+    'pca'            : the principal components of the centered training samples
+                       (from the eigenvectors of their Gram matrix, n_components
+                       is at most the number of training samples)
+    'randomized_svd' : the leading right singular vectors of the centered training
+                       samples by a randomized range finder with power iterations
+                       (Halko et al., 2011), an approximation of 'pca' in
+                       O(n_samples x n_voxels x n_components)
+    'sparse_random'  : a very sparse random projection (Li et al., 2006), entries
+                       +-sqrt(1/(density*n_components)) with probability density/2,
+                       not fitted (any n_components, a few thousand features)
+
+The samples are read in chunks of rows, so a memory-mapped dataset (dnnwsp.dataset)
+is never loaded whole. project_datasets projects the samples of a fold and, with a
+PreprocessCache (dnnwsp.cache), keeps the projected samples and the projection of
+every fold on local disk.
+
+The first layer of a network trained on the features maps back to voxel space:
+features = (x - mean) components, so features W + b = x (components W) + (b - mean components W),
+and voxel_weights / voxel_bias give the first layer on the voxels for interpretation
+(e.g. saved as w1_voxel next to w1).
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+METHODS = ('pca', 'randomized_svd', 'sparse_random')
+
+# number of samples read at once
+CHUNK_ROWS = 256
+# number of voxels of a block of the Gram matrix of 'pca'
+BLOCK_COLS = 8192
+
+
+# the products with the samples are float32 BLAS products (the samples are float32), the sums and
+# the orthogonalizations are in float64
+
+def _centered_dot(x, mean, M, chunk=CHUNK_ROWS):
+    # (x - mean) M, chunk of rows by chunk of rows
+    out = np.empty((np.shape(x)[0], M.shape[1]), dtype=np.float64)
+    M32 = np.asarray(M, dtype=np.float32)
+    shift = np.dot(mean, M)
+    for start in range(0, np.shape(x)[0], chunk):
+        out[start:start+chunk] = np.dot(np.asarray(x[start:start+chunk], dtype=np.float32), M32) - shift
+    return out
+
+
+def _centered_tdot(x, mean, Q, chunk=CHUNK_ROWS):
+    # (x - mean).T Q, summed over the chunks of rows
+    out = np.zeros((np.shape(x)[1], Q.shape[1]), dtype=np.float64)
+    Q32 = np.asarray(Q, dtype=np.float32)
+    for start in range(0, np.shape(x)[0], chunk):
+        out += np.dot(np.asarray(x[start:start+chunk], dtype=np.float32).T, Q32[start:start+chunk])
+    out -= np.outer(mean, Q.sum(axis=0))
+    return out
+
+
+class InputProjection(object):
+
+    def __init__(self, method='pca', n_components=200, random_state=1234, n_iter=4, n_oversamples=10, density=None):
+        """
+        :type method: str
+        :param method: 'pca', 'randomized_svd' or 'sparse_random'
+
+        :type n_components: int
+        :param n_components: number of features of the projected samples
+
+        :type n_iter: int
+        :param n_iter: number of power iterations of 'randomized_svd'
+
+        :type n_oversamples: int
+        :param n_oversamples: number of extra random vectors of 'randomized_svd'
+
+        :type density: float
+        :param density: fraction of nonzero entries of 'sparse_random' (1/sqrt(n_voxels) if None)
+        """
+        if method not in METHODS:
+            raise ValueError('method should be one of %s, got %r' % (', '.join(METHODS), method))
+        if int(n_components) < 1:
+            raise ValueError('n_components should be a positive number of features, got %r' % (n_components,))
+        self.method = method
+        self.n_components = int(n_components)
+        self.random_state = random_state
+        self.n_iter = n_iter
+        self.n_oversamples = n_oversamples
+        self.density = density
+        self.mean = None
+        self.components = None
+
+    def fit(self, x):
+        """Fit the projection on the training samples x (n_samples x n_voxels), returns self."""
+        n_samples, n_voxels = np.shape(x)
+        rng = np.random.RandomState(self.random_state)
+
+        if self.method == 'sparse_random':
+            density = self.density if self.density is not None else 1/np.sqrt(n_voxels)
+            nnz = rng.binomial(n_voxels*self.n_components, density)
+            index = np.unique(rng.randint(0, n_voxels*self.n_components, nnz))
+            values = np.where(rng.randint(0, 2, index.size) == 1, 1, -1)*np.sqrt(1/(density*self.n_components))
+            rows, cols = np.divmod(index, self.n_components)
+            self.mean = np.zeros(n_voxels, dtype=np.float32)
+            self.components = sp.csr_matrix((values.astype(np.float32), (rows, cols)), shape=(n_voxels, self.n_components))
+            return self
+
+        if self.n_components > n_samples:
+            raise ValueError('%s keeps at most the number of training samples %d, got n_components=%r'
+                             % (self.method, n_samples, self.n_components))
+        mean = np.zeros(n_voxels, dtype=np.float64)
+        for start in range(0, n_samples, CHUNK_ROWS):
+            mean += np.sum(x[start:start+CHUNK_ROWS], axis=0, dtype=np.float64)
+        mean /= n_samples
+
+        if self.method == 'pca':
+            # eigenvectors of the Gram matrix of the centered samples, then V = Xc.T U / s
+            gram = np.zeros((n_samples, n_samples), dtype=np.float64)
+            for start in range(0, n_voxels, BLOCK_COLS):
+                block = np.asarray(x[:, start:start+BLOCK_COLS], dtype=np.float64) - mean[start:start+BLOCK_COLS]
+                gram += np.dot(block, block.T)
+            eigvals, U = np.linalg.eigh(gram)
+            order = np.argsort(eigvals)[::-1][:self.n_components]
+            s = np.sqrt(np.maximum(eigvals[order], 0))
+            s[s == 0] = 1
+            V = _centered_tdot(x, mean, U[:, order]) / s
+        else:
+            # randomized range finder of the centered samples with power iterations, orthonormalized in the
+            # sample space only (n_samples x l), so nothing of the size of the voxels is factorized
+            l = min(self.n_components+self.n_oversamples, n_samples)
+            Q = np.linalg.qr(_centered_dot(x, mean, rng.standard_normal((n_voxels, l))))[0]
+            for _ in range(self.n_iter):
+                Q = np.linalg.qr(_centered_dot(x, mean, _centered_tdot(x, mean, Q)))[0]
+            # Xc ~ Q B with B = Q.T Xc, the right singular vectors of B from the eigenvectors of B B.T
+            Bt = _centered_tdot(x, mean, Q)
+            eigvals, U = np.linalg.eigh(np.dot(Bt.T, Bt))
+            order = np.argsort(eigvals)[::-1][:self.n_components]
+            s = np.sqrt(np.maximum(eigvals[order], 0))
+            s[s == 0] = 1
+            V = np.dot(Bt, U[:, order]) / s
+
+        self.mean = mean.astype(np.float32)
+        self.components = V.astype(np.float32)
+        return self
+
+    def transform(self, x, dtype=np.float32, chunk=CHUNK_ROWS):
+        """Projected samples (n_samples x n_components) in dtype."""
+        if self.components is None:
+            raise ValueError('the projection is not fitted')
+        out = np.empty((np.shape(x)[0], self.n_components), dtype=dtype)
+        for start in range(0, np.shape(x)[0], chunk):
+            xc = np.asarray(x[start:start+chunk], dtype=np.float32) - self.mean
+            out[start:start+chunk] = self.components.T.dot(xc.T).T if sp.issparse(self.components) else np.dot(xc, self.components)
+        return out
+
+    def fit_transform(self, x, dtype=np.float32):
+        return self.fit(x).transform(x, dtype)
+
+    def voxel_weights(self, W):
+        """First-layer weights (n_components x n_hidden) on the voxels (n_voxels x n_hidden)."""
+        W = np.asarray(W, dtype=np.float32)
+        return np.asarray(self.components.dot(W)) if sp.issparse(self.components) else np.dot(self.components, W)
+
+    def voxel_bias(self, W, b):
+        """First-layer bias on the voxels, so voxel_weights(W) and voxel_bias(W, b) give the same output on raw samples."""
+        return np.ravel(b) - np.dot(self.mean, self.voxel_weights(W))
+
+    def arrays(self, prefix='projection_'):
+        """The fitted projection as a dict of arrays (e.g. to save it with the projected samples)."""
+        arrays = {prefix+'mean': self.mean, prefix+'shape': np.asarray(self.components.shape)}
+        if sp.issparse(self.components):
+            arrays.update({prefix+'data': self.components.data, prefix+'indices': self.components.indices,
+                           prefix+'indptr': self.components.indptr})
+        else:
+            arrays[prefix+'components'] = self.components
+        return arrays
+
+    def set_arrays(self, arrays, prefix='projection_'):
+        """Take the fitted projection from the arrays saved by arrays, returns self."""
+        shape = tuple(int(n) for n in arrays[prefix+'shape'])
+        self.mean = np.asarray(arrays[prefix+'mean'])
+        if prefix+'components' in arrays:
+            self.components = np.asarray(arrays[prefix+'components'])
+        else:
+            self.components = sp.csr_matrix((np.asarray(arrays[prefix+'data']), np.asarray(arrays[prefix+'indices']),
+                                             np.asarray(arrays[prefix+'indptr'])), shape=shape)
+        self.n_components = shape[1]
+        return self
+
+
+def project_datasets(datasets, projection, names=('train', 'test'), dtype=np.float32, cache=None, sources=None, params=None):
+    """Fit the projection on <names[0]>_x of datasets and project the <name>_x samples of every name.
+
+    :type projection: InputProjection
+    :param projection: the (unfitted) projection, fitted on the first name (the training samples) only
+
+    :type cache: dnnwsp.cache.PreprocessCache
+    :param cache: keep the result on local disk, keyed by sources (the data files), params (e.g. the fold)
+                  and the settings of the projection, or None
+
+    Returns the projected datasets (the other arrays unchanged) and the fitted projection.
+    """
+    def compute():
+        projected = dict((key, datasets[key]) for key in datasets if not key.startswith('__'))
+        projection.fit(datasets[names[0]+'_x'])
+        for name in names:
+            if name+'_x' in datasets:
+                projected[name+'_x'] = projection.transform(datasets[name+'_x'], dtype)
+        projected.update(projection.arrays())
+        return projected
+
+    if cache is None:
+        projected = compute()
+    else:
+        settings = dict(params or {}, projection=projection.method, n_components=projection.n_components,
+                        random_state=projection.random_state, n_iter=projection.n_iter, n_oversamples=projection.n_oversamples,
+                        density=projection.density, dtype=np.dtype(dtype).name)
+        projected = cache.load(sources, settings, compute)
+
+    projection.set_arrays(projected)
+    return dict((key, arr) for key, arr in projected.items() if not key.startswith('projection_')), projection
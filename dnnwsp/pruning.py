@@ -0,0 +1,119 @@
+"""
+Structured pruning of hidden nodes after the node-wise weight sparsity control.
+
+A hidden node is dead when the product of the L2 norms of its incoming weights
+(a column of the layer) and of its outgoing weights (a row of the next layer) is a
+small fraction of the median over the layer, or when its Hoyer's sparseness stayed
+above hsp_tol over the last epochs of training (all but a few incoming weights are
+zero). Removing a node removes its column, its bias and the matching row of the
+next layer. The output of the node for a zero input, activation(bias), is folded
+into the bias of the next layer. This is exact only for a node whose incoming
+weights are all zero; the other dead nodes (a small norm product, or a few nonzero
+incoming weights left) change the output of the network a little, so shrink_network
+measures the accuracy of the pruned network instead of assuming it is unchanged,
+and reports which layers were pruned exactly.
+"""
+
+import numpy as np
+
+from .inference import ACTIVATIONS, predict
+
+
+def find_dead_nodes(W_in, W_out, hsp_trace=None, norm_tol=1e-2, hsp_tol=0.98, last_epochs=10):
+    """Return a boolean mask of the dead nodes of a hidden layer.
+
+    :type W_in: numpy.ndarray
+    :param W_in: incoming weights of the layer (n_in x n_nodes)
+
+    :type W_out: numpy.ndarray
+    :param W_out: outgoing weights, the weights of the next layer (n_nodes x n_out)
+
+    :type hsp_trace: numpy.ndarray
+    :param hsp_trace: Hoyer's sparseness of each node in every epoch (n_epochs x n_nodes), or None
+    """
+    strength = np.sqrt(np.sum(np.square(W_in), axis=0)) * np.sqrt(np.sum(np.square(W_out), axis=1))
+    dead = strength < norm_tol*np.median(strength)
+
+    if hsp_trace is not None:
+        hsp_trace = np.atleast_2d(hsp_trace)
+        dead |= np.mean(hsp_trace[-last_epochs:], axis=0) >= hsp_tol
+
+    # keep at least one node in the layer
+    if np.all(dead):
+        dead[np.argmax(strength)] = False
+    return dead
+
+
+def prune_nodes(weights, biases, dead_masks, activation='tanh'):
+    """Remove the dead nodes of every hidden layer.
+
+    :type dead_masks: list of numpy.ndarray
+    :param dead_masks: boolean mask of the dead nodes of each hidden layer
+
+    Returns the pruned weights and biases (new arrays). The fold of activation(bias) into the next
+    bias is exact for the removed nodes whose incoming weights are all zero only (see exact_masks).
+    """
+    act = ACTIVATIONS[activation]
+    weights = [np.array(W) for W in weights]
+    biases = [np.array(np.ravel(b)) for b in biases]
+
+    for i, dead in enumerate(dead_masks):
+        keep = ~np.asarray(dead, dtype=bool)
+        # constant output of the removed nodes, folded into the next layer
+        biases[i+1] += np.dot(act(biases[i][~keep]), weights[i+1][~keep]).astype(biases[i+1].dtype)
+
+        weights[i] = weights[i][:, keep]
+        biases[i] = biases[i][keep]
+        weights[i+1] = weights[i+1][keep]
+    return weights, biases
+
+
+def exact_masks(weights, dead_masks):
+    """Whether the removal of the dead nodes of each hidden layer leaves the output of the network unchanged
+    (all their incoming weights are zero)."""
+    return [not np.any(np.asarray(W)[:, np.asarray(dead, dtype=bool)]) for W, dead in zip(weights, dead_masks)]
+
+
+def network_stats(weights):
+    """Number of parameters and multiply-add FLOPs per sample (2 per weight) of the network."""
+    n_params = int(sum(np.size(W) + np.shape(W)[1] for W in weights))
+    flops = int(sum(2*np.size(W) for W in weights))
+    return n_params, flops
+
+
+def shrink_network(weights, biases, x, y, hsp_traces=None, activation='tanh',
+                   norm_tol=1e-2, hsp_tol=0.98, last_epochs=10):
+    """Find and remove the dead nodes of every hidden layer, and report the size, FLOPs
+    and accuracy (on x, y) of the network before and after.
+
+    :type hsp_traces: list of numpy.ndarray
+    :param hsp_traces: Hoyer's sparseness trace of each hidden layer (n_epochs x n_nodes), or None
+
+    Returns the pruned weights and biases, and the report.
+    """
+    dead_masks = []
+    for i in range(len(weights)-1):
+        hsp_trace = None if hsp_traces is None else hsp_traces[i]
+        dead_masks.append(find_dead_nodes(weights[i], weights[i+1], hsp_trace, norm_tol, hsp_tol, last_epochs))
+
+    new_weights, new_biases = prune_nodes(weights, biases, dead_masks, activation)
+
+    y = np.ravel(y)
+    report = {'dead_nodes': [int(np.sum(dead)) for dead in dead_masks], 'dead_masks': dead_masks}
+    report['exact'] = exact_masks(weights, dead_masks)
+    report['n_nodes'] = [np.shape(weights[0])[0]] + [np.shape(W)[1] for W in weights]
+    report['pruned_n_nodes'] = [np.shape(new_weights[0])[0]] + [np.shape(W)[1] for W in new_weights]
+    report['n_params'], report['flops'] = network_stats(weights)
+    report['pruned_n_params'], report['pruned_flops'] = network_stats(new_weights)
+    report['accuracy'] = np.mean(predict(weights, biases, x, activation) == y)
+    report['pruned_accuracy'] = np.mean(predict(new_weights, new_biases, x, activation) == y)
+
+    return new_weights, new_biases, report
+
+
+def print_report(report):
+    print('node pruning : %s -> %s nodes, %.2f -> %.2f M params, %.2f -> %.2f MFLOPs/sample, accuracy %.3f -> %.3f (%s)'
+          % ('-'.join(str(n) for n in report['n_nodes']), '-'.join(str(n) for n in report['pruned_n_nodes']),
+             report['n_params']/1e6, report['pruned_n_params']/1e6, report['flops']/1e6, report['pruned_flops']/1e6,
+             report['accuracy'], report['pruned_accuracy'],
+             'exact' if all(report['exact']) else 'approximate, nodes with nonzero incoming weights removed'))
@@ -0,0 +1,106 @@
+"""
+Schedule of the weight sparsity control.
+
+By default beta is recomputed after every minibatch. HspSchedule lets the trainers
+recompute it every k minibatches or once per epoch, and optionally run the Hoyer's
+sparseness computation in a background thread on a snapshot of the weights while
+the next minibatches train. The new beta is applied as soon as it is ready, and the
+number of minibatches it lagged behind the snapshot is recorded for the run log.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class HspSchedule(object):
+
+    def __init__(self, every=1, asynchronous=False):
+        """
+        :type every: int or str
+        :param every: recompute beta every k minibatches, or 'epoch' for once
+                      after the last minibatch of each epoch
+
+        :type asynchronous: bool
+        :param asynchronous: compute Hoyer's sparseness in a background thread
+        """
+        if every != 'epoch' and (int(every) != every or every < 1):
+            raise ValueError("every should be a positive number of minibatches or 'epoch', got %r" % (every,))
+
+        self.every = every
+        self.asynchronous = asynchronous
+
+        # the number of minibatches trained so far
+        self.step = 0
+
+        # background job and the step of its weight snapshot
+        self._executor = ThreadPoolExecutor(max_workers=1) if asynchronous else None
+        self._job = None
+        self._job_step = 0
+
+        # lag (in minibatches) of every applied beta since the last call of lag_summary
+        self._lags = []
+
+    def due(self, batch, n_batches):
+        """Count one trained minibatch and return True if beta should be recomputed now."""
+        self.step += 1
+
+        if self.every == 'epoch':
+            return batch == n_batches-1
+        return self.step % self.every == 0
+
+    def run(self, control, *args):
+        """Run the sparsity control on a snapshot of the weights.
+
+        Returns the result of control(*args) when it can be applied now, or None.
+        In the asynchronous mode the job is started in the background (unless the
+        previous one is still running, in which case this snapshot is skipped) and
+        the result of an earlier job is returned once it has finished.
+        """
+        if not self.asynchronous:
+            self._lags.append(0)
+            return control(*args)
+
+        result = self.poll()
+        if self._job is None:
+            self._job = self._executor.submit(control, *args)
+            self._job_step = self.step
+        return result
+
+    def poll(self):
+        """Return the result of a finished background job, or None."""
+        if self._job is None or not self._job.done():
+            return None
+        return self._collect()
+
+    def wait(self):
+        """Block until the background job has finished and return its result (or None)."""
+        if self._job is None:
+            return None
+        return self._collect()
+
+    def _collect(self):
+        result = self._job.result()
+        self._lags.append(self.step - self._job_step)
+        self._job = None
+        return result
+
+    def lag_summary(self):
+        """Return the mean and maximum lag of beta (in minibatches) since the last call."""
+        lags = self._lags
+        self._lags = []
+        if len(lags) == 0:
+            return 0.0, 0
+        return float(np.mean(lags)), int(np.max(lags))
+
+    def reset(self):
+        """Drop the background job and restart the count (e.g. when the weights are re-initialized)."""
+        if self._job is not None:
+            self._job.result()
+            self._job = None
+        self.step = 0
+        self._lags = []
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,87 @@
+"""
+Weight sparsity control of all hidden layers with Hoyer's sparseness.
+
+The beta of every node (node-wise control) or of every layer (layer-wise control)
+lives in one contiguous buffer, so it can be fed to the L1 penalty as it is, and
+each layer gets a view of its own part of the buffer. Hoyer's sparseness is
+computed layer by layer (the layers have different shapes), then the betas of all
+layers are updated and clipped in one vectorized step:
+
+    beta <- clip(beta - beta_lrate*sign(hsp - tg_hsp), 0, max_beta)
+"""
+
+import numpy as np
+
+from .hoyer import hoyer_sparseness
+
+
+class SparsityControl(object):
+
+    def __init__(self, n_nodes, tg_hsp, max_beta, beta_lrate, nodewise=True, dtype=np.float64):
+        """
+        :type n_nodes: list of int
+        :param n_nodes: number of nodes of each hidden layer
+
+        :type tg_hsp: list of float
+        :param tg_hsp: target Hoyer's sparseness of each hidden layer
+
+        :type max_beta: list of float
+        :param max_beta: maximum beta of each hidden layer
+
+        :type beta_lrate: float
+        :param beta_lrate: learning rate of beta
+
+        :type nodewise: bool
+        :param nodewise: one beta per node (True) or one beta per layer (False)
+
+        :type dtype: numpy.dtype
+        :param dtype: dtype of the betas and Hoyer's sparseness (the compute dtype of a PrecisionPolicy)
+        """
+        self.nodewise = nodewise
+        self.beta_lrate = beta_lrate
+
+        # number of betas of each layer and where they start in the buffer
+        self.sizes = [int(n) for n in n_nodes] if nodewise else [1]*len(n_nodes)
+        self.index = np.concatenate([[0], np.cumsum(self.sizes)]).astype(int)
+
+        self.dtype = np.dtype(dtype)
+        self.beta = np.zeros(self.index[-1], dtype=self.dtype)
+        self.hsp = np.zeros(self.index[-1], dtype=self.dtype)
+
+        # per-layer views of the buffers (a layer-wise beta is a view of length 1)
+        self.layer_beta = [self.beta[self.index[i]:self.index[i+1]] for i in range(len(self.sizes))]
+        self.layer_hsp = [self.hsp[self.index[i]:self.index[i+1]] for i in range(len(self.sizes))]
+
+        self.max_beta = np.repeat(np.asarray(max_beta, dtype=self.dtype), self.sizes)
+        self.set_target(tg_hsp)
+
+    def set_target(self, tg_hsp):
+        """Change the target Hoyer's sparseness of each hidden layer."""
+        self.tg_hsp = np.repeat(np.asarray(tg_hsp, dtype=self.dtype), self.sizes)
+
+    def hoyer(self, W_list):
+        """Return Hoyer's sparseness of every node (or layer) of the weights in W_list.
+
+        Only the weights are read, so this can run in a background thread on a
+        snapshot of the weights while the betas are being fed.
+        """
+        axis = 0 if self.nodewise else None
+        hsp = np.empty(self.index[-1], dtype=self.dtype)
+        for i in range(len(self.sizes)):
+            hsp[self.index[i]:self.index[i+1]] = hoyer_sparseness(W_list[i], axis=axis)
+        return hsp
+
+    def apply(self, hsp):
+        """Update the betas of all layers in place from Hoyer's sparseness."""
+        self.hsp[...] = hsp
+        self.beta -= self.beta_lrate*np.sign(self.hsp-self.tg_hsp)
+        np.clip(self.beta, 0.0, self.max_beta, out=self.beta)
+
+    def update(self, W_list):
+        """Compute Hoyer's sparseness of W_list and update the betas."""
+        self.apply(self.hoyer(W_list))
+
+    def reset(self):
+        """Set the betas (and Hoyer's sparseness) of all layers back to zero."""
+        self.beta[...] = 0.0
+        self.hsp[...] = 0.0
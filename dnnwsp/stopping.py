@@ -0,0 +1,139 @@
+"""
+Early stopping once the weight sparsity control has converged.
+
+The training loops run for n_epochs whatever happens. EarlyStopping watches,
+after every epoch:
+
+    the monitored value : the validation error or a cost (lower is better)
+    Hoyer's sparseness  : the mean of every hidden layer within hsp_tol of its
+                          target (tg_hspset)
+    beta                : steady, the mean beta of every hidden layer over the last
+                          window epochs within beta_tol of its mean over the window
+                          before (beta moves by beta_lrates at every update, so its
+                          value at the end of an epoch oscillates around its steady
+                          state and is not compared epoch by epoch)
+
+Before the sparsity has converged the network is still being made sparse, so the
+monitored value is not compared and training goes on. Once it has, the weights of
+the best monitored value are kept (a copy taken only when the value improves) and
+training stops when the value has not improved by more than min_delta for patience
+epochs. The caller restores best_params (None if the sparsity never converged, then
+the last weights are kept).
+
+    stopping = EarlyStopping(patience=20, tg_hsp=tg_hspset)
+    for epoch in range(n_epochs):
+        ...
+        if stopping.update(valid_err, sparsity.layer_hsp, sparsity.layer_beta, lambda: [W.get_value() for W in params]):
+            break
+"""
+
+import numpy as np
+
+
+class EarlyStopping(object):
+
+    def __init__(self, patience=20, min_delta=0.0, tg_hsp=None, hsp_tol=0.05, beta_tol=0.01, window=5, min_epochs=0):
+        """
+        :type patience: int
+        :param patience: number of epochs without improvement of the monitored value before stopping
+
+        :type min_delta: float
+        :param min_delta: smallest decrease of the monitored value counted as an improvement
+
+        :type tg_hsp: list of float
+        :param tg_hsp: target Hoyer's sparseness of every hidden layer, or None to compare the
+                       monitored value from the first epoch (no sparsity convergence)
+
+        :type hsp_tol: float
+        :param hsp_tol: largest distance of the mean Hoyer's sparseness of a layer to its target
+
+        :type beta_tol: float
+        :param beta_tol: largest change of the mean beta of a layer between two windows of epochs,
+                         or None to ignore beta (also ignored when update is not given beta)
+
+        :type window: int
+        :param window: number of epochs of a window of beta
+
+        :type min_epochs: int
+        :param min_epochs: number of epochs trained before stopping is considered
+        """
+        if int(patience) < 1:
+            raise ValueError('patience should be a positive number of epochs, got %r' % (patience,))
+        if int(window) < 1:
+            raise ValueError('window should be a positive number of epochs, got %r' % (window,))
+        self.patience = int(patience)
+        self.min_delta = min_delta
+        self.tg_hsp = None if tg_hsp is None else [float(tg) for tg in tg_hsp]
+        self.hsp_tol = hsp_tol
+        self.beta_tol = beta_tol
+        self.window = int(window)
+        self.min_epochs = int(min_epochs)
+        self.reset()
+
+    def reset(self, tg_hsp=None):
+        """Start a new fit (with the target Hoyer's sparseness tg_hsp, if it changes)."""
+        if tg_hsp is not None:
+            self.tg_hsp = [float(tg) for tg in tg_hsp]
+        self.epoch = 0
+        self.best_value = np.inf
+        self.best_epoch = 0
+        self.best_params = None
+        self.converged_epoch = 0
+        self.stop_reason = None
+        self._beta_means = []
+
+    def sparsity_converged(self, hsp=None, beta=None):
+        """Whether Hoyer's sparseness is at its target and beta is steady (given this epoch's values)."""
+        if self.tg_hsp is None:
+            return True
+        if hsp is None or any(abs(np.mean(h) - tg) > self.hsp_tol for h, tg in zip(hsp, self.tg_hsp)):
+            return False
+        if self.beta_tol is None or beta is None:
+            return True
+        if len(self._beta_means) < 2*self.window:
+            return False
+        means = np.asarray(self._beta_means[-2*self.window:])
+        return bool(np.all(np.abs(means[self.window:].mean(axis=0) - means[:self.window].mean(axis=0)) <= self.beta_tol))
+
+    def update(self, value, hsp=None, beta=None, params=None):
+        """Record the epoch, returns True when training should stop.
+
+        :type value: float
+        :param value: the monitored value of this epoch (e.g. the validation error)
+
+        :type hsp: list of numpy.ndarray
+        :param hsp: Hoyer's sparseness of every hidden layer (e.g. SparsityControl.layer_hsp)
+
+        :type beta: list of numpy.ndarray
+        :param beta: beta of every hidden layer (e.g. SparsityControl.layer_beta)
+
+        :type params: callable
+        :param params: returns the weights to keep (copied) when the value improves
+        """
+        self.epoch += 1
+        if beta is not None:
+            self._beta_means.append([np.mean(b) for b in beta])
+
+        if self.converged_epoch == 0:
+            if not self.sparsity_converged(hsp, beta):
+                return False
+            self.converged_epoch = self.epoch
+
+        if value < self.best_value - self.min_delta:
+            self.best_value = float(value)
+            self.best_epoch = self.epoch
+            if params is not None:
+                self.best_params = [np.array(p, copy=True) for p in params()]
+
+        if self.epoch >= self.min_epochs and self.epoch - self.best_epoch >= self.patience:
+            self.stop_reason = 'no improvement for %d epochs' % (self.epoch - self.best_epoch)
+            return True
+        return False
+
+    def summary(self):
+        """One line with the epoch of convergence of the sparsity, the best epoch and why training stopped."""
+        if self.converged_epoch == 0:
+            return 'early stopping : the sparsity did not converge in %d epochs, the last weights are kept' % self.epoch
+        return 'early stopping : sparsity converged at epoch %d, best value %.4f at epoch %d, %s' % (
+            self.converged_epoch, self.best_value, self.best_epoch,
+            'stopped at epoch %d (%s)' % (self.epoch, self.stop_reason) if self.stop_reason else 'trained %d epochs' % self.epoch)
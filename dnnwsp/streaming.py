@@ -0,0 +1,198 @@
+"""
+Out-of-core training on datasets larger than memory.
+
+A shard directory holds the training samples in shards of a fixed number of
+samples, one float32 .npy file of samples (x_00000.npy, ...) and one .npy file of
+integer labels (y_00000.npy, ...) per shard, and a shards.json file with the
+number of samples of every shard. The shards are written one subject at a time,
+so the whole cohort is never in memory.
+
+ShardStream iterates over the minibatches of one epoch with a chunked shuffle:
+the order of the shards is shuffled, and the samples of consecutive shards are
+shuffled together in a buffer of at least buffer_size samples (the samples that
+do not fill a whole minibatch are carried over to the next buffer). The next
+shards are read from disk in a background thread while the current minibatches
+train, so at most the buffer and `prefetch` shards are in memory.
+
+Write a shard directory from per-subject .mat files (from the root of the repository):
+    python -m dnnwsp.streaming sensorimotor_shards x_sbj1.mat:y_sensorimotor_sbj1.mat x_sbj2.mat:y_sensorimotor_sbj2.mat \\
+        --mask KHBM2019/Sensorimotor_classification/vMsk_3d.mat
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.io as sio
+
+from .masking import _mat_array, apply_mask, load_mask, mask_index
+from .prepare import one_hot
+
+SHARD_FILE = 'shards.json'
+
+
+def write_shards(out_dir, subjects, shard_size=1000, dtype=np.float32):
+    """Write the samples of every subject into a shard directory.
+
+    :type subjects: iterable of (numpy.ndarray, numpy.ndarray)
+    :param subjects: samples (n_samples x n_features) and labels of each subject,
+                     e.g. a generator that loads one subject at a time
+
+    :type shard_size: int
+    :param shard_size: number of samples of a shard (the last one may be smaller)
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    meta = {'created': time.ctime(), 'n_samples': 0, 'n_features': None, 'shards': []}
+    pending_x = []
+    pending_y = []
+    n_pending = 0
+
+    for x, y in subjects:
+        y = np.ravel(y)
+        if np.shape(x)[0] != np.size(y):
+            raise ValueError('%d samples but %d labels' % (np.shape(x)[0], np.size(y)))
+        if meta['n_features'] is None:
+            meta['n_features'] = int(np.shape(x)[1])
+        elif np.shape(x)[1] != meta['n_features']:
+            raise ValueError('%d features, the previous subjects have %d' % (np.shape(x)[1], meta['n_features']))
+
+        pending_x.append(np.asarray(x, dtype=dtype))
+        pending_y.append(y)
+        n_pending += np.size(y)
+        if n_pending >= shard_size:
+            pending_x, pending_y, n_pending = _save_shards(out_dir, meta, pending_x, pending_y, shard_size, dtype)
+    if n_pending > 0:
+        _save_shards(out_dir, meta, pending_x, pending_y, shard_size, dtype, last=True)
+
+    with open(os.path.join(out_dir, SHARD_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def _save_shards(out_dir, meta, pending_x, pending_y, shard_size, dtype, last=False):
+    # save the whole shards of the pending samples (and the rest if last), return the rest
+    x = np.concatenate(pending_x)
+    y = np.concatenate(pending_y)
+    n_saved = np.size(y) if last else np.size(y)//shard_size*shard_size
+    for start in range(0, n_saved, shard_size):
+        name = '%05d' % len(meta['shards'])
+        np.save(os.path.join(out_dir, 'x_'+name+'.npy'), np.ascontiguousarray(x[start:start+shard_size], dtype=dtype))
+        np.save(os.path.join(out_dir, 'y_'+name+'.npy'), y[start:start+shard_size])
+        meta['shards'].append({'x': 'x_'+name+'.npy', 'y': 'y_'+name+'.npy', 'n_samples': int(np.size(y[start:start+shard_size]))})
+        meta['n_samples'] += meta['shards'][-1]['n_samples']
+    return [x[n_saved:]], [y[n_saved:]], np.size(y)-n_saved
+
+
+class ShardStream(object):
+
+    def __init__(self, path, batch_size, buffer_size=2000, n_classes=None, prefetch=2, rng=np.random):
+        """
+        :type path: str
+        :param path: shard directory written by write_shards
+
+        :type batch_size: int
+        :param batch_size: number of samples of a minibatch
+
+        :type buffer_size: int
+        :param buffer_size: minimum number of samples shuffled together
+
+        :type n_classes: int
+        :param n_classes: one-hot (float32) labels with n_classes columns, or None for the integer labels
+
+        :type prefetch: int
+        :param prefetch: number of shards read ahead in the background
+        """
+        with open(os.path.join(path, SHARD_FILE)) as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.shards = meta['shards']
+        self.n_samples = meta['n_samples']
+        self.n_features = meta['n_features']
+        self.batch_size = int(batch_size)
+        self.buffer_size = max(int(buffer_size), self.batch_size)
+        self.n_classes = n_classes
+        self.prefetch = max(int(prefetch), 1)
+        self.rng = rng
+
+        # the samples that do not fill a whole minibatch at the end of an epoch are dropped
+        self.n_batches = self.n_samples//self.batch_size
+
+    def _read(self, i):
+        shard = self.shards[i]
+        x = np.load(os.path.join(self.path, shard['x']))
+        y = np.load(os.path.join(self.path, shard['y']))
+        return x, y
+
+    def __iter__(self):
+        """Yield the (samples, labels) minibatches of one epoch."""
+        order = self.rng.permutation(len(self.shards))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            jobs = [executor.submit(self._read, i) for i in order[:self.prefetch]]
+            pending_x = []
+            pending_y = []
+            n_pending = 0
+
+            for k in range(len(order)):
+                x, y = jobs.pop(0).result()
+                if k+self.prefetch < len(order):
+                    jobs.append(executor.submit(self._read, order[k+self.prefetch]))
+
+                pending_x.append(x)
+                pending_y.append(y)
+                n_pending += np.size(y)
+                if n_pending < self.buffer_size and k < len(order)-1:
+                    continue
+
+                # shuffle the buffer and cut it into minibatches
+                x = np.concatenate(pending_x)
+                y = np.concatenate(pending_y)
+                perm = self.rng.permutation(n_pending)
+                n_full = n_pending//self.batch_size
+                for b in range(n_full):
+                    ids = np.sort(perm[b*self.batch_size:(b+1)*self.batch_size])
+                    yield self._batch(x[ids], y[ids])
+
+                rest = perm[n_full*self.batch_size:]
+                pending_x = [x[rest]]
+                pending_y = [y[rest]]
+                n_pending = np.size(rest)
+
+    def _batch(self, x, y):
+        if self.n_classes is None:
+            return x, y
+        return x, one_hot(y, self.n_classes)
+
+
+def load_subject(x_file, y_file, mask=None):
+    """Load the samples and labels of one subject from two .mat files.
+
+    Volumes (X x Y x Z x n_samples) are vectorized with the mask (X x Y x Z) into
+    n_samples x n_voxels (see dnnwsp.masking); 2D samples are used as they are (n_samples x n_features).
+    """
+    x = _mat_array(x_file)
+    if x.ndim == 4:
+        if mask is None:
+            raise ValueError('%s holds volumes, a mask is needed' % x_file)
+        x = apply_mask(x, mask_index(mask))
+    return x, np.ravel(_mat_array(y_file))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write per-subject .mat files into a shard directory.')
+    parser.add_argument('out_dir', help='output shard directory')
+    parser.add_argument('subjects', nargs='+', help='<samples.mat>:<labels.mat> of each subject')
+    parser.add_argument('--mask', help='.mat file of the brain mask of the volumes')
+    parser.add_argument('--shard-size', type=int, default=1000, help='number of samples of a shard')
+    args = parser.parse_args()
+
+    mask = load_mask(args.mask) if args.mask else None
+    subjects = (load_subject(*pair.split(':'), mask=mask) for pair in args.subjects)
+    meta = write_shards(args.out_dir, subjects, args.shard_size)
+    print('%d samples x %d features in %d shards' % (meta['n_samples'], meta['n_features'], len(meta['shards'])))
@@ -20,7 +20,6 @@ import timeit  # To calculate computational time
 
 import numpy # NumPy is the fundamental package for scientific computing with Python.
 import numpy as np  # Simplification
-from numpy import linalg as LA 
 
 import scipy.io as sio # The module for file input and output
 import scipy.stats # This module contains a large number of probability distributions as well as a growing library of statistical functions.
@@ -29,6 +28,16 @@ import theano # Theano is the fundamental package for scientific computing with
 import theano.tensor as T
 from theano.tensor.shared_randomstreams import RandomStreams
 
+# To import the shared dnnwsp modules from the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from dnnwsp.sparsity import SparsityControl # Node-wise control of weight sparsity of all hidden layers with one beta buffer
+from dnnwsp.schedule import HspSchedule # How often (and in which thread) the weight sparsity control runs
+from dnnwsp.dataset import load_dataset # Memory-mapped datasets (a directory made by python -m dnnwsp.dataset) or .mat files
+from dnnwsp.cache import PreprocessCache # Cache of the preprocessed inputs, keyed by the content of the data file
+from dnnwsp.epoch_scan import scan_epoch as compile_scan_epoch # All minibatches of an epoch in one theano.scan call
+from dnnwsp.precision import PrecisionPolicy # Storage and compute dtypes with a dtype audit
+from dnnwsp.projection import InputProjection, project_datasets # PCA, randomized SVD or sparse random projection of the voxels
+
 
 rng = numpy.random.RandomState(123)
 theano_rng = RandomStreams(rng.randint(2 ** 30))
@@ -36,32 +45,18 @@ theano_rng = RandomStreams(rng.randint(2 ** 30))
 ########################################## Function definition #################################################
 # Define the node-wise control of weight sparsity via Hoyer sparseness (Hoyer, 2014, Kim and Lee PRNI2016, Kim and Lee ICASSP 2017)
 
-def hsp_fnc_inv_mat_cal(val_L1_ly, W, thre, tg, lrate):
-    W = np.array(W.get_value(borrow=True));
-    
-    [dim, nodes] = W.shape
-    
-    cnt_L1_ly = val_L1_ly;
+# Define the node-wise control as Theano updates (the same rule as dnnwsp.sparsity), so that it runs inside the compiled training function
+# val_L1_ly and hsp_ly are shared vectors and W is the expression of the weight after the optimizer step
+def hsp_updates_inv_mat_cal(val_L1_ly, hsp_ly, W, dim, thre, tg, lrate):
     
-    hsp_vec = np.zeros((1,nodes));  
-    
-    tg_vec = np.ones(nodes)*tg;
     sqrt_nsamps = pow(dim,0.5)
-        
-    n1_W = LA.norm(W,1,axis=0);    n2_W = LA.norm(W,2,axis=0);
+    
+    n1_W = abs(W).sum(axis=0);    n2_W = T.sqrt((W ** 2).sum(axis=0));
     hsp_vec = (sqrt_nsamps - (n1_W/n2_W))/(sqrt_nsamps-1)
     
-    cnt_L1_ly -= lrate*np.sign(hsp_vec-tg_vec)
-        
-    for ii in range(0,nodes):
-        if cnt_L1_ly[ii] < 0:
-            cnt_L1_ly[ii] = 0
-        if cnt_L1_ly[ii] > thre:
-            cnt_L1_ly[ii] = thre
-        
-    hspset =[hsp_vec, cnt_L1_ly]
-
-    return hspset
+    cnt_L1_ly = T.clip(val_L1_ly - lrate*T.sgn(hsp_vec-tg), 0, thre)
+    
+    return [(hsp_ly, T.cast(hsp_vec, hsp_ly.dtype)), (val_L1_ly, T.cast(cnt_L1_ly, val_L1_ly.dtype))]
    
 def get_corrupted_input(input,corruption_level):
         """This function keeps ``1-corruption_level`` entries of the inputs the
@@ -245,10 +240,31 @@ def test_mlp():
     max_beta = [0.03,0.5,0.5];  # Maximum beta changes
     beta_lrates = 1e-2;
     
+    # 1: update beta inside the compiled training function, 0: copy the weights and update beta in NumPy after each minibatch
+    hsp_in_graph = 1;
+    # recompute beta every k minibatches (1: after every minibatch) or 'epoch' (once per epoch)
+    hsp_every = 1;
+    # 1: compute Hoyer's sparseness in a background thread on a copy of the weights while the next minibatches train (needs hsp_in_graph = 0)
+    hsp_async = 0;
+    # 1: cache the z-scored samples and scaled responses on local disk (~/.cache/dnnwsp) and memory-map them in the next runs
+    preprocess_cache = 0;
+    # 1: train all minibatches of an epoch in one call of a theano.scan function (needs hsp_in_graph = 1)
+    scan_epoch = 0;
+    # None: theano.config.floatX everywhere, 'float32', or 'float16' (z-scored samples stored in float16, every minibatch upcast
+    # to float32, needs floatX = float32); the run fails if anything is silently upcast (dtype audit of the graph and of beta)
+    precision = None;
+    # None, or 'pca', 'randomized_svd' or 'sparse_random': train on projection_components features of the z-scored voxels,
+    # fitted on train_x only (dnnwsp.projection, cached with preprocess_cache); n_in becomes projection_components and the
+    # first layer is also saved on the voxels (w1_voxel, b1_voxel); 'pca' keeps at most the 64 training samples
+    projection = None;
+    projection_components = 60;
+    
     rng = np.random.RandomState(8000)
 
     ########################################## Input data  #################################################
-    sbjinfo = sio.loadmat('%s/emt_valence_sample.mat' % rootpath)
+    # a dataset directory converted from the .mat file (python -m dnnwsp.dataset emt_valence_sample.mat emt_valence_sample)
+    # is memory-mapped in float32 instead of being read into RAM in float64
+    data_file = '%s/emt_valence_sample.mat' % rootpath
     
     ############# emt_sample_data.mat #############
     # train_x  = 64 volumes x 55417 voxels  
@@ -258,17 +274,36 @@ def test_mlp():
     ############################################################
     
     start_time = timeit.default_timer()
-        
-    train_x = sbjinfo['train_x']; 
-    train_y = np.asarray(sbjinfo['train_y'],'float32').flatten() / scal_ref ;
     
-    test_x = sbjinfo['test_x'];
-    test_y =  np.asarray(sbjinfo['test_y'],'float32').flatten() / scal_ref ;
+    precision_policy = PrecisionPolicy(precision if precision is not None else theano.config.floatX)
+    if precision_policy.compute_dtype != theano.config.floatX:
+        raise ValueError('precision = %r computes in %s, run Theano with floatX = %s' % (precision, precision_policy.compute_dtype, precision_policy.compute_dtype))
+    
+    # z-score every volume (once, in the precision of the loaded data) and scale the emotion responses,
+    # the samples are kept in the storage dtype of the precision policy
+    def preprocess():
+        sbjinfo = load_dataset(data_file)
+        return {'train_x': precision_policy.store(scipy.stats.zscore(sbjinfo['train_x'],axis=1,ddof=1)),
+                'train_y': np.asarray(sbjinfo['train_y'],'float32').flatten() / scal_ref,
+                'test_x': precision_policy.store(scipy.stats.zscore(sbjinfo['test_x'],axis=1,ddof=1)),
+                'test_y': np.asarray(sbjinfo['test_y'],'float32').flatten() / scal_ref}
     
-    n_train_set_x = scipy.stats.zscore(train_x,axis=1,ddof=1)
-    n_test_set_x = scipy.stats.zscore(test_x,axis=1,ddof=1)
+    if preprocess_cache == 1:
+        sbjinfo = PreprocessCache().load(data_file, {'zscore':'axis=1,ddof=1', 'scal_ref':scal_ref, 'dtype':precision_policy.storage_dtype.name}, preprocess)
+    else:
+        sbjinfo = preprocess()
     
-    n_trvld_batches = int(train_x.shape[0] / batch_size)
+    # project the z-scored voxels, fitted on train_x only
+    if projection is not None:
+        [sbjinfo, input_projection] = project_datasets(sbjinfo, InputProjection(projection, projection_components), dtype=precision_policy.storage_dtype,
+                                                       cache=PreprocessCache() if preprocess_cache == 1 else None, sources=data_file,
+                                                       params={'zscore':'axis=1,ddof=1', 'scal_ref':scal_ref})
+        n_in = projection_components
+        
+    n_train_set_x = sbjinfo['train_x'];    train_y = sbjinfo['train_y'];
+    n_test_set_x = sbjinfo['test_x'];    test_y = sbjinfo['test_y'];
+    
+    n_trvld_batches = int(n_train_set_x.shape[0] / batch_size)
     n_test_batches = int(n_test_set_x.shape[0] / batch_size)
     
     ########################################## Build model #################################################
@@ -296,10 +331,13 @@ def test_mlp():
     list_tr_err = np.zeros((n_epochs,1));    list_ts_err = np.zeros((n_epochs,1)) 
     lrate_list =np.zeros((n_epochs,1));
 
-    train_set_x = theano.shared(np.asarray(n_train_set_x, dtype=theano.config.floatX))
+    # borrow the z-scored arrays (no second copy of the data)
+    train_set_x = theano.shared(precision_policy.store(n_train_set_x), borrow=True)
     train_set_y = T.cast(theano.shared(train_y,borrow=True),'float32')
 
-    test_set_x = theano.shared(np.asarray(n_test_set_x, dtype=theano.config.floatX)); 
+    test_set_x = theano.shared(precision_policy.store(n_test_set_x), borrow=True); 
+    if precision_policy.name != 'float32':
+        print(precision_policy.describe(train_x=train_set_x.get_value(borrow=True), test_x=test_set_x.get_value(borrow=True)))
     test_set_y = T.cast(theano.shared(test_y,borrow=True),'float32')
     
     lrate_val = itlrate
@@ -319,6 +357,15 @@ def test_mlp():
         )
             
     # cost function
+    # beta of each hidden layer as shared variables updated by the compiled training function
+    if hsp_in_graph == 1:
+        L1p_ly1 = theano.shared(np.zeros(n_hidden1, dtype=theano.config.floatX), name='L1p_ly1')
+        L1p_ly2 = theano.shared(np.zeros(n_hidden2, dtype=theano.config.floatX), name='L1p_ly2')
+        L1p_ly3 = theano.shared(np.zeros(n_hidden3, dtype=theano.config.floatX), name='L1p_ly3')
+        hsp_ly1 = theano.shared(np.zeros(n_hidden1, dtype=theano.config.floatX), name='hsp_ly1')
+        hsp_ly2 = theano.shared(np.zeros(n_hidden2, dtype=theano.config.floatX), name='hsp_ly2')
+        hsp_ly3 = theano.shared(np.zeros(n_hidden3, dtype=theano.config.floatX), name='hsp_ly3')
+            
     cost = ((classifier.linearRegressionLayer.y_pred-y)**2).sum()
     cost += (T.dot(abs(classifier.hiddenLayer1.W),L1p_ly1)).sum(); 
     cost += (T.dot(abs(classifier.hiddenLayer2.W),L1p_ly2)).sum();
@@ -337,14 +384,34 @@ def test_mlp():
         delta = lrate * gparam + momentum * oldparam
         updates.append((param, param - delta))
         updates.append((oldparam, delta))
+        
+    if hsp_async == 1 and hsp_in_graph == 1:
+        raise ValueError('the asynchronous sparsity control needs hsp_in_graph = 0')
+    if scan_epoch == 1 and hsp_in_graph == 0:
+        raise ValueError('scan_epoch = 1 needs hsp_in_graph = 1')
+        
+    # the samples in the storage dtype, the cost and every updated variable (weights, momentum) in the compute dtype
+    precision_policy.audit('graph', {'train_x':train_set_x, 'test_x':test_set_x}, cost=cost,
+                           **dict(('update %d (%s)' % (k, var.name), new) for k, (var, new) in enumerate(updates)))
+        
+    # Node-wise control of weight sparsity on the updated weights, in the same call
+    opt_updates = list(updates)
+    if hsp_in_graph == 1:
+        new_params = dict(updates)
+        updates.extend(hsp_updates_inv_mat_cal(L1p_ly1, hsp_ly1, new_params[classifier.hiddenLayer1.W], n_in, max_beta_ly1, op_tg_L1_ly1, beta_lrates))
+        updates.extend(hsp_updates_inv_mat_cal(L1p_ly2, hsp_ly2, new_params[classifier.hiddenLayer2.W], n_hidden1, max_beta_ly2, op_tg_L1_ly2, beta_lrates))
+        updates.extend(hsp_updates_inv_mat_cal(L1p_ly3, hsp_ly3, new_params[classifier.hiddenLayer3.W], n_hidden2, max_beta_ly3, op_tg_L1_ly3, beta_lrates))
+        trvld_inputs = [index, L2p_ly, lrate]
+    else:
+        trvld_inputs = [index, L1p_ly1, L1p_ly2, L1p_ly3, L2p_ly, lrate]
                        
     trvld_model = theano.function(
-        inputs=[index, L1p_ly1, L1p_ly2, L1p_ly3, L2p_ly, lrate],
+        inputs=trvld_inputs,
 
         outputs=[classifier.errors(y), classifier.linearRegressionLayer.y_pred],
         updates=updates,
         givens={
-            x: train_set_x[index * batch_size: (index + 1) * batch_size],
+            x: T.cast(train_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
             y: train_set_y[index * batch_size: (index + 1) * batch_size],
             is_train: np.cast['int32'](1)
 
@@ -353,11 +420,40 @@ def test_mlp():
         on_unused_input = 'ignore',
     )
 
+    # The same step without the weight sparsity control, for the minibatches between two updates of beta
+    if hsp_in_graph == 1 and hsp_every != 1:
+        trvld_model_nohsp = theano.function(
+            inputs=trvld_inputs,
+            outputs=[classifier.errors(y), classifier.linearRegressionLayer.y_pred],
+            updates=opt_updates,
+            givens={
+                x: T.cast(train_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
+                y: train_set_y[index * batch_size: (index + 1) * batch_size],
+                is_train: np.cast['int32'](1)
+            },
+            allow_input_downcast = True,
+            on_unused_input = 'ignore',
+        )
+        
+    # All minibatches of the epoch in one call, returns the error and the predictions of every minibatch
+    if scan_epoch == 1:
+        trvld_epoch = compile_scan_epoch(
+            inputs=[L2p_ly, lrate],
+            outputs=[classifier.errors(y), classifier.linearRegressionLayer.y_pred],
+            updates=opt_updates,
+            x=x, y=y, data_x=train_set_x, data_y=train_set_y,
+            batch_size=batch_size, n_batches=n_trvld_batches,
+            every_updates=updates[len(opt_updates):], every=hsp_every,
+            givens={is_train: np.cast['int32'](1)},
+            allow_input_downcast = True,
+            on_unused_input = 'ignore',
+        )
+
     test_model = theano.function(
         inputs=[index],
         outputs=[classifier.errors(y), classifier.linearRegressionLayer.y_pred],
         givens={
-                x: test_set_x[index * batch_size:(index + 1) * batch_size],
+                x: T.cast(test_set_x[index * batch_size: (index + 1) * batch_size], x.dtype),
                 y: test_set_y[index * batch_size:(index + 1) * batch_size],
                 is_train: np.cast['int32'](0)
             },
@@ -374,6 +470,11 @@ def test_mlp():
     hsp_val_ly1 = np.zeros((n_epochs+1,n_hidden1));    hsp_val_ly2 = np.zeros((n_epochs+1,n_hidden2));   hsp_val_ly3 = np.zeros((n_epochs+1,n_hidden3));
     L1_val_ly1 = np.zeros((n_epochs+1,n_hidden1));    L1_val_ly2 = np.zeros((n_epochs+1,n_hidden2));    L1_val_ly3 = np.zeros((n_epochs+1,n_hidden3));
     
+    # current beta and Hoyer's sparseness of the three hidden layers for the NumPy control (layer_beta[i] is a view of
+    # the beta buffer of the i-th hidden layer), and when to recompute them
+    sparsity = SparsityControl([n_hidden1, n_hidden2, n_hidden3], hsp_level, max_beta, beta_lrates, dtype=precision_policy.compute_dtype)
+    hsp_schedule = HspSchedule(hsp_every, hsp_async == 1);    list_beta_lag = np.zeros((n_epochs,1));
+    
     ########################################## Learning model #################################################
    
     print ('... Training & Test')
@@ -385,17 +486,54 @@ def test_mlp():
         trvld_score = np.zeros((n_trvld_batches,1));
         tmp_trvld_pct =0;
         
-        for minibatch_index in range(n_trvld_batches):
-            tmp_mat_ly1 = (L1_val_ly1[epoch-1,:]);            tmp_mat_ly2 = (L1_val_ly2[epoch-1,:]);            tmp_mat_ly3 = (L1_val_ly3[epoch-1,:]);
-            trvld_out = trvld_model(minibatch_index,tmp_mat_ly1,tmp_mat_ly2,tmp_mat_ly3,val_L2,lrate_val)
-            if minibatch_index ==0:
-                tmp_trvld_pct = trvld_out[1]
-            else:
-                tmp_trvld_pct = np.concatenate((tmp_trvld_pct,trvld_out[1]),axis=0)
+        # the whole epoch in one call of the scan function (the predictions of the minibatches in their order)
+        if scan_epoch == 1:
+            trvld_out = trvld_epoch(val_L2,lrate_val,(epoch-1)*n_trvld_batches)
+            tmp_trvld_pct = np.reshape(trvld_out[1],-1)
+            minibatch_index = n_trvld_batches-1
+        else:
+            # minibatch based training
+            for minibatch_index in range(n_trvld_batches):
+                if hsp_in_graph == 1:
+                    # the weight sparsity control is part of trvld_model
+                    if hsp_schedule.due(minibatch_index, n_trvld_batches):
+                        trvld_out = trvld_model(minibatch_index,val_L2,lrate_val)
+                    else:
+                        trvld_out = trvld_model_nohsp(minibatch_index,val_L2,lrate_val)
+                else:
+                    trvld_out = trvld_model(minibatch_index,sparsity.layer_beta[0],sparsity.layer_beta[1],sparsity.layer_beta[2],val_L2,lrate_val)
+                
+                    # node-wise control of weight sparsity (the asynchronous mode needs a copy of the weights)
+                    if hsp_schedule.due(minibatch_index, n_trvld_batches):
+                        W_list = [layer.W.get_value(borrow=(hsp_async == 0)) for layer in [classifier.hiddenLayer1, classifier.hiddenLayer2, classifier.hiddenLayer3]]
+                        hsp_result = hsp_schedule.run(sparsity.hoyer, W_list)
+                    else:
+                        hsp_result = hsp_schedule.poll()
+                    
+                    # update beta of the three hidden layers at once
+                    if hsp_result is not None:
+                        sparsity.apply(hsp_result)
+                
+                if minibatch_index ==0:
+                    tmp_trvld_pct = trvld_out[1]
+                else:
+                    tmp_trvld_pct = np.concatenate((tmp_trvld_pct,trvld_out[1]),axis=0)
+            
+        # Read beta and Hoyer's sparseness of the last minibatch from the shared variables
+        if hsp_in_graph == 1:
+            hsp_val_ly1[epoch,:] = hsp_ly1.get_value(borrow=True);    L1_val_ly1[epoch,:] = L1p_ly1.get_value(borrow=True);
+            hsp_val_ly2[epoch,:] = hsp_ly2.get_value(borrow=True);    L1_val_ly2[epoch,:] = L1p_ly2.get_value(borrow=True);
+            hsp_val_ly3[epoch,:] = hsp_ly3.get_value(borrow=True);    L1_val_ly3[epoch,:] = L1p_ly3.get_value(borrow=True);
+        else:
+            hsp_val_ly1[epoch,:] = sparsity.layer_hsp[0];    L1_val_ly1[epoch,:] = sparsity.layer_beta[0];
+            hsp_val_ly2[epoch,:] = sparsity.layer_hsp[1];    L1_val_ly2[epoch,:] = sparsity.layer_beta[1];
+            hsp_val_ly3[epoch,:] = sparsity.layer_hsp[2];    L1_val_ly3[epoch,:] = sparsity.layer_beta[2];
+            
+        # the run fails if beta or Hoyer's sparseness were upcast during the epoch
+        precision_policy.audit('epoch %d' % epoch, beta=sparsity.beta, hsp=sparsity.hsp)
             
-            [hsp_val_ly1[epoch,:], L1_val_ly1[epoch,:]] = hsp_fnc_inv_mat_cal(L1_val_ly1[epoch-1,:],classifier.hiddenLayer1.W,max_beta_ly1,op_tg_L1_ly1,beta_lrates)
-            [hsp_val_ly2[epoch,:], L1_val_ly2[epoch,:]] = hsp_fnc_inv_mat_cal(L1_val_ly2[epoch-1,:],classifier.hiddenLayer2.W,max_beta_ly2,op_tg_L1_ly2,beta_lrates)
-            [hsp_val_ly3[epoch,:], L1_val_ly3[epoch,:]] = hsp_fnc_inv_mat_cal(L1_val_ly3[epoch-1,:],classifier.hiddenLayer3.W,max_beta_ly3,op_tg_L1_ly3,beta_lrates)
+        # mean lag of the applied beta (in minibatches)
+        [list_beta_lag[epoch-1], lag_max] = hsp_schedule.lag_summary()
             
         trvld_score=0;
         trvld_score = (np.mean(abs(tmp_trvld_pct-train_y[numpy.arange(0,len(tmp_trvld_pct))])))
@@ -425,9 +563,13 @@ def test_mlp():
                % (np.mean(hsp_val_ly1[epoch-1,:]),op_tg_L1_ly1,np.mean(L1_val_ly1[epoch-1,:]),
                   np.mean(hsp_val_ly2[epoch-1,:]),op_tg_L1_ly2,np.mean(L1_val_ly2[epoch-1,:]),
                   np.mean(hsp_val_ly3[epoch-1,:]),op_tg_L1_ly3,np.mean(L1_val_ly3[epoch-1,:])))           
+        if hsp_async == 1:
+            print ("beta lag = %.1f/%d minibatches" % (list_beta_lag[epoch-1], lag_max))
         
         list_ts_err[epoch-1] = test_score * scal_ref
         
+    hsp_schedule.close()
+    
     ########################################## Save variables #################################################
     
     if not os.path.exists(save_path):
@@ -436,6 +578,13 @@ def test_mlp():
     end_time = timeit.default_timer()
     cst_time = (end_time - start_time) / 60.
         
+    # the first layer on the voxels
+    if projection is not None:
+        w1_voxel = input_projection.voxel_weights(classifier.hiddenLayer1.W.get_value(borrow=True))
+        b1_voxel = input_projection.voxel_bias(classifier.hiddenLayer1.W.get_value(borrow=True), classifier.hiddenLayer1.b.get_value(borrow=True))
+    else:
+        w1_voxel = [];    b1_voxel = [];
+        
     sio.savemat(save_name, {'w1': classifier.hiddenLayer1.W.get_value(borrow=True),'b1': classifier.hiddenLayer1.b.get_value(borrow=True),
                        'w2': classifier.hiddenLayer2.W.get_value(borrow=True),'b2': classifier.hiddenLayer2.b.get_value(borrow=True),
                        'w3': classifier.hiddenLayer3.W.get_value(borrow=True),'b3': classifier.hiddenLayer3.b.get_value(borrow=True),
@@ -443,7 +592,10 @@ def test_mlp():
                        'pct_trvld':pct_trvld,'pct_tst':pct_tst,'trvld_err':list_trvld_err,'ts_err':list_ts_err,'L2_val':val_L2,
                        'l1ly1':L1_val_ly1,'l1ly2':L1_val_ly2,'l1ly3':L1_val_ly3,'hsply1':hsp_val_ly1,'hsply2':hsp_val_ly2,'hsply3':hsp_val_ly3,
                        'l_rate':lrate_list,'cst_time':cst_time,'epch':epoch,'max_beta':max_beta,'beta_lrates':beta_lrates,
-                        'test_y':test_y,'train_y':train_y,'mtum':momentum,'btch_size':batch_size,'opt_hsp':hsp_level,'cp_lev':corruption_level})
+                        'test_y':test_y,'train_y':train_y,'mtum':momentum,'btch_size':batch_size,'opt_hsp':hsp_level,'cp_lev':corruption_level,
+                        'hsp_every':hsp_every,'hsp_async':hsp_async,'beta_lag':list_beta_lag,'scan_epoch':scan_epoch,
+                        'precision':precision_policy.name,'projection':str(projection),'projection_components':projection_components,
+                        'w1_voxel':w1_voxel,'b1_voxel':b1_voxel})
     print ('...done!')
 
 if __name__ == '__main__':
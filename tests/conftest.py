@@ -0,0 +1,5 @@
+# To import the shared dnnwsp modules from the root of the repository (as the scripts do)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
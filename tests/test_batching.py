@@ -0,0 +1,47 @@
+import numpy as np
+
+from dnnwsp.batching import BatchGatherer
+
+
+def test_every_epoch_covers_the_samples_once():
+    x = np.arange(20, dtype=np.float32).reshape(10, 2)
+    y = np.arange(10)
+    gatherer = BatchGatherer([x, y], batch_size=3, rng=np.random.RandomState(0))
+    assert gatherer.n_batches == 3
+    for _ in range(3):
+        seen = []
+        for batch_x, batch_y in gatherer:
+            np.testing.assert_array_equal(batch_x[:, 0], 2*batch_y)
+            assert np.all(np.diff(batch_y) > 0)
+            seen.extend(batch_y)
+        # the 9 samples of the full batches, no duplicates
+        assert len(set(seen)) == 9
+    np.testing.assert_array_equal(np.sort(gatherer.order), np.arange(10))
+
+
+def test_buffers_are_reused_and_upcast():
+    x = np.arange(12, dtype=np.float16).reshape(6, 2)
+    gatherer = BatchGatherer([x], batch_size=2, dtypes=[np.float32])
+    gatherer.shuffle()
+    first = gatherer.batch(0)[0]
+    assert first.dtype == np.float32
+    assert gatherer.batch(1)[0] is first
+
+
+def test_out_of_range_order_raises():
+    x = np.zeros((5, 1))
+    gatherer = BatchGatherer([x], batch_size=2)
+    gatherer.order[0] = 5
+    try:
+        gatherer.shuffle()
+    except ValueError:
+        return
+    raise AssertionError('an index out of range should raise ValueError')
+
+
+def test_arrays_must_have_the_same_number_of_samples():
+    try:
+        BatchGatherer([np.zeros((5, 1)), np.zeros(4)], batch_size=2)
+    except ValueError:
+        return
+    raise AssertionError('arrays of different lengths should raise ValueError')
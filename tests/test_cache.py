@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from dnnwsp import cache
+from dnnwsp.cache import PreprocessCache
+
+
+def _source(tmp_path, name, content):
+    path = tmp_path/name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _compute(calls, n=10):
+    def compute():
+        calls.append(1)
+        return {'x': np.arange(n, dtype=np.float32)}
+    return compute
+
+
+def test_hit_and_miss(tmp_path):
+    source = _source(tmp_path, 'data.mat', b'abc')
+    preprocess = PreprocessCache(str(tmp_path/'cache'))
+    calls = []
+    for _ in range(3):
+        result = preprocess.load(source, {'zscore': True}, _compute(calls))
+    assert len(calls) == 1
+    assert isinstance(result['x'], np.memmap)
+    np.testing.assert_array_equal(result['x'], np.arange(10))
+
+    # other parameters, or another content of the source
+    preprocess.load(source, {'zscore': False}, _compute(calls))
+    assert len(calls) == 2
+    with open(source, 'wb') as f:
+        f.write(b'abcd')
+    preprocess.load(source, {'zscore': True}, _compute(calls))
+    assert len(calls) == 3
+    assert len(preprocess.entries()) == 3
+
+    # no temporary file or directory is left
+    assert not [name for name in os.listdir(str(tmp_path/'cache')) if '.tmp' in name]
+
+
+def test_key_depends_on_the_code_version(tmp_path, monkeypatch):
+    source = _source(tmp_path, 'data.mat', b'abc')
+    preprocess = PreprocessCache(str(tmp_path/'cache'))
+    key = preprocess.key([source], {})
+    assert preprocess.key([source], {}) == key
+    monkeypatch.setattr(cache, '_code_version', 'another version')
+    assert preprocess.key([source], {}) != key
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    sources = [_source(tmp_path, 'data%d.mat' % i, b'%d' % i) for i in range(3)]
+    preprocess = PreprocessCache(str(tmp_path/'cache'), max_bytes=float('inf'))
+    calls = []
+    for source in sources:
+        preprocess.load(source, {}, _compute(calls, 1000))
+    # the first entry is the least recently used one, whatever the resolution of the modification times
+    keys = [preprocess.key([source], {}) for source in sources]
+    for t, key in enumerate(keys):
+        os.utime(os.path.join(preprocess.cache_dir, key, cache.META_FILE), (t, t))
+
+    entry_bytes = preprocess.entries()[0][1]
+    preprocess.max_bytes = 2.5*entry_bytes
+    preprocess.evict()
+    assert sorted(key for _, _, key in preprocess.entries()) == sorted(keys[1:])
+
+    preprocess.clear()
+    assert preprocess.entries() == []
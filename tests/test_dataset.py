@@ -0,0 +1,36 @@
+import numpy as np
+import scipy.io as sio
+
+from dnnwsp.dataset import convert_mat, load_dataset, save_dataset
+
+
+def test_save_and_load(tmp_path):
+    arrays = {'train_x': np.arange(6, dtype=np.float16).reshape(2, 3), 'train_y': np.array([1, 2], dtype=np.int64)}
+    meta = save_dataset(str(tmp_path/'data'), arrays, source='test')
+    assert meta['source'] == 'test'
+    loaded = load_dataset(str(tmp_path/'data'))
+    for key, arr in arrays.items():
+        assert isinstance(loaded[key], np.memmap)
+        assert loaded[key].dtype == arr.dtype
+        np.testing.assert_array_equal(loaded[key], arr)
+
+
+def test_convert_mat(tmp_path):
+    mat_file = str(tmp_path/'data.mat')
+    sio.savemat(mat_file, {'train_x': np.ones((3, 4)), 'train_y': np.array([[0], [1], [1]], dtype=np.uint8)})
+    convert_mat(mat_file, str(tmp_path/'data'))
+    loaded = load_dataset(str(tmp_path/'data'))
+    assert loaded['train_x'].dtype == np.float32
+    assert loaded['train_y'].dtype == np.uint8
+    # a .mat file is loaded with sio.loadmat
+    np.testing.assert_array_equal(load_dataset(mat_file)['train_x'], loaded['train_x'])
+
+
+def test_mismatch_with_meta_raises(tmp_path):
+    save_dataset(str(tmp_path/'data'), {'x': np.zeros(3, dtype=np.float32)})
+    np.save(str(tmp_path/'data'/'x.npy'), np.zeros(4, dtype=np.float32))
+    try:
+        load_dataset(str(tmp_path/'data'))
+    except ValueError:
+        return
+    raise AssertionError('an array that does not match meta.json should raise ValueError')
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+import theano.tensor as T
+
+from dnnwsp.epoch_scan import scan_epoch
+
+
+def _model(x_data, y_data, batch_size):
+    floatX = theano.config.floatX
+    data_x = theano.shared(x_data.astype(floatX))
+    data_y = theano.shared(y_data.astype(floatX))
+    W = theano.shared(np.zeros((x_data.shape[1], y_data.shape[1]), dtype=floatX))
+    count = theano.shared(np.asarray(0, dtype=floatX))
+    x = T.matrix('x')
+    y = T.matrix('y')
+    lr = T.scalar('lr', dtype=floatX)
+    cost = T.mean(T.sqr(T.dot(x, W) - y))
+    updates = [(W, W - lr*T.grad(cost, W))]
+    every_updates = [(count, count + 1)]
+    return data_x, data_y, W, count, x, y, lr, cost, updates, every_updates
+
+
+def test_one_call_matches_the_minibatch_function():
+    rng = np.random.RandomState(0)
+    x_data = rng.standard_normal((12, 3))
+    y_data = rng.standard_normal((12, 2))
+    batch_size = 4
+    n_batches = 3
+
+    # one call per minibatch, the updates of every_updates every 2 minibatches
+    data_x, data_y, W, count, x, y, lr, cost, updates, every_updates = _model(x_data, y_data, batch_size)
+    index = T.lscalar('index')
+    givens = {x: data_x[index*batch_size:(index+1)*batch_size], y: data_y[index*batch_size:(index+1)*batch_size]}
+    train_model = theano.function([index, lr], cost, updates=updates, givens=givens, allow_input_downcast=True)
+    count_update = theano.function([], [], updates=every_updates)
+    costs = []
+    for epoch in range(2):
+        for i in range(n_batches):
+            costs.append(train_model(i, 0.1))
+            if (epoch*n_batches+i+1) % 2 == 0:
+                count_update()
+    expected = (np.array(costs), W.get_value(), count.get_value())
+
+    data_x, data_y, W, count, x, y, lr, cost, updates, every_updates = _model(x_data, y_data, batch_size)
+    train_epoch = scan_epoch([lr], [cost], updates, x, y, data_x, data_y, batch_size, n_batches,
+                             every_updates=every_updates, every=2, allow_input_downcast=True)
+    costs = []
+    for epoch in range(2):
+        costs.extend(train_epoch(0.1, epoch*n_batches)[0])
+
+    np.testing.assert_allclose(costs, expected[0], rtol=1e-5)
+    np.testing.assert_allclose(W.get_value(), expected[1], rtol=1e-5)
+    assert count.get_value() == expected[2] == 3
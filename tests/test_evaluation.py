@@ -0,0 +1,31 @@
+import numpy as np
+
+from dnnwsp.evaluation import RunningMean, evaluate
+
+
+def test_chunked_matches_the_whole_set():
+    rng = np.random.RandomState(0)
+    x = rng.standard_normal((103, 4))
+    y = rng.randint(0, 3, 103)
+
+    def run(x, y):
+        return [np.mean(x[:, 0] > 0), np.argmax(x, axis=1) + y]
+
+    error, predict = evaluate(run, x, y, chunk_size=10)
+    full_error, full_predict = run(x, y)
+    np.testing.assert_allclose(error, full_error)
+    np.testing.assert_array_equal(predict, full_predict)
+
+
+def test_empty_set():
+    assert evaluate(lambda x, y: [0.0], np.zeros((0, 3))) == []
+
+
+def test_running_mean():
+    mean = RunningMean()
+    assert mean.mean() == 0.0
+    mean.add(1.0, 3)
+    mean.add(3.0, 1)
+    assert mean.mean() == 1.5
+    mean.reset()
+    assert mean.count == 0
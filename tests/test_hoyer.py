@@ -0,0 +1,38 @@
+import numpy as np
+import numpy.linalg as LA
+import scipy.sparse as sp
+
+from dnnwsp.hoyer import hoyer_sparseness, l1_l2_norms
+
+
+def test_norms_match_numpy():
+    W = np.random.RandomState(0).standard_normal((3000, 7)).astype(np.float32)
+    L1, L2 = l1_l2_norms(W, axis=0, block_rows=256)
+    np.testing.assert_allclose(L1, LA.norm(W, 1, axis=0), rtol=1e-5)
+    np.testing.assert_allclose(L2, LA.norm(W, 2, axis=0), rtol=1e-5)
+
+    L1, L2 = l1_l2_norms(W, axis=None)
+    np.testing.assert_allclose(L1, LA.norm(W.ravel(), 1), rtol=1e-5)
+    np.testing.assert_allclose(L2, LA.norm(W), rtol=1e-5)
+
+
+def test_csr_matches_dense():
+    W = np.random.RandomState(1).standard_normal((500, 6)).astype(np.float32)
+    W[np.abs(W) < 1.0] = 0
+    for axis in (0, None):
+        np.testing.assert_allclose(hoyer_sparseness(sp.csr_matrix(W), axis=axis), hoyer_sparseness(W, axis=axis), rtol=1e-5)
+
+
+def test_extremes():
+    W = np.zeros((100, 2), dtype=np.float32)
+    W[3, 0] = 2.0
+    W[:, 1] = -0.5
+    np.testing.assert_allclose(hoyer_sparseness(W, axis=0), [1.0, 0.0], atol=1e-6)
+
+
+def test_axis_is_checked():
+    try:
+        l1_l2_norms(np.ones((3, 3)), axis=1)
+    except ValueError:
+        return
+    raise AssertionError('axis=1 should raise ValueError')
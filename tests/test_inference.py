@@ -0,0 +1,61 @@
+import numpy as np
+import scipy.sparse as sp
+
+from dnnwsp.hoyer import hoyer_sparseness
+from dnnwsp.inference import export_sparse, hoyer_nnz, load_sparse, magnitude_threshold, predict, sparsify
+
+
+def _network(seed=0):
+    rng = np.random.RandomState(seed)
+    weights = [rng.standard_normal((20, 8)).astype(np.float32), rng.standard_normal((8, 6)).astype(np.float32),
+               rng.standard_normal((6, 3)).astype(np.float32)]
+    # mostly zero hidden layers
+    for W in weights[:-1]:
+        W[rng.rand(*W.shape) < 0.8] = 0
+    biases = [rng.standard_normal(W.shape[1]).astype(np.float32) for W in weights]
+    return weights, biases, rng.standard_normal((50, 20)).astype(np.float32)
+
+
+def test_hoyer_nnz():
+    # k equal entries out of n, the rest zero
+    W = np.zeros((100, 1))
+    W[:9] = 1
+    np.testing.assert_allclose(hoyer_nnz(hoyer_sparseness(W, axis=0), 100), 9)
+
+
+def test_threshold_keeps_the_nonzeros_of_an_exactly_sparse_layer():
+    weights, _, _ = _network()
+    W = weights[0]
+    thre = magnitude_threshold(W, nodewise=True)
+    assert thre.shape == (W.shape[1],)
+    assert np.all(thre > 0)
+    layer_thre = magnitude_threshold(W, nodewise=False)
+    assert np.ndim(layer_thre) == 0
+
+
+def test_sparse_predict_matches_dense():
+    weights, biases, x = _network()
+    sparse_weights, _ = sparsify(weights, keep_scale=10.0)
+    assert all(sp.isspmatrix_csr(W) for W in sparse_weights[:-1])
+    # a large keep_scale keeps every nonzero weight
+    for W, S in zip(weights[:-1], sparse_weights[:-1]):
+        np.testing.assert_array_equal(S.toarray(), W)
+    np.testing.assert_array_equal(predict(sparse_weights, biases, x), predict(weights, biases, x))
+
+
+def test_export_and_load(tmp_path):
+    weights, biases, x = _network()
+    y = predict(weights, biases, x, activation='relu')
+    file_name = str(tmp_path/'model.mat')
+    report = export_sparse(file_name, weights, biases, x, y, activation='relu', keep_scale=10.0, repeat=1)
+    assert report['dense_accuracy'] == 1.0
+    assert report['accuracy_drift'] == 0.0
+    assert report['sparse_nbytes'] < report['dense_nbytes']
+
+    loaded_weights, loaded_biases, activation = load_sparse(file_name)
+    assert activation == 'relu'
+    assert all(sp.isspmatrix_csr(W) for W in loaded_weights[:-1])
+    for W, L in zip(weights, loaded_weights):
+        np.testing.assert_array_equal(L.toarray() if sp.issparse(L) else L, W)
+    for b, L in zip(biases, loaded_biases):
+        np.testing.assert_array_equal(L, b)
@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.io as sio
+
+from dnnwsp.dataset import load_dataset
+from dnnwsp.masking import apply_mask, extract_dataset, mask_index, unmask
+
+
+def _volumes(n_volumes, offset, seed=0):
+    rng = np.random.RandomState(seed)
+    return (rng.standard_normal((3, 4, 2, n_volumes)) + offset).astype(np.float32)
+
+
+def _mask():
+    mask = np.zeros((3, 4, 2), dtype=bool)
+    mask[0, 1, 0] = mask[2, 3, 1] = mask[1, 0, 1] = mask[2, 2, 0] = True
+    return mask
+
+
+def test_column_major_order():
+    mask = _mask()
+    volumes = _volumes(5, 0)
+    index = mask_index(mask)
+    features = apply_mask(volumes, index)
+    assert features.shape == (5, 4)
+    # vol(mask) of MATLAB: the voxels in column-major order
+    expected = np.stack([volumes[..., k].ravel(order='F')[mask.ravel(order='F')] for k in range(5)])
+    np.testing.assert_array_equal(features, expected)
+    np.testing.assert_array_equal(features[:, 0], volumes[0, 1, 0])
+
+
+def test_unmask_round_trip():
+    mask = _mask()
+    index = mask_index(mask)
+    volumes = _volumes(5, 0)
+    volumes[~mask] = 0
+    back = unmask(apply_mask(volumes, index).T, index, mask.shape)
+    assert back.shape == (3, 4, 2, 5)
+    np.testing.assert_array_equal(back, volumes)
+
+
+def test_extract_dataset(tmp_path):
+    mask = _mask()
+    sio.savemat(str(tmp_path/'mask.mat'), {'vMsk_3d': mask.astype(np.uint8)})
+    runs = [_volumes(5, 0, seed=1), _volumes(3, 10, seed=2)]
+    sio.savemat(str(tmp_path/'run1.mat'), {'vol': runs[0]})
+    np.save(str(tmp_path/'run2.npy'), runs[1])
+    np.save(str(tmp_path/'y1.npy'), np.arange(5))
+    sio.savemat(str(tmp_path/'y2.mat'), {'y': np.arange(3).reshape((-1, 1))})
+
+    meta = extract_dataset([str(tmp_path/'run1.mat'), str(tmp_path/'run2.npy')], str(tmp_path/'mask.mat'),
+                           str(tmp_path/'data'), label_files=[str(tmp_path/'y1.npy'), str(tmp_path/'y2.mat')], n_workers=2)
+    assert [run['start'] for run in meta['runs']['train']] == [0, 5]
+
+    data = load_dataset(str(tmp_path/'data'))
+    assert isinstance(data['train_x'], np.memmap)
+    assert data['train_x'].dtype == np.float32
+    index = mask_index(mask)
+    np.testing.assert_array_equal(data['train_x'], np.concatenate([apply_mask(run, index) for run in runs]))
+    np.testing.assert_array_equal(np.ravel(data['train_y']), [0, 1, 2, 3, 4, 0, 1, 2])
+
+    # the saved index map projects the features back into the volumes
+    back = unmask(np.asarray(data['train_x'][:5]).T, data['mask_index'], data['mask_shape'])
+    np.testing.assert_array_equal(back[mask], runs[0][mask])
+    assert np.all(back[~mask] == 0)
+
+
+def test_volumes_must_match_the_mask(tmp_path):
+    np.save(str(tmp_path/'mask.npy'), _mask())
+    np.save(str(tmp_path/'run.npy'), np.zeros((3, 4, 3, 2), dtype=np.float32))
+    try:
+        extract_dataset([str(tmp_path/'run.npy')], str(tmp_path/'mask.npy'), str(tmp_path/'data'))
+    except ValueError:
+        return
+    raise AssertionError('volumes of another shape than the mask should raise ValueError')
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'placeholder'):
+    pytest.skip('the TensorFlow 1 graph API is needed', allow_module_level=True)
+
+from dnnwsp.multistep import MultiStepLoop
+
+
+def _build(n_in, n_out, batch_size, learning_rate=0.1):
+    tf.reset_default_graph()
+    tf.set_random_seed(1234)
+    loop = MultiStepLoop(n_in, n_out, batch_size)
+    W = tf.Variable(np.zeros((n_in, n_out), dtype=np.float32))
+
+    def step_fn(x, y, epoch, batch):
+        w = W.read_value()
+        loss = tf.reduce_mean(tf.square(tf.matmul(x, w) - y))
+        update = tf.assign_sub(W, learning_rate*tf.gradients(loss, w)[0])
+        with tf.control_dependencies([update]):
+            return [tf.identity(loss), tf.cast(batch, tf.float32)]
+
+    traces = loop.build(step_fn, [tf.float32, tf.float32])
+    return loop, W, traces
+
+
+def test_one_call_matches_single_steps():
+    rng = np.random.RandomState(0)
+    x = rng.standard_normal((12, 3)).astype(np.float32)
+    y = rng.standard_normal((12, 2)).astype(np.float32)
+    loop, W, traces = _build(3, 2, batch_size=4)
+
+    results = []
+    for calls in ([7], [1]*7):
+        with tf.Session() as sess:
+            sess.run(W.initializer)
+            assert loop.start(sess, x, y) == 3
+            loss = []
+            batch = []
+            for n_steps in calls:
+                loss_steps, batch_steps = sess.run(traces, {loop.n_steps: n_steps})
+                assert len(loss_steps) == n_steps
+                loss.extend(loss_steps)
+                batch.extend(batch_steps)
+            results.append((np.array(loss), np.array(batch), sess.run(W)))
+
+    (loss, batch, weights), (single_loss, single_batch, single_weights) = results
+    np.testing.assert_array_equal(batch, [0, 1, 2, 0, 1, 2, 0])
+    np.testing.assert_array_equal(single_batch, batch)
+    np.testing.assert_allclose(single_loss, loss, rtol=1e-5)
+    np.testing.assert_allclose(single_weights, weights, rtol=1e-5)
+    # the weights were trained
+    assert np.any(weights != 0)
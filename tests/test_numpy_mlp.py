@@ -0,0 +1,170 @@
+import numpy as np
+
+from dnnwsp import numpy_mlp
+from dnnwsp.numpy_mlp import NumpyMLP
+
+
+def _data(n_nodes, batch_size, output='softmax', seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.standard_normal((batch_size, n_nodes[0]))
+    if output == 'linear':
+        y = rng.standard_normal((batch_size, n_nodes[-1]))
+    else:
+        y = rng.randint(0, n_nodes[-1], batch_size)
+    return x, y
+
+
+def _betas(n_nodes, nodewise, seed=1):
+    rng = np.random.RandomState(seed)
+    return [rng.uniform(0.01, 0.05, n if nodewise else 1) for n in n_nodes[1:-1]]
+
+
+def _cost(model, x, y, beta_list):
+    # the data cost of the model and the penalties computed here in float64
+    cost = model.gradients(x, y, beta_list, compute_penalty=False)[0]
+    for i, W in enumerate(model.W):
+        if i < model.n_layers-1:
+            L1 = np.sum(np.abs(W), axis=0) if model.flag_nodewise == 1 else np.sum(np.abs(W))
+            cost += np.sum(L1*beta_list[i])
+        cost += model.L2_reg*np.sum(W**2)
+    return cost
+
+
+def _check_gradients(activation, output, nodewise):
+    n_nodes = [6, 5, 4, 3]
+    x, y = _data(n_nodes, 7, output)
+    beta_list = _betas(n_nodes, nodewise)
+    model = NumpyMLP(n_nodes, activation, output, batch_size=7, flag_nodewise=int(nodewise), L2_reg=1e-3, dtype=np.float64)
+    model.b = [np.random.RandomState(2).standard_normal(b.shape) for b in model.b]
+    model.params = model.W+model.b
+
+    model.gradients(x, y, beta_list)
+    analytic = [np.array(g) for g in model.grads]
+    eps = 1e-6
+    for p, g in zip(model.params, analytic):
+        flat = p.ravel()
+        for j in range(0, flat.size, 3):
+            value = flat[j]
+            flat[j] = value+eps
+            plus = _cost(model, x, y, beta_list)
+            flat[j] = value-eps
+            minus = _cost(model, x, y, beta_list)
+            flat[j] = value
+            np.testing.assert_allclose((plus-minus)/(2*eps), g.ravel()[j], rtol=1e-4, atol=1e-7)
+
+
+def test_gradients_softmax_tanh_nodewise():
+    _check_gradients('tanh', 'softmax', True)
+
+
+def test_gradients_tanh_softmax_sigmoid_layerwise():
+    _check_gradients('sigmoid', 'tanh_softmax', False)
+
+
+def test_gradients_linear_tanh():
+    _check_gradients('tanh', 'linear', True)
+
+
+def test_penalty_matches_the_gradient_check_cost():
+    n_nodes = [6, 5, 4, 3]
+    x, y = _data(n_nodes, 7)
+    beta_list = _betas(n_nodes, True)
+    model = NumpyMLP(n_nodes, flag_nodewise=1, batch_size=7, dtype=np.float64)
+    with_penalty = model.gradients(x, y, beta_list)[0]
+    np.testing.assert_allclose(with_penalty, _cost(model, x, y, beta_list), rtol=1e-5)
+
+
+def _sparse_gradients(monkeypatch, sparse_products):
+    monkeypatch.setattr(numpy_mlp, 'SPARSE_DENSITY', 1.0 if sparse_products else 0.0)
+    n_nodes = [30, 8, 3]
+    x, y = _data(n_nodes, 5)
+    beta_list = _betas(n_nodes, True)
+    dense = NumpyMLP(n_nodes, flag_nodewise=1, batch_size=5, dtype=np.float64)
+    support = np.flatnonzero(np.random.RandomState(3).rand(30*8) < 0.3)
+    dense.W[0].ravel()[np.setdiff1d(np.arange(30*8), support)] = 0
+
+    model = NumpyMLP(n_nodes, flag_nodewise=1, batch_size=5, dtype=np.float64,
+                     init_params=list(zip(dense.W, dense.b)))
+    model.sparsify_layer(0, support=support)
+    assert model._sparse_products[0] == sparse_products
+    np.testing.assert_allclose(model.density(0), support.size/240.0)
+
+    dense_scores = dense.gradients(x, y, beta_list)
+    scores = model.gradients(x, y, beta_list)
+    np.testing.assert_allclose(scores, dense_scores)
+    np.testing.assert_allclose(model.grads[0], dense.grads[0].ravel()[support])
+    for g, dense_g in zip(model.grads[1:], dense.grads[1:]):
+        np.testing.assert_allclose(g, dense_g)
+
+    # the update changes the surviving weights only, and copies them into the dense W
+    model.update(0.1)
+    assert np.all(model.W[0].ravel()[np.setdiff1d(np.arange(240), support)] == 0)
+    np.testing.assert_array_equal(model.W[0].ravel()[support], model.params[0])
+    assert np.any(model.params[0] != dense.W[0].ravel()[support])
+
+
+def test_sparse_layer_dense_products(monkeypatch):
+    _sparse_gradients(monkeypatch, False)
+
+
+def test_sparse_layer_sparse_products(monkeypatch):
+    _sparse_gradients(monkeypatch, True)
+
+
+def test_training_reduces_the_cost():
+    n_nodes = [10, 8, 3]
+    x, y = _data(n_nodes, 20)
+    beta_list = [np.zeros(8)]
+    for algorithm in ('Grad', 'Adam', 'Rmsp'):
+        model = NumpyMLP(n_nodes, batch_size=20, optimizer_algorithm=algorithm, flag_nodewise=1)
+        first = model.train_step(x, y, beta_list, 1e-2, momentum=0.5)[0]
+        for _ in range(50):
+            last = model.train_step(x, y, beta_list, 1e-2, momentum=0.5)[0]
+        assert last < first, algorithm
+
+
+def test_shared_params_without_optimizer_state():
+    n_nodes = [4, 3, 2]
+    init = NumpyMLP(n_nodes)
+    init_params = list(zip(init.W, init.b))
+    model = NumpyMLP(n_nodes, batch_size=3, init_params=init_params, share_params=True, optimizer_state=False)
+    assert all(W is shared for W, (shared, _) in zip(model.W, init_params))
+    assert not any(name.startswith('state') for name in model.arrays())
+
+    x, y = _data(n_nodes, 3)
+    model.gradients(x, y, [np.zeros(1)])
+    try:
+        model.update(0.1)
+    except ValueError:
+        return
+    raise AssertionError('update without optimizer state should raise ValueError')
+
+
+def test_arguments_are_checked():
+    for kwargs in [dict(activation='elu'), dict(output='sigmoid'), dict(optimizer_algorithm='Sgd')]:
+        try:
+            NumpyMLP([4, 3, 2], **kwargs)
+        except ValueError:
+            continue
+        raise AssertionError('%r should raise ValueError' % (kwargs,))
+
+
+def test_regrow_keeps_the_density_bounded():
+    n_nodes = [40, 10, 3]
+    x, y = _data(n_nodes, 8)
+    # no L1 penalty: every pruned weight with a gradient is a candidate for regrowth
+    beta_list = [np.zeros(10)]
+    model = NumpyMLP(n_nodes, batch_size=8, flag_nodewise=1, dtype=np.float64)
+    model.sparsify_layer(0, keep_scale=0.5)
+    density = model.density(0)
+    assert density < 1.0
+
+    total_added = 0
+    for _ in range(10):
+        for _ in range(5):
+            model.train_step(x, y, beta_list, 0.5)
+        n_added, n_dropped = model.regrow(0, x, y, beta_list, keep_scale=0.5)
+        assert n_added <= n_dropped
+        assert model.density(0) <= density
+        total_added += n_added
+    assert total_added > 0
@@ -0,0 +1,54 @@
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from dnnwsp.numpy_mlp import NumpyMLP
+from dnnwsp.parallel import DataParallelMLP
+
+
+def _data(n_samples=24, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.standard_normal((n_samples, 12)).astype(np.float32), rng.randint(0, 3, n_samples)
+
+
+def test_step_matches_a_single_process():
+    n_nodes = [12, 6, 3]
+    x, y = _data()
+    beta_list = [np.full(6, 0.01)]
+    model = NumpyMLP(n_nodes, batch_size=8, flag_nodewise=1)
+    trainer = DataParallelMLP(3, n_nodes, batch_size=8, flag_nodewise=1)
+    try:
+        assert trainer.start(x, y, [6]) == 3
+        for batch in range(3):
+            scores = trainer.step(batch, beta_list, 0.1, momentum=0.5)
+            expected = model.train_step(x[batch*8:(batch+1)*8], y[batch*8:(batch+1)*8], beta_list, 0.1, momentum=0.5)
+            np.testing.assert_allclose(scores, expected, rtol=1e-5)
+        for W, expected in zip(trainer.W+trainer.b, model.W+model.b):
+            np.testing.assert_allclose(W, expected, rtol=1e-5, atol=1e-6)
+    finally:
+        trainer.close()
+
+
+def test_failing_worker_breaks_the_step():
+    n_nodes = [12, 6, 3]
+    x, y = _data()
+    # a label out of range fails in the worker of the first shard
+    y[0] = 7
+    trainer = DataParallelMLP(2, n_nodes, batch_size=8, timeout=30.0)
+    trainer.start(x, y, [1])
+    try:
+        trainer.step(0, [np.zeros(1)], 0.1)
+    except BrokenBarrierError:
+        assert trainer._workers == []
+        return
+    finally:
+        trainer.close()
+    raise AssertionError('the step should raise BrokenBarrierError')
+
+
+def test_number_of_workers_is_checked():
+    try:
+        DataParallelMLP(9, [4, 2], batch_size=8)
+    except ValueError:
+        return
+    raise AssertionError('more workers than samples should raise ValueError')
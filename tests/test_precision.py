@@ -0,0 +1,50 @@
+import numpy as np
+
+from dnnwsp.precision import PrecisionPolicy, dtype_of
+
+
+def test_store_and_compute_dtypes():
+    policy = PrecisionPolicy('float16')
+    x = np.arange(6, dtype=np.float64).reshape(2, 3)
+    stored = policy.store(x)
+    assert stored.dtype == np.float16
+    assert policy.store(stored) is stored
+    assert policy.compute(stored).dtype == np.float32
+
+    out = np.empty((2, 3), dtype=np.float32)
+    assert policy.compute(stored, out=out) is out
+    np.testing.assert_array_equal(out, x)
+
+    policy = PrecisionPolicy('float32')
+    assert policy.storage_dtype == policy.compute_dtype == np.float32
+    assert PrecisionPolicy('float64').compute(stored).dtype == np.float64
+
+
+def test_mismatches_and_audit():
+    policy = PrecisionPolicy('float16')
+    inputs = {'train_x': np.zeros(2, dtype=np.float16), 'test_x': np.zeros(2, dtype=np.float32)}
+    arrays = dict(W=np.zeros(2, dtype=np.float32), beta=np.zeros(2, dtype=np.float64), labels=np.zeros(2, dtype=np.int64))
+    assert policy.mismatches(inputs, **arrays) == ['test_x (float32)', 'beta (float64)']
+
+    policy.audit('clean', {'train_x': inputs['train_x']}, W=arrays['W'], labels=arrays['labels'])
+    try:
+        policy.audit('load', inputs, **arrays)
+    except ValueError as e:
+        assert 'load' in str(e) and 'test_x (float32)' in str(e) and 'beta (float64)' in str(e)
+        return
+    raise AssertionError('an array in another dtype should fail the audit')
+
+
+def test_dtype_of():
+    assert dtype_of(np.zeros(2, dtype=np.float16)) == np.float16
+    assert dtype_of([1.0, 2.0]) == np.float64
+    assert dtype_of(np.float32(1)) == np.float32
+
+
+def test_unknown_policy_is_rejected():
+    for name in ('bfloat16', 'float', None):
+        try:
+            PrecisionPolicy(name)
+        except ValueError:
+            continue
+        raise AssertionError('precision=%r should raise ValueError' % (name,))
@@ -0,0 +1,23 @@
+import numpy as np
+
+from dnnwsp.prepare import check_float32, one_hot, prepare_classification, to_float32
+
+
+def test_one_hot():
+    y = one_hot(np.array([[2], [0], [1]]))
+    np.testing.assert_array_equal(y, [[0, 0, 1], [1, 0, 0], [0, 1, 0]])
+    assert y.dtype == np.float32
+    assert one_hot([0, 1], n_classes=4).shape == (2, 4)
+
+
+def test_prepare_classification():
+    datasets = {'train_x': np.ones((2, 3)), 'train_y': np.array([0, 1]), 'test_x': np.ones((1, 3), dtype=np.float32)}
+    prepared = prepare_classification(datasets, n_classes=2)
+    assert sorted(prepared) == ['test_x', 'train_x', 'train_y']
+    assert check_float32(**prepared) == []
+    assert check_float32(x=np.ones(2)) == ['x']
+
+
+def test_to_float32_does_not_copy():
+    x = np.ones(3, dtype=np.float32)
+    assert to_float32(x) is x
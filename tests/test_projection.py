@@ -0,0 +1,57 @@
+import numpy as np
+
+from dnnwsp.projection import InputProjection
+
+
+def _samples(seed=0):
+    rng = np.random.RandomState(seed)
+    # rank 5 samples plus a little noise, offset from zero
+    return (np.dot(rng.standard_normal((40, 5)), rng.standard_normal((5, 300))) + 0.01*rng.standard_normal((40, 300)) + 3.0).astype(np.float32)
+
+
+def test_pca_matches_the_svd():
+    x = _samples()
+    projection = InputProjection('pca', n_components=5).fit(x)
+    xc = x.astype(np.float64) - x.mean(axis=0)
+    _, s, Vt = np.linalg.svd(xc, full_matrices=False)
+    # the same components up to their sign
+    np.testing.assert_allclose(np.abs(np.dot(Vt[:5], projection.components)), np.eye(5), atol=1e-3)
+    np.testing.assert_allclose(np.linalg.norm(projection.transform(x), axis=0), s[:5], rtol=1e-3)
+
+
+def test_randomized_svd_matches_pca():
+    x = _samples()
+    pca = InputProjection('pca', n_components=5).fit(x)
+    randomized = InputProjection('randomized_svd', n_components=5).fit(x)
+    np.testing.assert_allclose(np.abs(np.dot(pca.components.T, randomized.components)), np.eye(5), atol=1e-3)
+
+
+def test_voxel_weights_give_the_same_output():
+    x = _samples()
+    rng = np.random.RandomState(1)
+    W = rng.standard_normal((5, 3)).astype(np.float32)
+    b = rng.standard_normal(3).astype(np.float32)
+    for method in ('pca', 'sparse_random'):
+        projection = InputProjection(method, n_components=5).fit(x)
+        projected = np.dot(projection.transform(x), W) + b
+        voxel = np.dot(x, projection.voxel_weights(W)) + projection.voxel_bias(W, b)
+        np.testing.assert_allclose(voxel, projected, rtol=1e-3, atol=1e-2)
+
+
+def test_arrays_round_trip():
+    x = _samples()
+    for method in ('pca', 'sparse_random'):
+        projection = InputProjection(method, n_components=5).fit(x)
+        loaded = InputProjection(method, n_components=1).set_arrays(projection.arrays())
+        assert loaded.n_components == 5
+        np.testing.assert_array_equal(loaded.transform(x), projection.transform(x))
+
+
+def test_arguments_are_checked():
+    for args, x in [(('svd', 5), None), (('pca', 0), None), (('pca', 50), _samples())]:
+        try:
+            projection = InputProjection(*args)
+            projection.fit(x)
+        except ValueError:
+            continue
+        raise AssertionError('%r should raise ValueError' % (args,))
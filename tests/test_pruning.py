@@ -0,0 +1,62 @@
+import numpy as np
+
+from dnnwsp.pruning import exact_masks, find_dead_nodes, prune_nodes, shrink_network
+
+
+def _output(weights, biases, x):
+    h = x
+    for W, b in zip(weights[:-1], biases[:-1]):
+        h = np.tanh(np.dot(h, W) + b)
+    return np.dot(h, weights[-1]) + biases[-1]
+
+
+def _network(seed=0):
+    rng = np.random.RandomState(seed)
+    weights = [rng.standard_normal((10, 6)), rng.standard_normal((6, 4)), rng.standard_normal((4, 3))]
+    biases = [rng.standard_normal(W.shape[1]) for W in weights]
+    return weights, biases, rng.standard_normal((30, 10))
+
+
+def test_fold_is_exact_for_a_zero_column():
+    weights, biases, x = _network()
+    weights[0][:, 2] = 0
+    dead = [np.array([False, False, True, False, False, False]), np.zeros(4, dtype=bool)]
+    assert exact_masks(weights, dead) == [True, True]
+
+    new_weights, new_biases = prune_nodes(weights, biases, dead)
+    assert new_weights[0].shape == (10, 5)
+    assert new_weights[1].shape == (5, 4)
+    np.testing.assert_allclose(_output(new_weights, new_biases, x), _output(weights, biases, x), atol=1e-12)
+
+
+def test_nonzero_column_is_approximate():
+    weights, biases, _ = _network()
+    weights[0][:, 2] *= 1e-4
+    dead = [np.array([False, False, True, False, False, False]), np.zeros(4, dtype=bool)]
+    assert exact_masks(weights, dead) == [False, True]
+
+
+def test_find_dead_nodes():
+    weights, _, _ = _network()
+    weights[0][:, 1] = 0
+    dead = find_dead_nodes(weights[0], weights[1])
+    np.testing.assert_array_equal(np.flatnonzero(dead), [1])
+    # a Hoyer's sparseness trace near 1 marks the node dead too
+    hsp_trace = np.zeros((20, 6))
+    hsp_trace[:, 4] = 0.99
+    np.testing.assert_array_equal(np.flatnonzero(find_dead_nodes(weights[0], weights[1], hsp_trace)), [1, 4])
+    # at least one node is kept
+    assert not np.all(find_dead_nodes(weights[0], weights[1], np.ones((20, 6))))
+
+
+def test_shrink_network_report():
+    weights, biases, x = _network()
+    weights[0][:, 3] = 0
+    weights[1][:, 0] = 0
+    y = np.argmax(_output(weights, biases, x), axis=1)
+    new_weights, _, report = shrink_network(weights, biases, x, y)
+    assert report['dead_nodes'] == [1, 1]
+    assert report['exact'] == [True, True]
+    assert report['pruned_n_nodes'] == [10, 5, 3, 3]
+    assert report['pruned_n_params'] < report['n_params']
+    assert report['pruned_accuracy'] == report['accuracy'] == 1.0
@@ -0,0 +1,96 @@
+import threading
+
+from dnnwsp.schedule import HspSchedule
+
+
+def test_due_every_k_minibatches_and_every_epoch():
+    schedule = HspSchedule(every=3)
+    due = [schedule.due(batch % 4, 4) for batch in range(8)]
+    assert due == [False, False, True, False, False, True, False, False]
+
+    schedule = HspSchedule(every='epoch')
+    due = [schedule.due(batch % 4, 4) for batch in range(8)]
+    assert due == [False, False, False, True, False, False, False, True]
+
+
+def test_every_is_checked():
+    for every in (0, 1.5, -2):
+        try:
+            HspSchedule(every=every)
+        except ValueError:
+            continue
+        raise AssertionError('every=%r should raise ValueError' % (every,))
+
+
+def test_synchronous_run_returns_at_once():
+    schedule = HspSchedule()
+    assert schedule.run(lambda a, b: a+b, 1, 2) == 3
+    assert schedule.lag_summary() == (0.0, 0)
+
+
+def test_asynchronous_run_skips_while_a_job_is_running():
+    schedule = HspSchedule(asynchronous=True)
+    release = threading.Event()
+    calls = []
+
+    def control(value):
+        calls.append(value)
+        release.wait(10)
+        return value
+
+    try:
+        schedule.due(0, 10)
+        assert schedule.run(control, 1) is None
+        # the first job is still running: the next snapshots are skipped
+        for value in (2, 3):
+            schedule.due(0, 10)
+            assert schedule.run(control, value) is None
+        assert schedule.poll() is None
+
+        release.set()
+        assert schedule.wait() == 1
+        assert calls == [1]
+        # nothing left to wait for
+        assert schedule.wait() is None
+        assert schedule.poll() is None
+    finally:
+        release.set()
+        schedule.close()
+
+
+def test_poll_returns_the_finished_job_before_starting_the_next():
+    schedule = HspSchedule(asynchronous=True)
+    try:
+        schedule.due(0, 10)
+        assert schedule.run(lambda value: value, 'first') is None
+        schedule._job.result()
+        for _ in range(2):
+            schedule.due(0, 10)
+        # the result of the first job (lagging 2 minibatches), and the second job starts
+        assert schedule.run(lambda value: value, 'second') == 'first'
+        assert schedule.wait() == 'second'
+        assert schedule.lag_summary() == (1.0, 2)
+        # the lags are cleared by lag_summary
+        assert schedule.lag_summary() == (0.0, 0)
+    finally:
+        schedule.close()
+
+
+def test_reset_and_close():
+    schedule = HspSchedule(asynchronous=True)
+    release = threading.Event()
+    schedule.due(0, 10)
+    schedule.run(lambda: release.wait(10))
+    threading.Timer(0.05, release.set).start()
+    # reset waits for the running job and drops its result
+    schedule.reset()
+    assert schedule.step == 0
+    assert schedule.poll() is None and schedule.wait() is None
+    assert schedule.lag_summary() == (0.0, 0)
+
+    schedule.close()
+    try:
+        schedule.run(lambda: None)
+    except RuntimeError:
+        return
+    raise AssertionError('a closed schedule should not start a job')
@@ -0,0 +1,32 @@
+import numpy as np
+
+from dnnwsp.sparsity import SparsityControl
+
+
+def test_beta_moves_towards_target_and_is_clipped():
+    control = SparsityControl([3, 2], tg_hsp=[0.5, 0.5], max_beta=[0.02, 0.05], beta_lrate=0.01)
+    # too dense: beta grows, up to max_beta
+    for _ in range(10):
+        control.apply(np.zeros(5))
+    np.testing.assert_allclose(control.beta, [0.02, 0.02, 0.02, 0.05, 0.05])
+    # too sparse: beta shrinks, down to zero
+    for _ in range(10):
+        control.apply(np.ones(5))
+    np.testing.assert_array_equal(control.beta, 0)
+
+
+def test_layer_views_share_the_buffer():
+    control = SparsityControl([3, 2], tg_hsp=[0.5, 0.5], max_beta=[1, 1], beta_lrate=0.1)
+    control.apply(np.array([0, 0, 1, 1, 0]))
+    np.testing.assert_allclose(control.layer_beta[0], [0.1, 0.1, 0])
+    np.testing.assert_allclose(control.layer_beta[1], [0, 0.1])
+    np.testing.assert_array_equal(control.layer_hsp[1], [1, 0])
+
+
+def test_layerwise_control_has_one_beta_per_layer():
+    control = SparsityControl([4, 3], tg_hsp=[0.9, 0.1], max_beta=[1, 1], beta_lrate=0.1, nodewise=False)
+    W = [np.random.RandomState(0).standard_normal((10, n)) for n in (4, 3)]
+    control.update(W)
+    assert control.sizes == [1, 1]
+    # gaussian weights are around 0.2 sparse: too dense for 0.9, too sparse for 0.1
+    np.testing.assert_allclose(control.beta, [0.1, 0])
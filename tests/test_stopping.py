@@ -0,0 +1,63 @@
+import numpy as np
+
+from dnnwsp.stopping import EarlyStopping
+
+
+def test_stops_after_patience_epochs_without_improvement():
+    stopping = EarlyStopping(patience=3)
+    values = [5, 4, 3, 3.5, 3.2, 3.1, 2.0]
+    stopped = [stopping.update(v, params=lambda: [np.array(v)]) for v in values[:6]]
+    assert stopped == [False, False, False, False, False, True]
+    assert stopping.best_epoch == 3
+    assert stopping.best_value == 3
+    np.testing.assert_array_equal(stopping.best_params, [3])
+
+
+def test_min_delta():
+    stopping = EarlyStopping(patience=2, min_delta=0.5)
+    assert not stopping.update(1.0)
+    assert not stopping.update(0.8)
+    assert stopping.update(0.7)
+    assert stopping.best_epoch == 1
+
+
+def test_counts_only_once_the_sparsity_has_converged():
+    stopping = EarlyStopping(patience=2, tg_hsp=[0.5], hsp_tol=0.05, beta_tol=None)
+    # the value gets worse, but Hoyer's sparseness is still far from its target
+    for epoch in range(5):
+        assert not stopping.update(float(epoch), hsp=[np.array([0.1])])
+    assert stopping.converged_epoch == 0
+    assert not stopping.update(10.0, hsp=[np.array([0.52])])
+    assert stopping.converged_epoch == 6
+    # converged is sticky
+    assert not stopping.update(11.0, hsp=[np.array([0.1])])
+    assert stopping.update(12.0, hsp=[np.array([0.1])])
+    assert stopping.best_epoch == 6
+
+
+def test_waits_for_a_steady_beta():
+    stopping = EarlyStopping(patience=1, tg_hsp=[0.5], beta_tol=0.01, window=2)
+    hsp = [np.array([0.5])]
+    # beta still rising by 0.1 per epoch
+    for epoch in range(6):
+        assert not stopping.update(1.0, hsp, beta=[np.array([0.1*epoch])])
+    assert stopping.converged_epoch == 0
+    for epoch in range(4):
+        stopping.update(1.0, hsp, beta=[np.array([0.6])])
+    assert stopping.converged_epoch > 0
+
+
+def test_reset():
+    stopping = EarlyStopping(patience=1, tg_hsp=[0.5])
+    stopping.update(1.0, hsp=[np.array([0.5])], params=lambda: [np.ones(2)])
+    stopping.reset(tg_hsp=[0.7])
+    assert stopping.epoch == 0 and stopping.best_params is None and stopping.tg_hsp == [0.7]
+    assert np.isinf(stopping.best_value)
+
+
+def test_patience_is_checked():
+    try:
+        EarlyStopping(patience=0)
+    except ValueError:
+        return
+    raise AssertionError('patience=0 should raise ValueError')
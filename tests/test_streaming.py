@@ -0,0 +1,53 @@
+import numpy as np
+
+from dnnwsp.streaming import ShardStream, write_shards
+
+
+def _subjects(sizes):
+    # the first feature of a sample is its index, the label is the index modulo 3
+    start = 0
+    for n in sizes:
+        ids = np.arange(start, start+n)
+        yield np.stack([ids, -ids], axis=1), ids % 3
+        start += n
+
+
+def test_write_shards(tmp_path):
+    meta = write_shards(str(tmp_path), _subjects([7, 13, 4]), shard_size=5)
+    assert meta['n_samples'] == 24 and meta['n_features'] == 2
+    assert [shard['n_samples'] for shard in meta['shards']] == [5, 5, 5, 5, 4]
+    x = np.concatenate([np.load(str(tmp_path/shard['x'])) for shard in meta['shards']])
+    assert x.dtype == np.float32
+    np.testing.assert_array_equal(x[:, 0], np.arange(24))
+
+
+def test_every_sample_once_per_epoch_in_a_new_order(tmp_path):
+    write_shards(str(tmp_path), _subjects([7, 13, 4]), shard_size=5)
+    stream = ShardStream(str(tmp_path), batch_size=4, buffer_size=8, rng=np.random.RandomState(0))
+    assert stream.n_batches == 6
+
+    epochs = []
+    for _ in range(2):
+        seen = []
+        for x, y in stream:
+            assert x.shape == (4, 2)
+            np.testing.assert_array_equal(y, x[:, 0].astype(int) % 3)
+            seen.extend(x[:, 0].astype(int))
+        assert sorted(seen) == list(range(24))
+        epochs.append(seen)
+    assert epochs[0] != epochs[1]
+
+
+def test_one_hot_labels(tmp_path):
+    write_shards(str(tmp_path), _subjects([6]), shard_size=3)
+    x, y = next(iter(ShardStream(str(tmp_path), batch_size=2, n_classes=3)))
+    assert y.shape == (2, 3) and y.dtype == np.float32
+    np.testing.assert_array_equal(np.argmax(y, axis=1), x[:, 0].astype(int) % 3)
+
+
+def test_mismatched_subjects_raise(tmp_path):
+    try:
+        write_shards(str(tmp_path), [(np.zeros((3, 2)), np.zeros(2))])
+    except ValueError:
+        return
+    raise AssertionError('samples and labels of different lengths should raise ValueError')